@@ -1,4 +1,5 @@
-from typing import Literal
+from datetime import datetime
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 class Flashcard(BaseModel):
@@ -13,13 +14,29 @@ class ConceptMapInput(BaseModel):
 
 # New request model for the concept map image endpoint
 class ConceptMapRequest(BaseModel):
-    """Request body for generating a concept map image."""
-    text: str
+    """Request body for generating a concept map image.
+
+    Send either the source ``text`` or a ``concept_map`` already returned by
+    ``/study-mode``, which skips parsing.
+    """
+    text: Optional[str] = None
+    concept_map: Optional[dict] = None
+    fmt: Literal['png', 'svg'] = 'png'
 
 class ReviewInput(BaseModel):
     """Feedback provided when reviewing a flashcard."""
     feedback: str = Field(..., example="easy")
 
+class BatchReviewItem(BaseModel):
+    """A single review recorded by the client, possibly while offline."""
+    card_id: str = Field(..., example="3f1c2b6e-0d7a-4c1e-9a5b-2e8f0c4d7a91")
+    feedback: str = Field(..., example="easy")
+    reviewed_at: Optional[datetime] = Field(None, example="2024-05-01T09:30:00Z")
+
+class BatchReviewInput(BaseModel):
+    """Reviews to apply together, e.g. after an offline study session."""
+    reviews: List[BatchReviewItem]
+
 class ExportInput(BaseModel):
     """Parameters for exporting generated content."""
     content: str = Field(..., example="# Title\nSome markdown content")
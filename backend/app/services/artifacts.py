@@ -0,0 +1,84 @@
+"""Content-addressed store for the expensive products of an upload.
+
+Extracted document text, transcripts, per-chunk summaries and finished
+courses are stored in a size-bounded SQLite file keyed by the SHA-256 of
+their input, so re-uploading a known file skips PyMuPDF, OCR, ffmpeg,
+Whisper and the LLM, and an edited document only re-summarises the chunks
+whose text changed.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Optional
+
+from app.utils.cache import SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+# The store is only kept when ARTIFACTS_PATH is set
+ARTIFACTS_PATH = os.getenv("ARTIFACTS_PATH", "")
+ARTIFACTS_MAX_BYTES = int(os.getenv("ARTIFACTS_MAX_BYTES", str(512 * 1024 * 1024)))
+ARTIFACTS_TTL = float(os.getenv("ARTIFACTS_TTL", str(30 * 24 * 3600)))
+# Bump to invalidate stored artifacts when the way they are produced changes
+ARTIFACTS_VERSION = "1"
+
+TEXT, TRANSCRIPT, SUMMARY, COURSE = "text", "transcript", "summary", "course"
+CHUNKS = "chunks"
+
+_store: Optional[SQLiteCache] = None
+_store_lock = threading.Lock()
+
+
+def _get_store() -> Optional[SQLiteCache]:
+    global _store
+    if not ARTIFACTS_PATH:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteCache(
+                    ARTIFACTS_PATH, max_bytes=ARTIFACTS_MAX_BYTES, ttl=ARTIFACTS_TTL
+                )
+    return _store
+
+
+def digest_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _key(kind: str, digest: str, variant: str) -> str:
+    return f"{kind}:{ARTIFACTS_VERSION}:{variant}:{digest}"
+
+
+def get(kind: str, digest: str, variant: str = "") -> Optional[Any]:
+    """Return the stored artifact, or ``None``.
+
+    ``variant`` separates artifacts of the same input produced with
+    different settings (e.g. OCR language or summary prompt).
+    """
+    store = _get_store()
+    if store is None:
+        return None
+    try:
+        value = store.get(_key(kind, digest, variant))
+    except Exception as exc:
+        logger.warning("Artifact store read failed: %s", exc)
+        return None
+    return None if value is None else json.loads(value)
+
+
+def put(kind: str, digest: str, value: Any, variant: str = "") -> None:
+    store = _get_store()
+    if store is None:
+        return
+    try:
+        store.set(_key(kind, digest, variant), json.dumps(value).encode("utf-8"))
+    except Exception as exc:
+        logger.warning("Artifact store write failed: %s", exc)
+
+
+def stats() -> dict:
+    store = _get_store()
+    return store.stats() if store is not None else {"enabled": False}
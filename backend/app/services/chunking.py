@@ -0,0 +1,264 @@
+"""Structure-aware chunking of extracted documents.
+
+A :class:`Document` describes the extracted text as headings and paragraphs
+(character offsets into the text, plus their page). Chunks are packed from
+whole blocks up to a token budget, start at headings where they can, and
+only cut a paragraph when it alone exceeds the budget. The resulting chunk
+index (offsets, pages, section, token count) is stored in the artifact
+store, so anything that works on the same text can reuse it.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from app.services import artifacts
+from app.utils import tokens
+
+HEADING, PARAGRAPH = "heading", "paragraph"
+
+# PDF blocks set this much larger than the body text are headings
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 150
+HEADING_MAX_LEVEL = 3
+
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+_MARKDOWN_HEADING = re.compile(r"#{1,6}(?=\s+\S)")
+_NUMBERED_HEADING = re.compile(r"(\d{1,2}(?:\.\d{1,2})*)\.?\s+[^\W\d]")
+_NAMED_HEADING = re.compile(
+    r"(chapter|section|unit|part|cap[ií]tulo|secci[oó]n|unidad|parte|tema)"
+    r"\s+(\d+|[ivxlc]+)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Block:
+    """A heading or paragraph: ``text[start:end]`` of its :class:`Document`."""
+
+    kind: str
+    start: int
+    end: int
+    page: Optional[int] = None
+    level: int = 0
+
+
+@dataclass
+class Document:
+    text: str
+    blocks: List[Block]
+
+    def block_text(self, block: Block) -> str:
+        return self.text[block.start:block.end]
+
+    def headings(self) -> List[Block]:
+        return [block for block in self.blocks if block.kind == HEADING]
+
+
+def heading_level(line: str) -> int:
+    """Level of a heading-looking line of plain text, or 0 for body text."""
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_CHARS or line[-1] in ".,;:":
+        return 0
+    match = _MARKDOWN_HEADING.match(line)
+    if match:
+        return min(len(match.group()), HEADING_MAX_LEVEL)
+    match = _NUMBERED_HEADING.match(line)
+    if match and len(line) <= 80:
+        return min(match.group(1).count(".") + 1, HEADING_MAX_LEVEL)
+    if _NAMED_HEADING.match(line) and len(line) <= 80:
+        return 1
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 3 and line.isupper() and len(line) <= 80:
+        return 1
+    return 0
+
+
+def _strip(text: str, start: int, end: int):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _text_blocks(text: str, start: int, end: int, page: Optional[int]) -> List[Block]:
+    """Split ``text[start:end]`` at blank lines; a heading-like first line is its own block."""
+    blocks = []
+    edges = [start]
+    for match in _PARAGRAPH_BREAK.finditer(text, start, end):
+        edges.extend((match.start(), match.end()))
+    edges.append(end)
+    for a, b in zip(edges[::2], edges[1::2]):
+        a, b = _strip(text, a, b)
+        if a == b:
+            continue
+        newline = text.find("\n", a, b)
+        first_end = b if newline < 0 else newline
+        level = heading_level(text[a:first_end])
+        if level:
+            blocks.append(Block(HEADING, *_strip(text, a, first_end), page, level))
+            a, b = _strip(text, first_end, b)
+            if a == b:
+                continue
+        blocks.append(Block(PARAGRAPH, a, b, page))
+    return blocks
+
+
+def document_from_text(text: str) -> Document:
+    """Document model of plain text: paragraphs separated by blank lines."""
+    return Document(text, _text_blocks(text, 0, len(text), None))
+
+
+def document_from_pages(text: str, pages: Sequence[Dict]) -> Document:
+    """Document model of a PDF from the entries of ``extract_pdf_pages``.
+
+    ``text`` is the pages' text joined together (possibly truncated). Pages
+    with PyMuPDF block metadata get headings from font sizes: blocks set
+    ``HEADING_SIZE_RATIO`` larger than the body text, ranked by size. OCR'd
+    pages and entries without blocks are split like plain text.
+    """
+    sizes = Counter()
+    for entry in pages:
+        for block in entry.get("blocks") or ():
+            sizes[block["size"]] += block["end"] - block["start"]
+    body = sizes.most_common(1)[0][0] if sizes else 0
+    heading_sizes = sorted(
+        (size for size in sizes if body and size >= body * HEADING_SIZE_RATIO),
+        reverse=True,
+    )
+
+    blocks: List[Block] = []
+    base = 0
+    for entry in pages:
+        if base >= len(text):
+            break
+        page_end = min(base + len(entry["text"]), len(text))
+        if not entry.get("blocks"):
+            blocks.extend(_text_blocks(text, base, page_end, entry.get("page")))
+        for meta in entry.get("blocks") or ():
+            start, end = _strip(text, base + meta["start"], min(base + meta["end"], page_end))
+            if start >= end:
+                continue
+            block_text = text[start:end]
+            level = 0
+            if meta["size"] in heading_sizes and len(block_text) <= HEADING_MAX_CHARS:
+                level = min(heading_sizes.index(meta["size"]) + 1, HEADING_MAX_LEVEL)
+            elif "\n" not in block_text:
+                level = heading_level(block_text)
+            kind = HEADING if level else PARAGRAPH
+            blocks.append(Block(kind, start, end, entry.get("page"), level))
+        base += len(entry["text"])
+    return Document(text, blocks)
+
+
+def build_document(text: str, pages: Optional[Sequence[Dict]] = None) -> Document:
+    return document_from_pages(text, pages) if pages else document_from_text(text)
+
+
+def chunk_document(doc: Document, max_tokens: int, model: Optional[str] = None) -> List[Dict]:
+    """Pack the blocks of ``doc`` into chunks of at most ``max_tokens`` tokens.
+
+    A heading starts a new chunk once the current one is at least
+    ``tokens.CHUNK_MIN_FILL`` full, and a chunk never ends with a heading.
+    Paragraphs over the budget are split with :func:`tokens.split_offsets`.
+    The text is encoded once; block sizes and splits come from the token
+    offsets.
+    """
+    tokenizer = tokens.get_tokenizer(model)
+    starts = tokenizer.offsets(doc.text, tokenizer.encode(doc.text))
+
+    def size(start: int, end: int) -> int:
+        return bisect_left(starts, end) - max(bisect_right(starts, start) - 1, 0)
+
+    # Heading path each block falls under, e.g. "2 Cells > 2.1 Membranes"
+    sections: Dict[int, str] = {}
+    outline: List[str] = []
+    for block in doc.blocks:
+        if block.kind == HEADING:
+            outline = outline[: block.level - 1] + [doc.block_text(block)]
+        sections[block.start] = " > ".join(outline)
+
+    chunks: List[Dict] = []
+    current: List[Block] = []
+
+    def flush(blocks: List[Block], section: Optional[str] = None) -> None:
+        if not blocks:
+            return
+        start, end = blocks[0].start, blocks[-1].end
+        page_numbers = [block.page for block in blocks if block.page is not None]
+        chunks.append({
+            "start": start,
+            "end": end,
+            "tokens": size(start, end),
+            "pages": [page_numbers[0], page_numbers[-1]] if page_numbers else None,
+            "section": sections[start] if section is None else section,
+        })
+
+    for block in doc.blocks:
+        if current:
+            full = size(current[0].start, block.end) > max_tokens
+            new_section = (
+                block.kind == HEADING
+                and size(current[0].start, current[-1].end) >= max_tokens * tokens.CHUNK_MIN_FILL
+            )
+            if full or new_section:
+                # Keep trailing headings with the text they introduce
+                carried = []
+                while current and current[-1].kind == HEADING:
+                    carried.insert(0, current.pop())
+                flush(current)
+                current = carried
+                if current and size(current[0].start, block.end) > max_tokens:
+                    flush(current)
+                    current = []
+
+        if size(block.start, block.end) > max_tokens:
+            flush(current)
+            current = []
+            piece_text = doc.block_text(block)
+            # The document's own tokens, so pieces measure as they are stored;
+            # the token the block starts in counts as its first
+            first = max(bisect_right(starts, block.start) - 1, 0)
+            piece_starts = [0] + [
+                offset - block.start
+                for offset in starts[first + 1:bisect_left(starts, block.end)]
+            ]
+            for a, b in tokens.split_offsets(piece_text, piece_starts, max_tokens, 0):
+                a, b = _strip(piece_text, a, b)
+                if a < b:
+                    piece = Block(block.kind, block.start + a, block.start + b, block.page)
+                    flush([piece], sections[block.start])
+            continue
+        current.append(block)
+    flush(current)
+
+    for index, chunk in enumerate(chunks):
+        chunk["index"] = index
+    return chunks
+
+
+def chunk_index(
+    text: str,
+    max_tokens: int,
+    pages: Optional[Sequence[Dict]] = None,
+    model: Optional[str] = None,
+) -> List[Dict]:
+    """Chunk index of ``text``, read from the artifact store when present.
+
+    Each entry has ``index``, ``start``/``end`` (offsets into ``text``),
+    ``tokens``, ``pages`` (first and last page, or ``None``) and
+    ``section`` (the heading path it falls under).
+    """
+    variant = f"{'pages' if pages else 'text'}:{max_tokens}:{tokens.get_tokenizer(model).name}"
+    digest = artifacts.digest_text(text)
+    index = artifacts.get(artifacts.CHUNKS, digest, variant)
+    if index is None:
+        index = chunk_document(build_document(text, pages), max_tokens, model)
+        artifacts.put(artifacts.CHUNKS, digest, index, variant)
+    return index
+
+
+def chunk_texts(text: str, index: Sequence[Dict]) -> List[str]:
+    return [text[chunk["start"]:chunk["end"]] for chunk in index]
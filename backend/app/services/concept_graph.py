@@ -0,0 +1,162 @@
+"""Weighted concept graph built from extracted subject-verb-object triples.
+
+Nodes are canonical concept keys (lemmatised noun chunks without
+determiners); repeated mentions and parallel edges are merged into counts,
+and nodes are ranked by weighted PageRank so a large document can be pruned
+to the concepts that matter before it is sent to the client.
+"""
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CONCEPT_MAP_MAX_NODES = int(os.getenv("CONCEPT_MAP_MAX_NODES", "60"))
+PAGERANK_DAMPING = 0.85
+PAGERANK_ITERATIONS = 50
+PAGERANK_TOLERANCE = 1e-6
+
+
+class ConceptGraph:
+    """Accumulates concept mentions and labelled edges between concepts."""
+
+    def __init__(self):
+        self.mentions: Counter = Counter()
+        self.surfaces: Dict[str, Counter] = defaultdict(Counter)
+        # (source, target) -> verb label -> count
+        self.edges: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+
+    def add_mention(self, key: str, surface: str) -> None:
+        self.mentions[key] += 1
+        self.surfaces[key][surface] += 1
+
+    def add_edge(self, source: str, target: str, label: str = "", count: int = 1) -> None:
+        if source == target:
+            return
+        self.edges[(source, target)][label] += count
+
+    def merge(self, other: "ConceptGraph") -> "ConceptGraph":
+        self.mentions.update(other.mentions)
+        for key, surfaces in other.surfaces.items():
+            self.surfaces[key].update(surfaces)
+        for pair, labels in other.edges.items():
+            self.edges[pair].update(labels)
+        return self
+
+    def to_state(self) -> dict:
+        """Plain-data form, cheap to send back from a worker process."""
+        return {
+            "mentions": dict(self.mentions),
+            "surfaces": {key: dict(s) for key, s in self.surfaces.items()},
+            "edges": [[s, t, dict(labels)] for (s, t), labels in self.edges.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ConceptGraph":
+        graph = cls()
+        graph.mentions.update(state["mentions"])
+        for key, surfaces in state["surfaces"].items():
+            graph.surfaces[key].update(surfaces)
+        for source, target, labels in state["edges"]:
+            graph.edges[(source, target)].update(labels)
+        return graph
+
+    def label(self, key: str) -> str:
+        """Most frequent surface form of a concept."""
+        surfaces = self.surfaces.get(key)
+        return surfaces.most_common(1)[0][0] if surfaces else key
+
+    def weights(self) -> Dict[Tuple[str, str], int]:
+        return {pair: sum(labels.values()) for pair, labels in self.edges.items()}
+
+    def degrees(self) -> Counter:
+        degree: Counter = Counter()
+        for (source, target), weight in self.weights().items():
+            degree[source] += weight
+            degree[target] += weight
+        return degree
+
+    def pagerank(
+        self,
+        damping: float = PAGERANK_DAMPING,
+        iterations: int = PAGERANK_ITERATIONS,
+        tolerance: float = PAGERANK_TOLERANCE,
+    ) -> Dict[str, float]:
+        """Weighted PageRank over the graph with edges taken in both directions.
+
+        Concept maps are read both ways ("cells contain DNA" also makes DNA
+        relevant to cells), so a concept that is only ever an object still
+        ranks by how connected it is.
+        """
+        nodes = set(self.mentions)
+        out: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for (source, target), weight in self.weights().items():
+            nodes.update((source, target))
+            out[source][target] = out[source].get(target, 0) + weight
+            out[target][source] = out[target].get(source, 0) + weight
+        if not nodes:
+            return {}
+        n = len(nodes)
+        totals = {node: sum(out[node].values()) for node in out}
+        rank = dict.fromkeys(nodes, 1.0 / n)
+        for _ in range(iterations):
+            dangling = sum(rank[node] for node in nodes if not totals.get(node))
+            base = (1 - damping) / n + damping * dangling / n
+            new = dict.fromkeys(nodes, base)
+            for node, targets in out.items():
+                share = damping * rank[node] / totals[node]
+                for target, weight in targets.items():
+                    new[target] += share * weight
+            delta = sum(abs(new[node] - rank[node]) for node in nodes)
+            rank = new
+            if delta < tolerance:
+                break
+        return rank
+
+    def to_dict(self, max_nodes: Optional[int] = CONCEPT_MAP_MAX_NODES) -> Dict:
+        """Rank, prune to ``max_nodes`` and return the map for the client.
+
+        ``nodes`` are ordered by score and ``links`` by weight; each link
+        carries its most frequent verb as ``label``. ``adjacency`` maps a
+        node id to the indexes of its links so the client does not have to
+        rebuild it.
+        """
+        rank = self.pagerank()
+        degree = self.degrees()
+        # Concepts never linked to another add nothing to the map
+        ordered = sorted(
+            (key for key in rank if degree[key]),
+            key=lambda key: (-rank[key], -self.mentions[key], key),
+        )
+        keep = ordered if not max_nodes or max_nodes <= 0 else ordered[:max_nodes]
+        kept = set(keep)
+        nodes: List[Dict] = [
+            {
+                "id": key,
+                "label": self.label(key),
+                "score": round(rank[key], 6),
+                "degree": degree[key],
+                "mentions": self.mentions[key],
+            }
+            for key in keep
+        ]
+        links: List[Dict] = []
+        for (source, target), labels in self.edges.items():
+            if source in kept and target in kept:
+                links.append({
+                    "source": source,
+                    "target": target,
+                    "label": labels.most_common(1)[0][0],
+                    "weight": sum(labels.values()),
+                })
+        links.sort(key=lambda link: (-link["weight"], link["source"], link["target"]))
+        adjacency: Dict[str, List[int]] = {key: [] for key in keep}
+        for index, link in enumerate(links):
+            adjacency[link["source"]].append(index)
+            adjacency[link["target"]].append(index)
+        return {"nodes": nodes, "links": links, "adjacency": adjacency}
+
+
+def merge_states(states: Iterable[dict]) -> ConceptGraph:
+    graph = ConceptGraph()
+    for state in states:
+        graph.merge(ConceptGraph.from_state(state))
+    return graph
@@ -1,37 +1,124 @@
-from typing import Dict, List
-import spacy
-
-nlp = spacy.load("en_core_web_sm")
-
-
-def generate_concept_map(text: str) -> Dict:
-    doc = nlp(text)
-    nodes = set()
-    links: List[Dict] = []
-    for sent in doc.sents:
-        subject = None
-        obj = None
-        verb = None
-        for token in sent:
-            if token.dep_ in ("nsubj", "nsubjpass"):
-                subject = token.text
-            elif token.dep_ in ("dobj", "pobj"):
-                obj = token.text
-            elif token.dep_ == "ROOT":
-                verb = token.lemma_
-        if subject and obj:
-            nodes.add(subject)
-            nodes.add(obj)
-            links.append({"source": subject, "target": obj, "label": verb or ""})
-    return {"nodes": [{"id": n} for n in nodes], "links": links}
+from typing import Dict, List, Optional, Tuple
+
+from app.services import nlp_pool
+from app.services.concept_graph import CONCEPT_MAP_MAX_NODES, ConceptGraph, merge_states
+
+# Tokens that do not change which concept a noun chunk names
+_SKIP_POS = {"DET", "PRON", "PUNCT", "SPACE", "NUM"}
+_SUBJECT_DEPS = {"nsubj", "nsubjpass"}
+_OBJECT_DEPS = {"dobj", "attr", "dative", "oprd"}
+
+
+def _concept(span) -> Optional[Tuple[str, str]]:
+    """Canonical key (lowercased lemmas) and surface text of a noun phrase."""
+    tokens = [t for t in span if t.pos_ not in _SKIP_POS and not t.is_stop]
+    if not tokens:
+        return None
+    key = " ".join(t.lemma_.lower() for t in tokens)
+    return key, " ".join(t.text for t in tokens)
+
+
+def _with_conjuncts(tokens) -> List:
+    expanded = []
+    for token in tokens:
+        expanded.append(token)
+        expanded.extend(token.conjuncts)
+    return expanded
+
+
+def _subjects(verb) -> List:
+    subjects = [c for c in verb.children if c.dep_ in _SUBJECT_DEPS]
+    # "Cells grow and divide": the second verb shares the first one's subject
+    if not subjects and verb.dep_ == "conj":
+        subjects = [c for c in verb.head.children if c.dep_ in _SUBJECT_DEPS]
+    return _with_conjuncts(subjects)
+
+
+def _objects(verb) -> List[Tuple[object, str]]:
+    objects = [(c, "") for c in verb.children if c.dep_ in _OBJECT_DEPS]
+    for prep in verb.children:
+        if prep.dep_ in ("prep", "agent"):
+            objects.extend(
+                (c, prep.text.lower()) for c in prep.children if c.dep_ == "pobj"
+            )
+    return [(t, p) for obj, p in objects for t in _with_conjuncts([obj])]
+
+
+def _extract(doc) -> dict:
+    """Concept graph state for one parsed document (or segment)."""
+    graph = ConceptGraph()
+    concepts: Dict[int, Tuple[str, str]] = {}
+    for chunk in doc.noun_chunks:
+        concept = _concept(chunk)
+        if concept is None:
+            continue
+        graph.add_mention(*concept)
+        for token in chunk:
+            concepts[token.i] = concept
+
+    def concept_of(token):
+        if token.i in concepts:
+            return concepts[token.i][0]
+        if token.pos_ in ("NOUN", "PROPN") and not token.is_stop:
+            concept = (token.lemma_.lower(), token.text)
+            graph.add_mention(*concept)
+            concepts[token.i] = concept
+            return concept[0]
+        return None
+
+    for verb in doc:
+        if verb.pos_ not in ("VERB", "AUX"):
+            continue
+        subjects = [key for key in map(concept_of, _subjects(verb)) if key]
+        if not subjects:
+            continue
+        for obj, prep in _objects(verb):
+            target = concept_of(obj)
+            if target is None:
+                continue
+            label = f"{verb.lemma_.lower()} {prep}".strip()
+            for source in subjects:
+                graph.add_edge(source, target, label)
+    return graph.to_state()
+
+
+def _parse_segment(text: str) -> dict:
+    # Runs inside an nlp_pool worker, where the model is already loaded
+    return _extract(nlp_pool.get_nlp()(text))
+
+
+def generate_concept_map(text: str, max_nodes: int = CONCEPT_MAP_MAX_NODES) -> Dict:
+    """Build a ranked concept map from ``text``.
+
+    Long texts are cut into sentence-bounded segments that the warm worker
+    pool parses in parallel; each returns the counts of its own graph, and
+    the merged graph is ranked and pruned to ``max_nodes`` concepts here.
+    """
+    segments = nlp_pool.split_segments(text)
+    pool = nlp_pool.get_pool()
+    if pool is None:
+        docs = nlp_pool.get_nlp().pipe(segments, batch_size=nlp_pool.NLP_BATCH_SIZE)
+        states = (_extract(doc) for doc in docs)
+    else:
+        states = pool.map(_parse_segment, segments)
+    return merge_states(states).to_dict(max_nodes)
+
+
+def generate_concept_maps(
+    texts: List[str], n_process: int = 1, max_nodes: int = CONCEPT_MAP_MAX_NODES
+) -> List[Dict]:
+    """Build one concept map per text with a single batched ``nlp.pipe`` run.
+
+    Meant for bulk work such as re-indexing stored content; ``n_process`` > 1
+    lets spaCy fan the batch out over its own processes.
+    """
+    docs = nlp_pool.get_nlp().pipe(
+        texts, n_process=n_process, batch_size=nlp_pool.NLP_BATCH_SIZE
+    )
+    return [ConceptGraph.from_state(_extract(doc)).to_dict(max_nodes) for doc in docs]
 
 
 def concept_map_image(concept_map: Dict) -> bytes:
-    import graphviz
-
-    dot = graphviz.Digraph()
-    for n in concept_map["nodes"]:
-        dot.node(n["id"])
-    for l in concept_map["links"]:
-        dot.edge(l["source"], l["target"], label=l.get("label", ""))
-    return dot.pipe(format="png")
+    from app.services.concept_render import render_concept_map
+
+    return render_concept_map(concept_map, "png")[0]
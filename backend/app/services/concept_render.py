@@ -0,0 +1,108 @@
+"""Concept-map images rendered with Graphviz and cached by graph content."""
+import os
+import json
+import hashlib
+import logging
+import subprocess
+from typing import Dict, Tuple
+
+from fastapi import HTTPException
+
+from app.utils.cache import LRUCache, SQLiteCache, TieredCache
+from app.utils.lazy import lazy_import
+from app.utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+graphviz = lazy_import("graphviz", service="render")
+
+RENDER_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+# dot gives the most readable layout but grows super-linearly with size;
+# sfdp stays fast on large maps
+RENDER_SFDP_THRESHOLD = int(os.getenv("RENDER_SFDP_THRESHOLD", "80"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "10"))
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "256"))
+RENDER_CACHE_PATH = os.getenv("RENDER_CACHE_PATH", "")
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+_cache = TieredCache(
+    LRUCache(max_entries=RENDER_CACHE_MAX_ENTRIES),
+    SQLiteCache(RENDER_CACHE_PATH, max_bytes=RENDER_CACHE_MAX_BYTES)
+    if RENDER_CACHE_PATH
+    else None,
+)
+_inflight = SingleFlight()
+
+
+def _canonical(concept_map: Dict) -> Tuple[list, list]:
+    nodes = sorted(
+        (str(n["id"]), str(n.get("label", n["id"]))) for n in concept_map["nodes"]
+    )
+    links = sorted(
+        (str(l["source"]), str(l["target"]), str(l.get("label", "")))
+        for l in concept_map["links"]
+    )
+    return nodes, links
+
+
+def choose_engine(node_count: int) -> str:
+    return "sfdp" if node_count > RENDER_SFDP_THRESHOLD else "dot"
+
+
+def render_key(concept_map: Dict, fmt: str = "png") -> str:
+    """Cache key: the same graph in any node/link order gives the same key."""
+    nodes, links = _canonical(concept_map)
+    raw = json.dumps([fmt, choose_engine(len(nodes)), nodes, links])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _render(nodes: list, links: list, fmt: str, engine: str) -> bytes:
+    dot = graphviz.Digraph()
+    if engine == "sfdp":
+        dot.attr(overlap="prism", splines="true")
+    for node_id, label in nodes:
+        dot.node(node_id, label=label)
+    for source, target, label in links:
+        dot.edge(source, target, label=label)
+    # Run the layout ourselves so it can be killed when it overruns
+    try:
+        proc = subprocess.run(
+            [engine, f"-T{fmt}"],
+            input=dot.source.encode("utf-8"),
+            capture_output=True,
+            timeout=RENDER_TIMEOUT,
+            check=True,
+        )
+    except subprocess.TimeoutExpired:
+        logger.warning("%s layout of %d nodes timed out", engine, len(nodes))
+        raise HTTPException(status_code=504, detail="Concept map rendering timed out")
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logger.exception("Graphviz %s failed: %s", engine, exc)
+        raise HTTPException(status_code=500, detail="Concept map rendering failed")
+    return proc.stdout
+
+
+def render_concept_map(concept_map: Dict, fmt: str = "png") -> Tuple[bytes, str]:
+    """Return the rendered image and its cache key (usable as an ETag).
+
+    Renders are cached by :func:`render_key`, and concurrent requests for
+    the same graph share one Graphviz run.
+    """
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    key = render_key(concept_map, fmt)
+    image = _cache.get(key)
+    if image is not None:
+        return image, key
+
+    def render() -> bytes:
+        nodes, links = _canonical(concept_map)
+        image = _render(nodes, links, fmt, choose_engine(len(nodes)))
+        _cache.set(key, image)
+        return image
+
+    return _inflight.do(key, render), key
+
+
+def render_stats() -> dict:
+    return {"cache": _cache.stats(), "coalescing": _inflight.stats()}
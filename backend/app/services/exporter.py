@@ -2,9 +2,11 @@ from typing import Literal
 from pathlib import Path
 import uuid
 
-import markdown
-from bs4 import BeautifulSoup
-from weasyprint import HTML
+from app.utils.lazy import lazy_import
+
+markdown = lazy_import("markdown", service="export")
+bs4 = lazy_import("bs4", service="export")
+weasyprint = lazy_import("weasyprint", service="export")
 
 TMP_DIR = Path("/tmp")
 
@@ -14,10 +16,10 @@ def export_content(content: str, fmt: Literal['md', 'txt', 'pdf']):
         return content
     html = markdown.markdown(content)
     if fmt == 'txt':
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         return soup.get_text()
     if fmt == 'pdf':
-        return HTML(string=html).write_pdf()
+        return weasyprint.HTML(string=html).write_pdf()
     raise ValueError('Unsupported format')
 
 
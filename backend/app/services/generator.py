@@ -1,69 +1,45 @@
-import os, io, shutil, tempfile, logging, subprocess, shlex
+import os, io, time, tempfile, logging, subprocess, shlex, threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from fastapi import UploadFile, File, HTTPException
-from io import BytesIO
-import fitz  # PyMuPDF
-from pdf2image import convert_from_bytes
-import pytesseract
-from openai import OpenAI
 
 from app.utils.llm import (
     ask_llm,
-    split_text_into_chunks,
-    truncate_text_to_tokens,
+    llm_cache_bypassed,
+    llm_model_id,
     estimate_tokens,
-    MAX_MODEL_TOKENS,
 )
+from app.utils.mapreduce import map_unordered, reduce_hierarchical
+from app.services import artifacts, chunking, transcription
+from app.utils.ingest import SpooledUpload, spool_upload
+from app.utils.lazy import lazy_import
+
+fitz = lazy_import("fitz", service="pdf")  # PyMuPDF
+pdf2image = lazy_import("pdf2image", service="ocr")
+pytesseract = lazy_import("pytesseract", service="ocr")
 
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-OPENAI_TRANSCRIBE_MODEL = os.getenv("OPENAI_TRANSCRIBE_MODEL", "whisper-1")
 MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(100 * 1024 * 1024)))
+OCR_LANG = os.getenv("OCR_LANG", "spa")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_BATCH_PAGES = int(os.getenv("OCR_BATCH_PAGES", "4"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# Pages with fewer extractable characters than this (and an embedded image)
+# are treated as scans and OCR'd
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "50"))
+# Token budget of the document chunks summarised one LLM call each
+COURSE_CHUNK_TOKENS = int(os.getenv("COURSE_CHUNK_TOKENS", "10000"))
+# Bump when the summary or outline prompts change so stored outputs of the
+# old prompts are not reused
+COURSE_PROMPT_VERSION = "1"
 
-client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
-
-def _validate_stt_base_url():
-    # Warn (do NOT crash) if pointing to a non-official server (OSS usually lacks /v1/audio/transcriptions)
-    if OPENAI_BASE_URL.rstrip("/") != "https://api.openai.com/v1":
-        logger.warning(
-            "OPENAI_BASE_URL is %s (non-official). Most OSS servers do NOT support /v1/audio/transcriptions. "
-            "Use https://api.openai.com/v1 for Whisper.",
-            OPENAI_BASE_URL,
-        )
-    if not OPENAI_API_KEY:
-        logger.warning("OPENAI_API_KEY is empty; transcription will fail with 401.")
-
-_validate_stt_base_url()
-logger.info("Transcription model=%s base_url=%s", OPENAI_TRANSCRIBE_MODEL, OPENAI_BASE_URL)
 logger.info("MAX_MEDIA_BYTES=%s", MAX_MEDIA_BYTES)
 
 
-def _save_upload_to_named_temp(upload_file) -> str:
-    """
-    Save FastAPI UploadFile to a named temp file, preserving the original suffix.
-    This allows the OpenAI SDK to infer the format (mp3, wav, etc).
-    """
-    suffix = Path(upload_file.filename or "").suffix or ".mp3"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        upload_file.file.seek(0)
-        shutil.copyfileobj(upload_file.file, tmp)
-        tmp.flush()
-        return tmp.name
-
-
-def _convert_to_wav16k(src_path: str) -> str:
-    """
-    Optional fallback: convert any audio to 16 kHz mono WAV using ffmpeg,
-    then return the new path.
-    """
-    dst = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-    cmd = f'ffmpeg -y -i {shlex.quote(src_path)} -vn -ac 1 -ar 16000 -f wav {shlex.quote(dst)}'
-    subprocess.run(shlex.split(cmd), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    return dst
-
-
 def _ensure_size_ok(upload_file):
     # Works with FastAPI UploadFile
     upload_file.file.seek(0, os.SEEK_END)
@@ -74,180 +50,392 @@ def _ensure_size_ok(upload_file):
         raise HTTPException(status_code=400, detail="File too large")
 
 
-def _extract_audio_to_tmp(video_upload_file, ext=".mp3"):
+def _extract_audio_to_tmp(video_path, ext=".mp3"):
     # Requires ffmpeg in PATH (already in Docker image)
     with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as out:
         out_path = out.name
-    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as src:
-        src_path = src.name
-        video_upload_file.file.seek(0)
-        src.write(video_upload_file.file.read())
-    cmd = f'ffmpeg -y -i {shlex.quote(src_path)} -vn -ac 1 -ar 16000 -b:a 64k {shlex.quote(out_path)}'
+    cmd = f'ffmpeg -y -i {shlex.quote(str(video_path))} -vn -ac 1 -ar 16000 -b:a 64k {shlex.quote(out_path)}'
     subprocess.run(shlex.split(cmd), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return out_path
 
 
-def transcribe_audio(file):
-    # If you have a size guard, keep it:
-    try:
-        _ensure_size_ok(file)
-    except NameError:
-        pass  # ignore if not present
+def _transcription_error(exc: Exception) -> HTTPException:
+    msg = str(exc)
+    if isinstance(exc, subprocess.CalledProcessError) or "Unrecognized file format" in msg:
+        return HTTPException(status_code=400, detail="Unsupported or unrecognized audio format")
+    if "Connection refused" in msg or "APIConnectionError" in msg:
+        return HTTPException(status_code=502, detail=f"Transcription backend not reachable at {OPENAI_BASE_URL}")
+    if "401" in msg or "Unauthorized" in msg:
+        return HTTPException(status_code=401, detail="Invalid or missing OPENAI_API_KEY")
+    if "429" in msg or "Rate limit" in msg:
+        return HTTPException(status_code=429, detail="Transcription rate limited; please retry")
+    logger.exception("Transcription failed")
+    return HTTPException(status_code=500, detail="Transcription failed")
 
-    try:
-        # 1) Save the upload with a proper extension
-        src_path = _save_upload_to_named_temp(file)
 
-        # 2) First attempt: send as-is so OpenAI can detect format by suffix
-        try:
-            with open(src_path, "rb") as fh:
-                resp = client.audio.transcriptions.create(
-                    model=OPENAI_TRANSCRIBE_MODEL,  # e.g. "whisper-1"
-                    file=fh,
-                )
-        except Exception as e:
-            # 3) If the format is not recognized, convert to WAV 16k and retry once
-            if "Unrecognized file format" in str(e):
-                wav_path = _convert_to_wav16k(src_path)
-                with open(wav_path, "rb") as fh:
-                    resp = client.audio.transcriptions.create(
-                        model=OPENAI_TRANSCRIBE_MODEL,
-                        file=fh,
-                    )
-            else:
-                raise
-
-        text = getattr(resp, "text", None) or (resp.get("text") if isinstance(resp, dict) else None)
+def _transcribe_spooled(upload: SpooledUpload, to_audio=None) -> str:
+    """Transcribe a spooled upload, reusing a stored transcript when known.
+
+    ``to_audio`` turns the upload into an audio file first (for videos).
+    Long recordings are split and transcribed in parallel by
+    :mod:`app.services.transcription`.
+    """
+    backend = transcription.get_backend()
+    cached = artifacts.get(artifacts.TRANSCRIPT, upload.sha256, backend.describe())
+    if cached is not None:
+        return cached
+    audio_path = None
+    try:
+        audio_path = to_audio(upload.path) if to_audio else None
+        result = transcription.transcribe_file(audio_path or upload.path, backend)
+        text = result["text"].strip()
         if not text:
             raise RuntimeError("Empty transcription")
-        return text.strip()
-
     except Exception as exc:
-        msg = str(exc)
-        if "Unrecognized file format" in msg:
-            raise HTTPException(status_code=400, detail="Unsupported or unrecognized audio format")
-        if "Connection refused" in msg or "APIConnectionError" in msg:
-            raise HTTPException(status_code=502, detail=f"Transcription backend not reachable at {OPENAI_BASE_URL}")
-        if "401" in msg or "Unauthorized" in msg:
-            raise HTTPException(status_code=401, detail="Invalid or missing OPENAI_API_KEY")
-        if "429" in msg or "Rate limit" in msg:
-            raise HTTPException(status_code=429, detail="Transcription rate limited; please retry")
-        logger.exception("Transcription failed")
-        raise HTTPException(status_code=500, detail="Transcription failed")
+        raise _transcription_error(exc)
+    finally:
+        if audio_path:
+            Path(audio_path).unlink(missing_ok=True)
+    artifacts.put(artifacts.TRANSCRIPT, upload.sha256, text, backend.describe())
+    return text
+
+
+def transcribe_audio(file):
+    _ensure_size_ok(file)
+    # Spool the upload with its extension so the backend can detect the format
+    with spool_upload(file, default_suffix=".mp3") as upload:
+        return _transcribe_spooled(upload)
 
 
 def transcribe_video(file):
     _ensure_size_ok(file)
-    try:
-        audio_path = _extract_audio_to_tmp(file, ext=".mp3")
-        with open(audio_path, "rb") as fh:
-            resp = client.audio.transcriptions.create(model=OPENAI_TRANSCRIBE_MODEL, file=fh)
-        text = getattr(resp, "text", None) or (resp.get("text") if isinstance(resp, dict) else None)
-        if not text:
-            raise RuntimeError("Empty transcription")
-        return text.strip()
-    except Exception as exc:
-        msg = str(exc)
-        if "Connection refused" in msg or "APIConnectionError" in msg:
-            raise HTTPException(status_code=502, detail=f"Transcription backend not reachable at {OPENAI_BASE_URL}")
-        if "401" in msg or "Unauthorized" in msg:
-            raise HTTPException(status_code=401, detail="Invalid or missing OPENAI_API_KEY")
-        if "429" in msg or "Rate limit" in msg:
-            raise HTTPException(status_code=429, detail="Transcription rate limited; please retry")
-        logger.exception("Transcription failed")
-        raise HTTPException(status_code=500, detail="Transcription failed")
-
-
-def extract_text_with_ocr(pdf_data: bytes) -> str:
-    """Extract text from a PDF using OCR in Spanish."""
-    pages = convert_from_bytes(pdf_data, dpi=300)
-    text = ""
-    for page in pages:
-        text += pytesseract.image_to_string(page, lang='spa')
-    return text
+    with spool_upload(file, default_suffix=".mp4") as upload:
+        # ffmpeg reads the spooled file directly
+        return _transcribe_spooled(
+            upload, to_audio=lambda path: _extract_audio_to_tmp(path, ext=".mp3")
+        )
 
 
-def extract_text_from_pdf(pdf_data: bytes) -> str:
-    """Try basic extraction, fall back to OCR if needed."""
+def _ocr_image(image) -> str:
+    """OCR one rendered page (runs in an OCR worker process)."""
+    return pytesseract.image_to_string(image, lang=OCR_LANG)
+
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    """Return the OCR worker pool; workers are spawned, not forked from a
+    threaded server."""
+    global _ocr_pool
+    if _ocr_pool is None:
+        with _ocr_pool_lock:
+            if _ocr_pool is None:
+                _ocr_pool = ProcessPoolExecutor(
+                    max_workers=OCR_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _ocr_pool
+
+
+def shutdown_ocr_pool() -> None:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(wait=False, cancel_futures=True)
+            _ocr_pool = None
+
+
+def extract_text_with_ocr(pdf_data) -> str:
+    """Extract text from a PDF using OCR in Spanish.
+
+    Pages are rendered ``OCR_BATCH_PAGES`` at a time and recognised on a
+    process pool, with at most two pages per worker waiting at once, so peak
+    memory does not grow with the page count. Text is joined in page order.
+    ``pdf_data`` is the PDF's bytes or a path to it.
+    """
+    from_path = not isinstance(pdf_data, (bytes, bytearray))
+    if from_path:
+        page_count = int(pdf2image.pdfinfo_from_path(str(pdf_data))["Pages"])
+    else:
+        page_count = int(pdf2image.pdfinfo_from_bytes(pdf_data)["Pages"])
+    pool = _get_ocr_pool()
+    max_pending = max(OCR_BATCH_PAGES, 2 * OCR_WORKERS)
+    pending = deque()
+    texts = []
+    for first in range(1, page_count + 1, OCR_BATCH_PAGES):
+        last = min(first + OCR_BATCH_PAGES - 1, page_count)
+        options = dict(dpi=OCR_DPI, first_page=first, last_page=last, grayscale=True)
+        if from_path:
+            images = pdf2image.convert_from_path(str(pdf_data), **options)
+        else:
+            images = pdf2image.convert_from_bytes(pdf_data, **options)
+        pending.extend(pool.submit(_ocr_image, image) for image in images)
+        del images
+        while len(pending) > max_pending:
+            texts.append(pending.popleft().result())
+    while pending:
+        texts.append(pending.popleft().result())
+    return "".join(texts)
+
+
+def _ocr_png(png: bytes):
+    """OCR one page rendered by PyMuPDF; return the text and OCR time."""
+    from PIL import Image
+
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(png)) as image:
+        text = pytesseract.image_to_string(image, lang=OCR_LANG)
+    return text, time.perf_counter() - started
+
+
+def _open_pdf(pdf_data):
+    if isinstance(pdf_data, (bytes, bytearray)):
+        return fitz.open(stream=pdf_data, filetype="pdf")
+    return fitz.open(str(pdf_data), filetype="pdf")
+
+
+def _page_text(page):
+    """The page's text, as ``page.get_text()`` returns it, and its text blocks.
+
+    Each block has ``start``/``end`` offsets into the text and the font
+    ``size`` most of its characters are set in, from which headings are told
+    apart from body text.
+    """
+    parts = []
+    blocks = []
+    offset = 0
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        if block.get("type") != 0:
+            continue
+        start = offset
+        sizes = Counter()
+        for line in block["lines"]:
+            line_text = "".join(span["text"] for span in line["spans"])
+            for span in line["spans"]:
+                sizes[round(span["size"], 1)] += len(span["text"])
+            parts.append(line_text + "\n")
+            offset += len(line_text) + 1
+        if sizes:
+            blocks.append({"start": start, "end": offset, "size": sizes.most_common(1)[0][0]})
+    return "".join(parts), blocks
+
+
+def extract_pdf_pages(pdf_data) -> list[dict]:
+    """Extract text page by page, OCR-ing only the pages that look scanned.
+
+    Each entry has ``page`` (1-based), ``method`` (``text`` or ``ocr``),
+    ``chars``, ``seconds`` and ``text``; text pages also have ``blocks``
+    (see :func:`_page_text`). Scanned pages are rasterised with
+    ``page.get_pixmap`` from the already parsed document and recognised on
+    the OCR process pool. ``pdf_data`` is the PDF's bytes or, preferably, a
+    path, which PyMuPDF reads without loading the file into memory.
+    """
     try:
-        doc = fitz.open(stream=BytesIO(pdf_data), filetype="pdf")
-        text = "".join(page.get_text() for page in doc)
-        doc.close()
+        doc = _open_pdf(pdf_data)
     except Exception as e:
         logger.exception("Error reading PDF: %s", e)
-        text = ""
-    if not text.strip():
-        logger.info("PDF contains no extractable text, applying OCR")
+        started = time.perf_counter()
         text = extract_text_with_ocr(pdf_data)
-    return text
+        return [{
+            "page": None,
+            "method": "ocr",
+            "chars": len(text),
+            "seconds": round(time.perf_counter() - started, 3),
+            "text": text,
+        }]
+
+    pool = _get_ocr_pool()
+    max_pending = max(OCR_BATCH_PAGES, 2 * OCR_WORKERS)
+    pages: list[dict] = []
+    pending = deque()
+
+    def collect(entry, future):
+        text, seconds = future.result()
+        entry["text"] = text
+        entry["chars"] = len(text)
+        entry["seconds"] = round(entry["seconds"] + seconds, 3)
+
+    try:
+        for page in doc:
+            started = time.perf_counter()
+            text, blocks = _page_text(page)
+            entry = {"page": page.number + 1, "method": "text", "text": text, "blocks": blocks}
+            if len(text.strip()) < OCR_MIN_PAGE_CHARS and page.get_images():
+                pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+                entry["method"] = "ocr"
+                entry["blocks"] = None
+                pending.append((entry, pool.submit(_ocr_png, pix.tobytes("png"))))
+                del pix
+            entry["chars"] = len(text)
+            entry["seconds"] = time.perf_counter() - started
+            pages.append(entry)
+            while len(pending) > max_pending:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+    finally:
+        doc.close()
 
+    for entry in pages:
+        entry["seconds"] = round(entry["seconds"], 3)
+    ocr_pages = sum(1 for entry in pages if entry["method"] == "ocr")
+    if ocr_pages:
+        logger.info("OCR applied to %d of %d PDF pages", ocr_pages, len(pages))
+    return pages
 
 
-def generate_course(file: UploadFile = File(...)):
-    """Extract text from an uploaded file and generate a course."""
-    _ensure_size_ok(file)
-    filename = (file.filename or '').lower()
-    content_type = (file.content_type or '').lower()
+def extract_text_from_pdf(pdf_data) -> str:
+    """Extract text from a PDF, OCR-ing only pages without a text layer."""
+    return "".join(entry["text"] for entry in extract_pdf_pages(pdf_data))
 
-    # Read the uploaded file contents
-    data = file.file.read()
-    size = len(data)
-    logger.info("Processing file '%s' (%d bytes)", filename, size)
 
-    # Handle plain text files
+def _llm_variant() -> str:
+    # Stored LLM output is only reused for the same model and prompts
+    return f"{llm_model_id()}:{COURSE_PROMPT_VERSION}"
+
+
+def _summarize_chunk(chunk: str) -> str:
+    # Unchanged chunks of an edited document reuse their stored summary
+    digest = artifacts.digest_text(chunk)
+    variant = _llm_variant()
+    if not llm_cache_bypassed():
+        summary = artifacts.get(artifacts.SUMMARY, digest, variant)
+        if summary is not None:
+            return summary
+    summary = ask_llm("Summarize the following part of a course document:\n\n" + chunk)
+    artifacts.put(artifacts.SUMMARY, digest, summary, variant)
+    return summary
+
+
+def _merge_summaries(aggregated: str) -> str:
+    return ask_llm(
+        "Merge these partial summaries of a course document into a single "
+        "summary that keeps every key point:\n\n" + aggregated
+    )
+
+
+def _build_outline(aggregated: str) -> str:
+    return ask_llm(
+        "Combine these summaries into a coherent course outline:\n\n" + aggregated
+    )
+
+
+def _document_type(upload: SpooledUpload) -> str:
+    filename = upload.filename.lower()
+    content_type = upload.content_type.lower()
     if filename.endswith('.txt') and 'text/plain' in content_type:
+        return 'txt'
+    if filename.endswith('.pdf') and 'pdf' in content_type:
+        return 'pdf'
+    raise HTTPException(status_code=400, detail="Only .txt or .pdf files are supported")
+
+
+def _extract_document(upload: SpooledUpload):
+    """Return the text of a spooled .txt or .pdf upload and, for PDFs, the
+    per-page extraction metadata.
+
+    Results are kept in the artifact store by content hash, so a file seen
+    before is not parsed or OCR'd again.
+    """
+    doc_type = _document_type(upload)
+    variant = f"{doc_type}:{OCR_LANG}"
+    stored = artifacts.get(artifacts.TEXT, upload.sha256, variant)
+    if stored is not None:
+        return stored["text"], stored["pages"]
+    contents, pages = _read_document(upload, doc_type)
+    artifacts.put(artifacts.TEXT, upload.sha256, {"text": contents, "pages": pages}, variant)
+    return contents, pages
+
+
+def _read_document(upload: SpooledUpload, doc_type: str):
+    # Handle plain text files
+    if doc_type == 'txt':
+        data = upload.read_bytes()
         try:
             try:
-                contents = data.decode('utf-8')
+                return data.decode('utf-8'), None
             except UnicodeDecodeError:
                 try:
-                    contents = data.decode('latin-1')
+                    return data.decode('latin-1'), None
                 except UnicodeDecodeError:
-                    contents = data.decode('utf-8', errors='ignore')
+                    return data.decode('utf-8', errors='ignore'), None
         except Exception as e:
             logger.exception("Error decoding text: %s", e)
             raise HTTPException(status_code=422, detail="Error decoding text")
 
-    # Handle PDF files
-    elif filename.endswith('.pdf') and 'pdf' in content_type:
-        try:
-            contents = extract_text_from_pdf(data)
-        except Exception as e:
-            logger.exception("Error reading PDF: %s", e)
-            raise HTTPException(status_code=422, detail="Error reading PDF")
-    else:
-        raise HTTPException(status_code=400, detail="Only .txt or .pdf files are supported")
+    # Handle PDF files; PyMuPDF reads them from the spooled path
+    try:
+        pages = extract_pdf_pages(upload.path)
+        return "".join(entry["text"] for entry in pages), pages
+    except Exception as e:
+        logger.exception("Error reading PDF: %s", e)
+        raise HTTPException(status_code=422, detail="Error reading PDF")
 
-    # Ensure the content stays within the model's limits
-    token_count = estimate_tokens(contents)
-    truncated = False
-    if token_count > MAX_MODEL_TOKENS:
-        contents = truncate_text_to_tokens(contents, MAX_MODEL_TOKENS)
-        truncated = True
-        token_count = estimate_tokens(contents)
 
-    # Split the input into manageable chunks for the LLM
-    try:
-        chunks = split_text_into_chunks(contents, max_tokens=10_000)
-    except ValueError as exc:
-        logger.error("Unable to split text: %s", exc)
-        raise HTTPException(status_code=400, detail="File too large to process")
-
-    partial_summaries = []  # Store each chunk summary
-    for chunk in chunks:
-        prompt = (
-            "Summarize the following part of a course document:\n\n" + chunk
-        )
-        partial_summaries.append(ask_llm(prompt))
+def iter_course_events(file: UploadFile):
+    """Generate a course from an uploaded file, yielding progress events.
 
-    # Combine partial summaries and ask for a final overall summary
-    aggregated = "\n".join(partial_summaries)
-    final_prompt = (
-        "Combine these summaries into a coherent course outline:\n\n" + aggregated
+    Yields ``("chunk", {...})`` for every chunk summary as soon as it is
+    ready (in completion order) and finally ``("course", result)`` with the
+    same payload :func:`generate_course` returns. For an upload whose
+    content was processed before, only the stored ``course`` is yielded.
+    """
+    with spool_upload(file) as upload:
+        logger.info("Processing file '%s' (%d bytes)", upload.filename, upload.size)
+        variant = f"{_document_type(upload)}:{COURSE_CHUNK_TOKENS}:{_llm_variant()}"
+        course = (
+            None
+            if llm_cache_bypassed()
+            else artifacts.get(artifacts.COURSE, upload.sha256, variant)
+        )
+        if course is None:
+            contents, pages = _extract_document(upload)
+    if course is not None:
+        logger.info("Known upload %s; returning the stored course", upload.sha256[:12])
+        yield "course", course
+        return
+
+    # Split the whole input into chunks along its headings and paragraphs;
+    # every chunk is summarised, however long the document is
+    index = chunking.chunk_index(contents, COURSE_CHUNK_TOKENS, pages)
+    chunks = chunking.chunk_texts(contents, index)
+
+    # Summarize chunks concurrently and report each one as it finishes
+    partial_summaries = [None] * len(chunks)
+    for i, summary in map_unordered(_summarize_chunk, chunks):
+        partial_summaries[i] = summary
+        yield "chunk", {
+            "index": i,
+            "total": len(chunks),
+            "summary": summary,
+            "pages": index[i]["pages"],
+            "section": index[i]["section"],
+        }
+
+    # Combine the partial summaries (hierarchically when they do not fit in a
+    # single combine prompt)
+    final_summary = reduce_hierarchical(
+        partial_summaries,
+        _build_outline,
+        merge_fn=_merge_summaries,
+        count_tokens=estimate_tokens,
     )
-    final_summary = ask_llm(final_prompt)
-    # Include a warning if we had to cut off the input text
     result = {"course": final_summary}
-    if truncated:
-        result["warning"] = "Input text truncated to fit token limit."
+    if pages is not None:
+        result["pages"] = [
+            {key: value for key, value in entry.items() if key not in ("text", "blocks")}
+            for entry in pages
+        ]
+    artifacts.put(artifacts.COURSE, upload.sha256, result, variant)
+    yield "course", result
+
+
+def generate_course(file: UploadFile = File(...)):
+    """Extract text from an uploaded file and generate a course."""
+    result = None
+    for event, data in iter_course_events(file):
+        if event == "course":
+            result = data
     return result
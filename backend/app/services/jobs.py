@@ -0,0 +1,328 @@
+"""Background processing of long uploads with an SQLite-backed job queue."""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.services import generator
+from app.utils.ingest import spool_upload
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = Path(os.getenv("JOBS_DIR", "/tmp/learnsynth-jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(100 * 1024 * 1024)))
+# A running job belongs to its worker for this long after each heartbeat;
+# jobs whose lease runs out (their process died) are queued again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_STOP_TIMEOUT = float(os.getenv("JOB_STOP_TIMEOUT", "30"))
+# Pause before a worker tries the database again after an error
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "1"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+@dataclass
+class StoredUpload:
+    """The parts of ``UploadFile`` the generator stages use, backed by a file."""
+
+    filename: str
+    content_type: str
+    file: BinaryIO
+
+
+Report = Callable[[str, float], None]
+
+
+def _run_course(upload: StoredUpload, report: Report) -> dict:
+    report("extract", 0.0)
+    result = None
+    done = 0
+    for event, data in generator.iter_course_events(upload):
+        if event == "chunk":
+            done += 1
+            report("summarize", done / data["total"])
+            if done == data["total"]:
+                report("combine", 0.0)
+        elif event == "course":
+            result = data
+    return result
+
+
+def _run_audio(upload: StoredUpload, report: Report) -> dict:
+    report("transcribe", 0.0)
+    return {"text": generator.transcribe_audio(upload)}
+
+
+def _run_video(upload: StoredUpload, report: Report) -> dict:
+    report("transcribe", 0.0)
+    return {"text": generator.transcribe_video(upload)}
+
+
+# Pipeline run for each kind of job
+PIPELINES: Dict[str, Callable[[StoredUpload, Report], dict]] = {
+    "course": _run_course,
+    "audio": _run_audio,
+    "video": _run_video,
+}
+
+
+class JobQueue:
+    """Persistent FIFO of upload jobs processed by a bounded pool of threads.
+
+    Several processes can share the database. A claimed job records its
+    owner and a lease that the owner renews while it runs; a job left
+    ``running`` by a process that died is queued again once its lease
+    expires, never while its owner is still working on it.
+    """
+
+    def __init__(self, root: Path = JOBS_DIR, workers: int = JOB_WORKERS):
+        self.root = Path(root)
+        self.uploads = self.root / "uploads"
+        self.workers = workers
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.uploads.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " stage TEXT,"
+                " progress REAL NOT NULL DEFAULT 0,"
+                " filename TEXT,"
+                " content_type TEXT,"
+                " path TEXT,"
+                " result TEXT,"
+                " error TEXT,"
+                " created REAL NOT NULL,"
+                " updated REAL NOT NULL,"
+                " owner TEXT,"
+                " lease REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.root / "jobs.db", timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, kind: str, upload_file) -> str:
+        """Spool ``upload_file`` to disk and queue it; return the job id."""
+        if kind not in PIPELINES:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        suffix = Path(upload_file.filename or "").suffix
+        path = self.uploads / f"{job_id}{suffix}"
+        # Stops copying (and removes the file) once MAX_MEDIA_BYTES is exceeded
+        spool_upload(upload_file, max_bytes=MAX_MEDIA_BYTES, dest=path)
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, stage, filename, content_type,"
+                " path, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, kind, QUEUED, QUEUED, upload_file.filename or "",
+                    upload_file.content_type or "", str(path), now, now,
+                ),
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "filename": row["filename"],
+            "created": row["created"],
+            "updated": row["updated"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = json.loads(row["error"])
+        return job
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = ?, updated = ?, owner = ?, lease = ?"
+                    " WHERE id = ?",
+                    (RUNNING, now, self.owner, now + JOB_LEASE_SECONDS, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run(self, row: sqlite3.Row) -> None:
+        job_id = row["id"]
+
+        def report(stage: str, progress: float) -> None:
+            # Progress is informational; a busy database must not fail the job
+            try:
+                self._update(job_id, stage=stage, progress=round(progress, 3))
+            except sqlite3.Error as exc:
+                logger.warning("Could not record progress of job %s: %s", job_id, exc)
+
+        try:
+            with open(row["path"], "rb") as fh:
+                upload = StoredUpload(row["filename"], row["content_type"], fh)
+                result = PIPELINES[row["kind"]](upload, report)
+            fields = dict(status=DONE, stage=DONE, progress=1.0, result=json.dumps(result))
+        except HTTPException as exc:
+            error = {"status": exc.status_code, "detail": exc.detail}
+            fields = dict(status=FAILED, error=json.dumps(error))
+        except Exception as exc:
+            logger.exception("Job %s failed: %s", job_id, exc)
+            error = {"status": 500, "detail": "Internal server error"}
+            fields = dict(status=FAILED, error=json.dumps(error))
+        if self._finish(job_id, fields):
+            Path(row["path"]).unlink(missing_ok=True)
+
+    def _finish(self, job_id: str, fields: dict) -> bool:
+        """Store a job's outcome, retrying while the database is unavailable.
+
+        Returns ``False`` if the queue stopped first; the job keeps its
+        upload and is run again once its lease expires.
+        """
+        while True:
+            try:
+                self._update(job_id, **fields)
+                return True
+            except sqlite3.Error as exc:
+                logger.warning("Could not store the outcome of job %s: %s", job_id, exc)
+                if self._stopping.wait(JOB_RETRY_SECONDS):
+                    return False
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as exc:
+                logger.warning("Could not claim a job: %s", exc)
+                self._stopping.wait(JOB_RETRY_SECONDS)
+                continue
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._run(row)
+
+    def _renew(self) -> None:
+        """Extend the leases of the jobs this queue is running."""
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease = ? WHERE status = ? AND owner = ?",
+                (time.time() + JOB_LEASE_SECONDS, RUNNING, self.owner),
+            )
+
+    def _recover(self) -> int:
+        """Queue again the running jobs whose lease has expired."""
+        now = time.time()
+        with self._conn() as conn:
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, owner = NULL, lease = NULL"
+                " WHERE status = ? AND (lease IS NULL OR lease < ?)",
+                (QUEUED, QUEUED, RUNNING, now),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, now - JOB_RETENTION_SECONDS),
+            )
+        if requeued:
+            logger.warning("Queued %d abandoned job(s) again", requeued)
+            with self._wakeup:
+                self._wakeup.notify_all()
+        return requeued
+
+    def _heartbeat(self) -> None:
+        while not self._stopping.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                self._renew()
+                self._recover()
+            except sqlite3.Error as exc:
+                logger.warning("Job lease heartbeat failed: %s", exc)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._recover()
+        self._stopping.clear()
+        targets = [(self._heartbeat, "job-lease")] + [
+            (self._worker, f"job-worker-{i}") for i in range(self.workers)
+        ]
+        for target, name in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = JOB_STOP_TIMEOUT) -> None:
+        """Stop taking jobs and wait up to ``timeout`` for the running ones."""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        busy = [thread.name for thread in self._threads if thread.is_alive()]
+        if busy:
+            # Their jobs are queued again once the lease runs out
+            logger.warning("Job workers still running at shutdown: %s", ", ".join(busy))
+        self._threads = []
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
@@ -0,0 +1,133 @@
+"""Shared spaCy pipeline and a pool of worker processes that keep it loaded."""
+import os
+import re
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from app.utils.lazy import register
+
+logger = logging.getLogger(__name__)
+
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+# Concept extraction only reads the dependency parse and lemmas
+EXCLUDED_COMPONENTS = ["ner"]
+# Worker processes holding a loaded model; 0 parses in the calling process
+NLP_PROCESSES = int(os.getenv("NLP_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Texts longer than this are split into sentence-bounded segments
+NLP_SEGMENT_CHARS = int(os.getenv("NLP_SEGMENT_CHARS", "20000"))
+NLP_BATCH_SIZE = int(os.getenv("NLP_BATCH_SIZE", "32"))
+
+_nlp = None
+_nlp_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def get_nlp():
+    """Return this process's spaCy pipeline, loading it on first use."""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+
+                _nlp = spacy.load(SPACY_MODEL, exclude=EXCLUDED_COMPONENTS)
+                logger.info("Loaded spaCy %s with %s", SPACY_MODEL, _nlp.pipe_names)
+    return _nlp
+
+
+def _warm() -> None:
+    get_nlp()
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the worker pool, or ``None`` when ``NLP_PROCESSES`` is 0.
+
+    Workers are spawned (not forked from a threaded server) and load the
+    model once when they start.
+    """
+    global _pool
+    if NLP_PROCESSES <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=NLP_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm,
+                )
+    return _pool
+
+
+def warm_pool() -> None:
+    """Start every worker now so the first request does not pay model loading."""
+    pool = get_pool()
+    if pool is None:
+        get_nlp()
+        return
+    for future in [pool.submit(_warm) for _ in range(NLP_PROCESSES)]:
+        future.result()
+
+
+register("nlp", warm_pool)
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _hard_split(text: str, max_chars: int) -> List[str]:
+    pieces, current = [], ""
+    for word in text.split(" "):
+        if current and len(current) + len(word) + 1 > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_segments(text: str, max_chars: int = NLP_SEGMENT_CHARS) -> List[str]:
+    """Split ``text`` into segments of at most ``max_chars`` characters.
+
+    Paragraphs are packed together where they fit; longer paragraphs are cut
+    at sentence ends, so no sentence is split unless it alone is too long.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    units: List[str] = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        if len(paragraph) <= max_chars:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            if len(sentence) <= max_chars:
+                units.append(sentence)
+            else:
+                units.extend(_hard_split(sentence, max_chars))
+
+    segments, current = [], ""
+    for unit in units:
+        if not unit.strip():
+            continue
+        if current and len(current) + len(unit) + 2 > max_chars:
+            segments.append(current)
+            current = unit
+        else:
+            current = f"{current}\n\n{unit}" if current else unit
+    if current:
+        segments.append(current)
+    return segments
@@ -0,0 +1,175 @@
+"""Size-adaptive execution of LLM generators over arbitrarily long texts.
+
+Texts that fit in ``LLM_MAX_INPUT_TOKENS`` are sent in a single call.
+Longer texts are split along their structure (see :mod:`chunking`), the
+generator's prompt runs on every chunk concurrently, and the partial
+results are merged: lists of flashcards, questions or prompts are
+deduplicated and interleaved so every part of the text is represented, and
+summaries are merged by the LLM, hierarchically when they do not fit in
+one call.
+"""
+import os
+import re
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from app.services import chunking
+from app.utils.llm import (
+    LLM_MAX_INPUT_TOKENS,
+    async_ask_llm,
+    async_make_deep_prompts as async_make_chunk_deep_prompts,
+    estimate_tokens,
+)
+from app.utils.mapreduce import async_map_ordered, async_reduce_hierarchical
+
+logger = logging.getLogger(__name__)
+
+PLANNER_CHUNK_TOKENS = int(os.getenv("PLANNER_CHUNK_TOKENS", "6000"))
+# Most items kept when merging the lists produced for each chunk
+PLANNER_MAX_ITEMS = int(os.getenv("PLANNER_MAX_ITEMS", "40"))
+DEEP_PROMPTS_MAX_ITEMS = 8
+
+Merge = Callable[[List[str]], Awaitable[str]]
+
+
+def plan(text: str) -> List[str]:
+    """Parts to send to the LLM: ``[text]`` if it fits one call, else its chunks."""
+    if estimate_tokens(text) <= LLM_MAX_INPUT_TOKENS:
+        return [text]
+    index = chunking.chunk_index(text, PLANNER_CHUNK_TOKENS)
+    logger.info("Planned %d chunks for a %d-character text", len(index), len(text))
+    return chunking.chunk_texts(text, index)
+
+
+async def async_run(parts: Sequence[str], prompt: Callable[[str], str], merge: Merge) -> str:
+    """Run ``prompt`` on every part concurrently and merge the completions."""
+    if len(parts) == 1:
+        return await async_ask_llm(prompt(parts[0]))
+    partials = await async_map_ordered(lambda part: async_ask_llm(prompt(part)), parts)
+    return await merge(partials)
+
+
+# An answer wrapped in a Markdown code block, e.g. ```json ... ```
+_FENCED = re.compile(r"^\s*```[\w-]*[ \t]*\n?(.*?)\s*```\s*$", re.S)
+
+
+def _load(raw: str) -> Any:
+    fenced = _FENCED.match(raw) if isinstance(raw, str) else None
+    if fenced:
+        raw = fenced.group(1)
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        logger.warning("Dropping a chunk answer that is not JSON: %.80r", raw)
+        return None
+
+
+def _fingerprint(item: Any) -> str:
+    if isinstance(item, dict):
+        for field in ("question", "term", "prompt", "front", "title"):
+            if isinstance(item.get(field), str):
+                item = item[field]
+                break
+    if not isinstance(item, str):
+        item = json.dumps(item, sort_keys=True)
+    return re.sub(r"\W+", " ", item).strip().lower()
+
+
+def interleave(lists: Sequence[List], limit: int = PLANNER_MAX_ITEMS) -> List:
+    """Round-robin over ``lists`` dropping duplicates, up to ``limit`` items.
+
+    Taking one item per chunk in turn keeps the whole text represented when
+    the merged list has to be cut.
+    """
+    merged, seen = [], set()
+    for row in range(max((len(items) for items in lists), default=0)):
+        for items in lists:
+            if row >= len(items):
+                continue
+            fingerprint = _fingerprint(items[row])
+            if not fingerprint or fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            merged.append(items[row])
+            if len(merged) >= limit:
+                return merged
+    return merged
+
+
+def _items(data: Any, *keys: str) -> List:
+    if isinstance(data, dict):
+        data = next((data[key] for key in keys if data.get(key)), [])
+    return data if isinstance(data, list) else []
+
+
+def merge_lists(key: str, alias: Optional[str] = None, limit: int = PLANNER_MAX_ITEMS) -> Merge:
+    """Merge for generators answering ``{key: [...]}`` (or ``{alias: [...]}``)."""
+
+    async def merge(partials: List[str]) -> str:
+        lists = [_items(_load(raw), key, *filter(None, [alias])) for raw in partials]
+        return json.dumps({key: interleave(lists, limit)})
+
+    return merge
+
+
+async def async_merge_summaries(summaries: Sequence[str]) -> str:
+    """One summary from the summaries of consecutive chunks."""
+    summaries = [s for s in summaries if s]
+    if len(summaries) <= 1:
+        return summaries[0] if summaries else ""
+
+    async def combine(joined: str) -> str:
+        return await async_ask_llm(
+            "Merge these summaries of consecutive parts of one document into a "
+            "single summary that keeps every key point:\n\n" + joined
+        )
+
+    return await async_reduce_hierarchical(
+        summaries,
+        combine,
+        max_tokens=LLM_MAX_INPUT_TOKENS,
+        count_tokens=estimate_tokens,
+        separator="\n\n",
+    )
+
+
+def _groups(data: Dict) -> List[Dict]:
+    concept_map = data.get("concept_map") or data.get("conceptMap") or {}
+    groups = concept_map.get("groups") if isinstance(concept_map, dict) else concept_map
+    return [g for g in groups or [] if isinstance(g, dict)]
+
+
+async def async_merge_analysis(partials: List[str]) -> str:
+    """Merge per-chunk answers to the ``/analyze`` prompt into one answer."""
+    answers = [data for data in map(_load, partials) if isinstance(data, dict)]
+    topics: Dict[str, List] = {}
+    for data in answers:
+        for group in _groups(data):
+            title = str(group.get("title", "")).strip()
+            topics.setdefault(title, []).append(_items(group.get("topics")))
+    merged = {
+        "summary": await async_merge_summaries([str(d.get("summary", "")) for d in answers]),
+        "concept_map": {
+            "groups": [
+                {"title": title, "topics": interleave(lists)}
+                for title, lists in topics.items()
+            ]
+        },
+        "flashcards": interleave([_items(d, "flashcards") for d in answers]),
+        "quiz": interleave([_items(d, "quiz", "quizQuestions") for d in answers]),
+        "spaced_repetition": interleave(
+            [_items(d, "spaced_repetition", "spacedRepetition") for d in answers]
+        ),
+    }
+    if answers and answers[0].get("progress"):
+        merged["progress"] = answers[0]["progress"]
+    return json.dumps(merged)
+
+
+async def async_make_deep_prompts(parts: Sequence[str]) -> List[Dict]:
+    """Reflective prompts covering every part, at most ``DEEP_PROMPTS_MAX_ITEMS``."""
+    if len(parts) == 1:
+        return await async_make_chunk_deep_prompts(parts[0])
+    lists = await async_map_ordered(async_make_chunk_deep_prompts, parts)
+    return interleave(lists, DEEP_PROMPTS_MAX_ITEMS)
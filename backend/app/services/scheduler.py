@@ -0,0 +1,124 @@
+"""Due-card scheduling on top of the SRS store.
+
+The ``(user_id, deck_id, next_review, id)`` indexes kept by :mod:`srs` act as
+per-user/per-deck priority queues ordered by due time: "the next K due cards"
+is an index seek plus K steps, and pages continue from a cursor instead of an
+offset, so polling never loads the whole deck.
+"""
+import os
+import json
+import time
+import base64
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.services import srs
+
+MAX_PAGE_SIZE = 200
+FORECAST_TTL = float(os.getenv("SRS_FORECAST_TTL", "300"))
+
+_forecasts: Dict[Tuple, Tuple[float, int, dict]] = {}
+_forecasts_lock = threading.Lock()
+
+
+def encode_cursor(next_review: str, card_id: str) -> str:
+    raw = json.dumps([next_review, card_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        next_review, card_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(next_review), str(card_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _scope(user_id: str, deck_id: Optional[str]) -> Tuple[str, list]:
+    if deck_id is None:
+        return "user_id = ?", [user_id]
+    return "user_id = ? AND deck_id = ?", [user_id, deck_id]
+
+
+def next_due(
+    user_id: str = "",
+    deck_id: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> dict:
+    """Return up to ``limit`` due cards, oldest first, and the next cursor.
+
+    ``deck_id=None`` pages across all of the user's decks. ``next_cursor`` is
+    ``None`` on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    where, params = _scope(user_id, deck_id)
+    where += " AND next_review <= ?"
+    params.append(srs.to_iso(now or datetime.utcnow()))
+    if cursor:
+        where += " AND (next_review, id) > (?, ?)"
+        params.extend(decode_cursor(cursor))
+    rows = srs.get_connection().execute(
+        f"SELECT * FROM cards WHERE {where} ORDER BY next_review, id LIMIT ?",
+        (*params, limit + 1),
+    ).fetchall()
+    cards: List[Dict] = [srs.row_to_card(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = cards[-1]
+        next_cursor = encode_cursor(last["next_review"], last["id"])
+    return {"cards": cards, "next_cursor": next_cursor}
+
+
+def _count(where: str, params: list) -> int:
+    return srs.get_connection().execute(
+        f"SELECT COUNT(*) FROM cards WHERE {where}", params
+    ).fetchone()[0]
+
+
+def _compute_forecast(user_id: str, deck_id: Optional[str], now: datetime) -> dict:
+    where, params = _scope(user_id, deck_id)
+    tomorrow = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    by_hour = [0] * 24
+    rows = srs.get_connection().execute(
+        f"SELECT substr(next_review, 12, 2) AS hour, COUNT(*) FROM cards"
+        f" WHERE {where} AND next_review >= ? AND next_review < ? GROUP BY hour",
+        (*params, srs.to_iso(tomorrow), srs.to_iso(tomorrow + timedelta(days=1))),
+    )
+    for hour, count in rows:
+        by_hour[int(hour)] = count
+    return {
+        "due_now": _count(f"{where} AND next_review <= ?", [*params, srs.to_iso(now)]),
+        "due_later_today": _count(
+            f"{where} AND next_review > ? AND next_review < ?",
+            [*params, srs.to_iso(now), srs.to_iso(tomorrow)],
+        ),
+        "tomorrow": {
+            "date": tomorrow.date().isoformat(),
+            "total": sum(by_hour),
+            "by_hour": by_hour,
+        },
+    }
+
+
+def review_forecast(user_id: str = "", deck_id: Optional[str] = None) -> dict:
+    """Return the review load due now and tomorrow (UTC), bucketed by hour.
+
+    Results are kept until the deck changes in this process or
+    ``SRS_FORECAST_TTL`` seconds pass, so repeated polling is a dict lookup.
+    """
+    now = datetime.utcnow()
+    key = (user_id, deck_id, now.date())
+    version = srs.data_version()
+    with _forecasts_lock:
+        cached = _forecasts.get(key)
+    if cached and cached[1] == version and time.monotonic() - cached[0] < FORECAST_TTL:
+        return cached[2]
+    forecast = _compute_forecast(user_id, deck_id, now)
+    with _forecasts_lock:
+        if len(_forecasts) > 10_000:
+            _forecasts.clear()
+        _forecasts[key] = (time.monotonic(), version, forecast)
+    return forecast
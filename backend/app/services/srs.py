@@ -1,61 +1,266 @@
+import os
+import sys
 import json
 import uuid
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
+# Legacy JSON deck, imported into the database the first time it is opened
 DATA_FILE = Path(__file__).parent / "srs_cards.json"
+DB_FILE = Path(os.getenv("SRS_DB_PATH", str(Path(__file__).parent / "srs_cards.db")))
 
-if not DATA_FILE.exists():
-    DATA_FILE.write_text("[]")
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+# Bumped on every write so derived data (e.g. review forecasts) can be reused
+_version = 0
 
-def _load_cards() -> List[Dict]:
-    return json.loads(DATA_FILE.read_text())
+_COLUMNS = (
+    "id", "user_id", "deck_id", "front", "back", "interval", "next_review", "difficulty",
+)
 
-def _save_cards(cards: List[Dict]):
-    DATA_FILE.write_text(json.dumps(cards, indent=2))
 
+def to_iso(moment: datetime) -> str:
+    # Fixed-width timestamps so string order matches time order in the index
+    return moment.isoformat(timespec="microseconds")
 
-def add_flashcards(cards: List[Dict]) -> List[Dict]:
-    existing = _load_cards()
+
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    _ensure_schema(conn)
+    return conn
+
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cards ("
+            " id TEXT PRIMARY KEY,"
+            " front TEXT NOT NULL,"
+            " back TEXT NOT NULL,"
+            " interval INTEGER NOT NULL DEFAULT 1,"
+            " next_review TEXT NOT NULL,"
+            " difficulty INTEGER NOT NULL DEFAULT 0,"
+            " user_id TEXT NOT NULL DEFAULT '',"
+            " deck_id TEXT NOT NULL DEFAULT '')"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cards_next_review ON cards (next_review)"
+        )
+        # Per-user and per-deck due queues, ordered like the scheduler pages
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cards_user_due"
+            " ON cards (user_id, next_review, id)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cards_deck_due"
+            " ON cards (user_id, deck_id, next_review, id)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        migrated = conn.execute(
+            "SELECT value FROM meta WHERE key = 'json_migrated'"
+        ).fetchone()
+        if migrated is None and DATA_FILE.exists():
+            migrate_json(DATA_FILE, conn)
+        # Only once the legacy deck is committed, so no caller reads the
+        # cards table half-imported
+        _schema_ready = True
+
+
+@contextmanager
+def _transaction(conn: Optional[sqlite3.Connection] = None):
+    """Run a write transaction, taking the write lock up front."""
+    global _version
+    conn = conn or get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    _version += 1
+
+
+def data_version() -> int:
+    """Counter that changes whenever this process writes to the deck."""
+    return _version
+
+
+def row_to_card(row: sqlite3.Row) -> Dict:
+    return {name: row[name] for name in _COLUMNS}
+
+
+def migrate_json(path: Path = DATA_FILE, conn: Optional[sqlite3.Connection] = None) -> int:
+    """Import cards from a legacy JSON deck; return how many were added.
+
+    Cards whose id already exists are left untouched, so re-running the
+    migration is harmless.
+    """
+    cards = json.loads(Path(path).read_text() or "[]")
+    rows = []
+    for card in cards:
+        next_review = card.get("next_review") or to_iso(datetime.utcnow())
+        rows.append((
+            card.get("id") or str(uuid.uuid4()),
+            card.get("user_id", ""),
+            card.get("deck_id", ""),
+            card["front"],
+            card["back"],
+            card.get("interval", 1),
+            to_iso(datetime.fromisoformat(next_review)),
+            card.get("difficulty", 0),
+        ))
+    with _transaction(conn) as conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO cards (id, user_id, deck_id, front, back,"
+            " interval, next_review, difficulty) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        added = conn.total_changes - before
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+            (to_iso(datetime.utcnow()),),
+        )
+    return added
+
+
+def add_flashcards(cards: List[Dict], user_id: str = "", deck_id: str = "") -> List[Dict]:
     now = datetime.utcnow()
     new_cards = []
     for card in cards:
         entry = {
             "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "deck_id": deck_id,
             "front": card["front"],
             "back": card["back"],
             "interval": 1,
-            "next_review": now.isoformat(),
+            "next_review": to_iso(now),
             "difficulty": card.get("difficulty", 0),
         }
-        existing.append(entry)
         new_cards.append(entry)
-    _save_cards(existing)
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT INTO cards (id, user_id, deck_id, front, back, interval,"
+            " next_review, difficulty) VALUES (:id, :user_id, :deck_id, :front,"
+            " :back, :interval, :next_review, :difficulty)",
+            new_cards,
+        )
     return new_cards
 
 
 def get_due_flashcards() -> List[Dict]:
-    cards = _load_cards()
-    now = datetime.utcnow().isoformat()
-    return [c for c in cards if c["next_review"] <= now]
+    now = to_iso(datetime.utcnow())
+    rows = get_connection().execute(
+        "SELECT * FROM cards WHERE next_review <= ? ORDER BY next_review", (now,)
+    )
+    return [row_to_card(row) for row in rows]
+
+
+MAX_BATCH_REVIEWS = 1000
+
+
+def _apply_review(c: Dict, feedback: str, reviewed_at: datetime) -> Dict:
+    if feedback == "easy":
+        c["interval"] = c.get("interval", 1) * 2
+    elif feedback == "hard":
+        c["interval"] = 1
+    next_time = reviewed_at + timedelta(days=c["interval"])
+    c["next_review"] = to_iso(next_time)
+    c["difficulty"] = 0 if feedback == "easy" else 1
+    return c
+
+
+_UPDATE_REVIEW = (
+    "UPDATE cards SET interval = :interval, next_review = :next_review,"
+    " difficulty = :difficulty WHERE id = :id"
+)
 
 
 def update_flashcard(card_id: str, feedback: str) -> Dict:
-    cards = _load_cards()
     now = datetime.utcnow()
-    updated = None
-    for c in cards:
-        if c["id"] == card_id:
-            if feedback == "easy":
-                c["interval"] = c.get("interval", 1) * 2
-            elif feedback == "hard":
-                c["interval"] = 1
-            next_time = now + timedelta(days=c["interval"])
-            c["next_review"] = next_time.isoformat()
-            c["difficulty"] = 0 if feedback == "easy" else 1
-            updated = c
-            break
-    if updated:
-        _save_cards(cards)
-    return updated
+    with _transaction() as conn:
+        row = conn.execute("SELECT * FROM cards WHERE id = ?", (card_id,)).fetchone()
+        if row is None:
+            return None
+        c = _apply_review(row_to_card(row), feedback, now)
+        conn.execute(_UPDATE_REVIEW, c)
+    return c
+
+
+def _as_utc(moment: Optional[datetime], default: datetime) -> datetime:
+    if moment is None:
+        return default
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, default)
+
+
+def update_flashcards_batch(reviews: List[Dict]) -> List[Dict]:
+    """Apply many reviews (e.g. an offline session) in one transaction.
+
+    Each review has ``card_id``, ``feedback`` and an optional ``reviewed_at``
+    (defaults to now; future times are clamped to now). Reviews are replayed
+    in ``reviewed_at`` order so repeated reviews of a card compound, and the
+    next review is scheduled from the original review time. Returns one
+    result per input, in input order, with ``status`` ``updated`` or
+    ``not_found``.
+    """
+    now = datetime.utcnow()
+    ids = list({review["card_id"] for review in reviews})
+    with _transaction() as conn:
+        cards: Dict[str, Dict] = {}
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ", ".join("?" * len(batch))
+            for row in conn.execute(f"SELECT * FROM cards WHERE id IN ({marks})", batch):
+                cards[row["id"]] = row_to_card(row)
+
+        results: List[Dict] = [None] * len(reviews)
+        order = sorted(
+            range(len(reviews)),
+            key=lambda i: _as_utc(reviews[i].get("reviewed_at"), now),
+        )
+        for i in order:
+            review = reviews[i]
+            card = cards.get(review["card_id"])
+            if card is None:
+                results[i] = {"card_id": review["card_id"], "status": "not_found"}
+                continue
+            reviewed_at = _as_utc(review.get("reviewed_at"), now)
+            _apply_review(card, review["feedback"], reviewed_at)
+            results[i] = {
+                "card_id": review["card_id"],
+                "status": "updated",
+                "card": dict(card),
+            }
+        touched = {r["card_id"] for r in results if r["status"] == "updated"}
+        conn.executemany(_UPDATE_REVIEW, [cards[card_id] for card_id in touched])
+    return results
+
+
+if __name__ == "__main__":
+    # python -m app.services.srs [path/to/cards.json]
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else DATA_FILE
+    added = migrate_json(source)
+    total = get_connection().execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+    print(f"Imported {added} new cards from {source}; {DB_FILE} holds {total}")
@@ -0,0 +1,440 @@
+"""Speech-to-text for uploads.
+
+Long recordings are split with ffmpeg at silences into segments of bounded
+duration, the segments are transcribed concurrently by the configured
+backend, and the texts are stitched back together with their timestamps.
+A segment that fails is retried on its own; the others are not redone.
+"""
+import os
+import re
+import time
+import shlex
+import random
+import logging
+import tempfile
+import threading
+import subprocess
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.utils.lazy import register
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_TRANSCRIBE_MODEL = os.getenv("OPENAI_TRANSCRIBE_MODEL", "whisper-1")
+TRANSCRIBE_BACKEND = os.getenv("TRANSCRIBE_BACKEND", "openai")
+# Longest segment sent to the backend in one request
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "300"))
+# Do not cut at a silence that would leave a segment shorter than this
+TRANSCRIBE_MIN_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_MIN_SEGMENT_SECONDS", "30"))
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+TRANSCRIBE_ATTEMPTS = int(os.getenv("TRANSCRIBE_ATTEMPTS", "3"))
+# Files above this are always split (OpenAI rejects requests over 25 MB)
+TRANSCRIBE_MAX_REQUEST_BYTES = int(
+    os.getenv("TRANSCRIBE_MAX_REQUEST_BYTES", str(24 * 1024 * 1024))
+)
+# Local faster-whisper (CTranslate2) engine, used with TRANSCRIBE_BACKEND=local
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_DEVICE = os.getenv("LOCAL_WHISPER_DEVICE", "cpu")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+# CPU threads per transcription; 0 lets CTranslate2 decide
+LOCAL_WHISPER_THREADS = int(os.getenv("LOCAL_WHISPER_THREADS", "0"))
+# Transcriptions the model may run at the same time (one per segment)
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", "1"))
+LOCAL_WHISPER_BEAM_SIZE = int(os.getenv("LOCAL_WHISPER_BEAM_SIZE", "5"))
+LOCAL_WHISPER_LANGUAGE = os.getenv("LOCAL_WHISPER_LANGUAGE", "") or None
+SILENCE_NOISE_DB = os.getenv("SILENCE_NOISE_DB", "-35dB")
+SILENCE_MIN_SECONDS = float(os.getenv("SILENCE_MIN_SECONDS", "0.5"))
+
+
+@dataclass
+class Segment:
+    """A time range of the source recording, in seconds."""
+
+    index: int
+    start: float
+    end: float
+    path: Optional[str] = None
+    text: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class TranscriptionBackend(ABC):
+    """Turns one audio file into text."""
+
+    name = "base"
+
+    @abstractmethod
+    def transcribe(self, path: str) -> str:
+        """Text spoken in the audio file at ``path``."""
+
+    def describe(self) -> str:
+        """Identifies the backend and model, e.g. to key stored transcripts."""
+        return self.name
+
+    def warm(self) -> None:
+        """Load whatever the first request would otherwise have to load."""
+
+
+def _convert_to_wav16k(src_path: str) -> str:
+    """
+    Optional fallback: convert any audio to 16 kHz mono WAV using ffmpeg,
+    then return the new path.
+    """
+    dst = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
+    cmd = f'ffmpeg -y -i {shlex.quote(src_path)} -vn -ac 1 -ar 16000 -f wav {shlex.quote(dst)}'
+    subprocess.run(shlex.split(cmd), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return dst
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the OpenAI client used for transcription, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                _client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    return _client
+
+
+class OpenAIBackend(TranscriptionBackend):
+    """Whisper over the OpenAI ``/audio/transcriptions`` API."""
+
+    name = "openai"
+
+    def __init__(self, model: str = OPENAI_TRANSCRIBE_MODEL):
+        self.model = model
+        # Warn (do NOT crash) if pointing to a non-official server (OSS usually lacks /v1/audio/transcriptions)
+        if OPENAI_BASE_URL.rstrip("/") != "https://api.openai.com/v1":
+            logger.warning(
+                "OPENAI_BASE_URL is %s (non-official). Most OSS servers do NOT support /v1/audio/transcriptions. "
+                "Use https://api.openai.com/v1 for Whisper.",
+                OPENAI_BASE_URL,
+            )
+        if not OPENAI_API_KEY:
+            logger.warning("OPENAI_API_KEY is empty; transcription will fail with 401.")
+        logger.info("Transcription model=%s base_url=%s", model, OPENAI_BASE_URL)
+
+    def describe(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    def warm(self) -> None:
+        get_client()
+
+    def _create(self, path: str) -> str:
+        with open(path, "rb") as fh:
+            resp = get_client().audio.transcriptions.create(model=self.model, file=fh)
+        return getattr(resp, "text", None) or (resp.get("text") if isinstance(resp, dict) else None) or ""
+
+    def transcribe(self, path: str) -> str:
+        try:
+            # Send as-is first so OpenAI can detect the format by suffix
+            return self._create(path)
+        except Exception as e:
+            # If the format is not recognized, convert to WAV 16k and retry once
+            if "Unrecognized file format" not in str(e):
+                raise
+        wav_path = _convert_to_wav16k(path)
+        try:
+            return self._create(wav_path)
+        finally:
+            Path(wav_path).unlink(missing_ok=True)
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """faster-whisper (CTranslate2) running in this process.
+
+    The model is loaded once, on first use or :meth:`warm`, and kept in
+    memory. ``cpu_threads`` bounds the threads one transcription uses and
+    ``num_workers`` how many transcriptions (segments) run at once, so
+    ``cpu_threads * num_workers`` should not exceed the cores available.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model: str = LOCAL_WHISPER_MODEL,
+        device: str = LOCAL_WHISPER_DEVICE,
+        compute_type: str = LOCAL_WHISPER_COMPUTE_TYPE,
+        cpu_threads: int = LOCAL_WHISPER_THREADS,
+        num_workers: int = LOCAL_WHISPER_WORKERS,
+        beam_size: int = LOCAL_WHISPER_BEAM_SIZE,
+        language: Optional[str] = LOCAL_WHISPER_LANGUAGE,
+    ):
+        self.model_name = model
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.beam_size = beam_size
+        self.language = language
+        self._model = None
+        self._lock = threading.Lock()
+
+    def describe(self) -> str:
+        return f"{self.name}:{self.model_name}:{self.compute_type}"
+
+    def warm(self) -> None:
+        if self._model is not None:
+            return
+        with self._lock:
+            if self._model is not None:
+                return
+            try:
+                from faster_whisper import WhisperModel
+            except ImportError:
+                raise RuntimeError(
+                    "TRANSCRIBE_BACKEND=local needs the faster-whisper package"
+                )
+            started = time.perf_counter()
+            self._model = WhisperModel(
+                self.model_name,
+                device=self.device,
+                compute_type=self.compute_type,
+                cpu_threads=self.cpu_threads,
+                num_workers=self.num_workers,
+            )
+            logger.info(
+                "Loaded faster-whisper %s (%s, %s, %d threads) in %.1fs",
+                self.model_name, self.device, self.compute_type,
+                self.cpu_threads, time.perf_counter() - started,
+            )
+
+    def transcribe(self, path: str) -> str:
+        self.warm()
+        segments, _ = self._model.transcribe(
+            path, beam_size=self.beam_size, language=self.language
+        )
+        # ``segments`` is lazy; decoding happens while it is consumed
+        return " ".join(segment.text.strip() for segment in segments)
+
+
+class StubBackend(TranscriptionBackend):
+    """Offline backend for tests and local development.
+
+    ``text_for(path)`` produces each transcript and may raise to simulate a
+    failed request; by default the text names the file.
+    """
+
+    name = "stub"
+
+    def __init__(self, text_for: Optional[Callable[[str], str]] = None):
+        self.text_for = text_for or (lambda path: f"transcript of {Path(path).name}")
+        self.calls: List[str] = []
+
+    def transcribe(self, path: str) -> str:
+        self.calls.append(path)
+        return self.text_for(path)
+
+
+# Backend chosen with TRANSCRIBE_BACKEND
+BACKENDS: Dict[str, Callable[[], TranscriptionBackend]] = {
+    "openai": OpenAIBackend,
+    "local": LocalWhisperBackend,
+    "stub": StubBackend,
+}
+
+_backend: Optional[TranscriptionBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> TranscriptionBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if TRANSCRIBE_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown transcription backend: {TRANSCRIBE_BACKEND}")
+                _backend = BACKENDS[TRANSCRIBE_BACKEND]()
+    return _backend
+
+
+register("transcription", lambda: get_backend().warm())
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """Duration of a media file in seconds, or ``None`` if ffprobe cannot tell."""
+    cmd = [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", str(path),
+    ]
+    try:
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=60)
+        return float(out.stdout.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+
+_SILENCE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+
+def detect_silences(path: str) -> List[Tuple[float, float]]:
+    """(start, end) of every silence ffmpeg's ``silencedetect`` finds."""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-nostats", "-i", str(path), "-vn",
+        "-af", f"silencedetect=noise={SILENCE_NOISE_DB}:d={SILENCE_MIN_SECONDS}",
+        "-f", "null", "-",
+    ]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    silences, start = [], None
+    for kind, value in _SILENCE.findall(out.stderr):
+        if kind == "start":
+            start = max(0.0, float(value))
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    return silences
+
+
+def plan_segments(
+    duration: float,
+    silences: List[Tuple[float, float]],
+    max_seconds: float = TRANSCRIBE_SEGMENT_SECONDS,
+    min_seconds: float = TRANSCRIBE_MIN_SEGMENT_SECONDS,
+) -> List[Segment]:
+    """Cut ``[0, duration]`` into segments no longer than ``max_seconds``.
+
+    Each cut is made in the middle of the last silence that fits, so words
+    are not split; with no usable silence the segment is cut at
+    ``max_seconds``.
+    """
+    cuts = sorted((start + end) / 2 for start, end in silences)
+    segments: List[Segment] = []
+    start = 0.0
+    while duration - start > max_seconds:
+        limit = start + max_seconds
+        fitting = [c for c in cuts if start + min_seconds <= c <= limit]
+        end = fitting[-1] if fitting else limit
+        segments.append(Segment(len(segments), start, end))
+        start = end
+    segments.append(Segment(len(segments), start, duration))
+    return segments
+
+
+def _extract_segment(src: str, segment: Segment, workdir: str) -> str:
+    path = os.path.join(workdir, f"segment-{segment.index:04d}.mp3")
+    cmd = [
+        "ffmpeg", "-y", "-ss", f"{segment.start:.3f}", "-t", f"{segment.duration:.3f}",
+        "-i", str(src), "-vn", "-ac", "1", "-ar", "16000", "-b:a", "64k", path,
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return path
+
+
+def _is_transient(exc: Exception) -> bool:
+    """Whether a failed segment may succeed if sent again.
+
+    Connection errors, timeouts, rate limits and server errors are retried;
+    anything else (a bad key, an unsupported file, no ffmpeg) is not.
+    """
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    if isinstance(exc, (ConnectionError, TimeoutError, subprocess.TimeoutExpired)):
+        return True
+    try:
+        from openai import APIConnectionError
+    except ImportError:
+        return False
+    # Also covers APITimeoutError
+    return isinstance(exc, APIConnectionError)
+
+
+def transcribe_segments(
+    src: str,
+    segments: List[Segment],
+    backend: TranscriptionBackend,
+    workdir: str,
+    extract: Callable[[str, Segment, str], str] = _extract_segment,
+) -> List[Segment]:
+    """Transcribe ``segments`` concurrently, retrying only the failed ones.
+
+    Up to ``TRANSCRIBE_CONCURRENCY`` segments are cut and transcribed at a
+    time. After each round the segments that hit a transient error are
+    retried (with backoff) up to ``TRANSCRIBE_ATTEMPTS`` rounds in total; the
+    last error is raised if any segment still fails. Any other error is
+    raised at once.
+    """
+    def run(segment: Segment) -> None:
+        if segment.path is None:
+            segment.path = extract(src, segment, workdir)
+        segment.text = backend.transcribe(segment.path).strip()
+
+    attempts = max(1, TRANSCRIBE_ATTEMPTS)
+    pending = list(segments)
+    workers = max(1, min(TRANSCRIBE_CONCURRENCY, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stt") as pool:
+        for attempt in range(attempts):
+            futures = [(segment, pool.submit(run, segment)) for segment in pending]
+            failed, last_error = [], None
+            for segment, future in futures:
+                try:
+                    future.result()
+                except Exception as exc:
+                    if not _is_transient(exc):
+                        for _, other in futures:
+                            other.cancel()
+                        raise
+                    failed.append(segment)
+                    last_error = exc
+            if not failed:
+                return segments
+            logger.warning(
+                "%d of %d segments failed (attempt %d): %s",
+                len(failed), len(segments), attempt + 1, last_error,
+            )
+            pending = failed
+            if attempt + 1 < attempts:
+                time.sleep(min(8.0, 0.5 * 2 ** attempt) + random.random() * 0.25)
+    raise last_error
+
+
+def stitch(segments: List[Segment]) -> dict:
+    """Join segment texts in order, keeping each segment's time range."""
+    return {
+        "text": " ".join(s.text for s in segments if s.text),
+        "segments": [
+            {"index": s.index, "start": round(s.start, 2), "end": round(s.end, 2), "text": s.text}
+            for s in segments
+        ],
+    }
+
+
+def transcribe_file(path, backend: Optional[TranscriptionBackend] = None) -> dict:
+    """Transcribe an audio file; return ``{"text", "segments"}``.
+
+    Short files (at most ``TRANSCRIBE_SEGMENT_SECONDS`` long and small
+    enough for one request) are sent as they are. Longer ones are split on
+    silence and transcribed in parallel.
+    """
+    backend = backend or get_backend()
+    path = str(path)
+    duration = probe_duration(path)
+    small = os.path.getsize(path) <= TRANSCRIBE_MAX_REQUEST_BYTES
+    if duration is None or (duration <= TRANSCRIBE_SEGMENT_SECONDS and small):
+        segment = Segment(0, 0.0, duration or 0.0, path=path)
+        with tempfile.TemporaryDirectory(prefix="stt-") as workdir:
+            return stitch(transcribe_segments(path, [segment], backend, workdir))
+
+    segments = plan_segments(duration, detect_silences(path))
+    logger.info(
+        "Transcribing %.0fs of audio as %d segments with %s",
+        duration, len(segments), backend.describe(),
+    )
+    with tempfile.TemporaryDirectory(prefix="stt-") as workdir:
+        return stitch(transcribe_segments(path, segments, backend, workdir))
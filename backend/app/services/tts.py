@@ -1,6 +1,9 @@
 import uuid
 from pathlib import Path
-from gtts import gTTS
+
+from app.utils.lazy import lazy_import
+
+gtts = lazy_import("gtts", service="tts")
 
 TMP_DIR = Path('/tmp')
 
@@ -8,6 +11,6 @@ TMP_DIR = Path('/tmp')
 def text_to_speech(text: str) -> Path:
     TMP_DIR.mkdir(parents=True, exist_ok=True)
     filename = TMP_DIR / f"tts_{uuid.uuid4().hex}.mp3"
-    tts = gTTS(text)
+    tts = gtts.gTTS(text)
     tts.save(str(filename))
     return filename
@@ -0,0 +1,142 @@
+"""Per-provider circuit breakers and latency tracking for LLM calls.
+
+A provider that keeps failing is taken out of rotation: after
+``LLM_BREAKER_FAILURES`` consecutive failures its breaker opens and calls
+skip it without waiting. Once ``LLM_BREAKER_RESET_SECONDS`` have passed a
+single probe call is let through (half-open); its success closes the
+breaker, its failure keeps it open for another period. The latencies of
+successful calls give the p95 used to decide when to hedge a request.
+"""
+import os
+import time
+import math
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+# Successful call latencies kept per provider, and how many are needed
+# before a p95 is reported
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_LATENCY_MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", "20"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Failure counter that stops calls to an unhealthy provider."""
+
+    def __init__(
+        self,
+        name: str,
+        failures: Optional[int] = None,
+        reset_seconds: Optional[float] = None,
+        window: Optional[int] = None,
+    ):
+        self.name = name
+        self.max_failures = failures or LLM_BREAKER_FAILURES
+        self.reset_seconds = LLM_BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=window or LLM_LATENCY_WINDOW)
+        self.successes = 0
+        self.failed = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def available(self) -> bool:
+        """Whether a call would be let through, without claiming it."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            return time.monotonic() - self._opened_at >= self.reset_seconds
+
+    def allow(self) -> bool:
+        """Claim a call; ``False`` if the breaker is open.
+
+        After the reset period one probe goes through and the breaker is
+        half-open; further calls are refused until the probe reports back
+        (or another period passes without an answer).
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._opened_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("LLM provider %s recovered; closing its circuit", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.successes += 1
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failed += 1
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= self.max_failures
+            ):
+                if self.state == CLOSED:
+                    logger.warning(
+                        "LLM provider %s failed %d times in a row; opening its circuit",
+                        self.name, self.failures,
+                    )
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency below which ``q`` of recent successful calls finished."""
+        with self._lock:
+            if len(self._latencies) < LLM_LATENCY_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def stats(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "successes": self.successes,
+                "failures": self.failed,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "p50_seconds": None if p50 is None else round(p50, 3),
+                "p95_seconds": None if p95 is None else round(p95, 3),
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider)
+    if breaker is not None:
+        return breaker
+    with _breakers_lock:
+        return _breakers.setdefault(provider, CircuitBreaker(provider))
+
+
+def stats() -> dict:
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
@@ -0,0 +1,196 @@
+"""Upload ingestion: spool request bodies to disk in chunks while hashing them.
+
+Uploads are copied once, ``INGEST_CHUNK_BYTES`` at a time, into a named file
+whose path is handed to PyMuPDF, pdf2image and ffmpeg, so a large upload is
+never held in memory. :class:`BodySizeLimit` rejects oversize upload bodies
+while they are still arriving.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(100 * 1024 * 1024)))
+INGEST_CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", str(1024 * 1024)))
+# Multipart framing and form fields sent along with the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    """An upload stored as a file on disk, with its size and SHA-256."""
+
+    path: Path
+    size: int
+    sha256: str
+    filename: str
+    content_type: str
+    # False when the upload already lived in a file we must not delete
+    owned: bool = True
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
+
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
+
+    def cleanup(self) -> None:
+        if self.owned:
+            self.path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+
+def _too_large(size: int) -> HTTPException:
+    logger.info("File too large: %s bytes", size)
+    return HTTPException(status_code=400, detail="File too large")
+
+
+def _existing_path(upload_file) -> Optional[Path]:
+    # Uploads replayed from disk (e.g. queued jobs) already have a real file
+    name = getattr(upload_file.file, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return Path(name)
+    return None
+
+
+def _hash_file(path: Path, max_bytes: int) -> tuple:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(INGEST_CHUNK_BYTES), b""):
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(size)
+            digest.update(chunk)
+    return size, digest.hexdigest()
+
+
+def spool_upload(
+    upload_file,
+    max_bytes: int = MAX_MEDIA_BYTES,
+    dest: Optional[Path] = None,
+    default_suffix: str = "",
+) -> SpooledUpload:
+    """Copy ``upload_file`` to disk in fixed-size chunks, hashing as it goes.
+
+    Raises ``HTTPException(400, "File too large")`` as soon as more than
+    ``max_bytes`` have been read and removes the partial file. The file keeps
+    the upload's suffix so tools that sniff formats by extension work. When
+    the upload is already a file on disk and no ``dest`` is given, it is
+    only hashed, not copied.
+    """
+    filename = upload_file.filename or ""
+    content_type = upload_file.content_type or ""
+    existing = _existing_path(upload_file)
+    if existing is not None and dest is None:
+        size, sha256 = _hash_file(existing, max_bytes)
+        return SpooledUpload(existing, size, sha256, filename, content_type, owned=False)
+
+    if dest is None:
+        suffix = Path(filename).suffix or default_suffix
+        fd, name = tempfile.mkstemp(suffix=suffix)
+        out = os.fdopen(fd, "wb")
+        dest = Path(name)
+    else:
+        dest = Path(dest)
+        out = open(dest, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with out:
+            upload_file.file.seek(0)
+            for chunk in iter(lambda: upload_file.file.read(INGEST_CHUNK_BYTES), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(size)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        raise
+    return SpooledUpload(dest, size, digest.hexdigest(), filename, content_type)
+
+
+class BodySizeLimit:
+    """ASGI middleware that stops reading upload bodies past a size limit.
+
+    A ``Content-Length`` over the limit is rejected before the body is read;
+    chunked bodies are counted as they arrive and cut off at the limit, so
+    the multipart parser never buffers an oversize upload. Only requests to
+    ``paths`` are limited.
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int = MAX_MEDIA_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": "File too large"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 400,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Stop feeding the parser; the app's error is replaced below
+                    exceeded = True
+                    logger.info("Upload to %s cut off after %d bytes", scope["path"], received)
+                    return {"type": "http.disconnect"}
+            return message
+
+        rejected = False
+
+        async def checked_send(message):
+            nonlocal rejected
+            if not exceeded:
+                await send(message)
+            elif message["type"] == "http.response.start" and not rejected:
+                rejected = True
+                await self._reject(send)
+
+        try:
+            await self.app(scope, limited_receive, checked_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not rejected:
+            await self._reject(send)
@@ -0,0 +1,102 @@
+"""Deferred loading of heavy dependencies.
+
+Modules such as spaCy, PyMuPDF or WeasyPrint take most of the API's start-up
+time but are only needed by a few endpoints. Services import them through
+:func:`lazy_import` (or register their own loader) so they are loaded on
+first use, and :func:`start_warm_up` can load chosen ones in the background
+once the app is already serving.
+"""
+import time
+import types
+import logging
+import importlib
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Service name -> loaders that initialise it
+_services: Dict[str, List[Callable[[], Any]]] = {}
+_ready: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+        self.__dict__["_lazy_lock"] = threading.Lock()
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with self.__dict__["_lazy_lock"]:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def register(service: str, loader: Callable[[], Any]) -> None:
+    """Add ``loader`` to the steps that warm up ``service``."""
+    with _lock:
+        _services.setdefault(service, []).append(loader)
+
+
+def lazy_import(name: str, service: Optional[str] = None) -> LazyModule:
+    """Return a proxy for module ``name`` and register it under ``service``."""
+    module = LazyModule(name)
+    register(service or name, module._load)
+    return module
+
+
+def services() -> Dict[str, bool]:
+    """Registered services and whether each has been warmed up."""
+    with _lock:
+        return {name: name in _ready for name in _services}
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """Load the given services (all when ``None``); return seconds per service.
+
+    Failures are logged and skipped so a missing optional dependency only
+    affects the endpoints that need it.
+    """
+    with _lock:
+        selected = list(_services) if names is None else list(names)
+    timings: Dict[str, float] = {}
+    for name in selected:
+        loaders = _services.get(name)
+        if not loaders:
+            logger.warning("Unknown service %r in warm-up list", name)
+            continue
+        start = time.perf_counter()
+        try:
+            for loader in loaders:
+                loader()
+        except Exception as exc:
+            logger.warning("Warm-up of %s failed: %s", name, exc)
+            continue
+        timings[name] = time.perf_counter() - start
+        with _lock:
+            _ready[name] = timings[name]
+        logger.info("Warmed up %s in %.2fs", name, timings[name])
+    return timings
+
+
+def start_warm_up(names: Optional[Iterable[str]] = None) -> threading.Thread:
+    """Run :func:`warm_up` on a daemon thread and return the thread."""
+    thread = threading.Thread(
+        target=warm_up, args=(names,), name="warm-up", daemon=True
+    )
+    thread.start()
+    return thread
@@ -1,29 +1,23 @@
-import os, time, random, json
+import os, time, random, json, asyncio, threading, weakref, hashlib
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 from dotenv import load_dotenv
 import logging
-from typing import List
+from typing import AsyncIterator, List, Optional
 from fastapi import HTTPException
+import httpx
 
-# Anthropic
-import anthropic
-from anthropic import (
-    APIStatusError as AnthropicAPIStatusError,
-    RateLimitError as AnthropicRateLimitError,
-)
-
-# OpenAI (python >=1.x)
-from openai import OpenAI
-from openai import (
-    APIConnectionError as OpenAIConnError,
-    RateLimitError as OpenAIRateLimitError,
-    APIError as OpenAIAPIError,
-)
+from app.utils.cache import LRUCache, SQLiteCache, TieredCache
+from app.utils import circuit, ratelimit, tokens
+from app.utils.lazy import lazy_import
+from app.utils.mapreduce import MAP_CONCURRENCY
+from app.utils.singleflight import SingleFlight
 
-try:
-    import tiktoken  # type: ignore
-except Exception:  # pragma: no cover - optional dependency
-    tiktoken = None
+# Provider SDKs (OpenAI python >=1.x) are imported on the first LLM call
+anthropic = lazy_import("anthropic", service="llm")
+openai = lazy_import("openai", service="llm")
 
 # Load API key from backend/.env
 env_path = Path(__file__).resolve().parents[2] / '.env'
@@ -36,87 +30,159 @@ DEFAULT_OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 logger = logging.getLogger(__name__)
 
-MAX_MODEL_TOKENS = 200_000
+# Inputs up to this size are sent in one call; app.services.planner splits
+# longer ones into chunks
+LLM_MAX_INPUT_TOKENS = int(os.getenv("LLM_MAX_INPUT_TOKENS", "12000"))
+
+# Connection pool limits shared by the long-lived provider clients
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "256"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "64"))
+LLM_MAX_ATTEMPTS = 5
+LLM_MAX_TOKENS = 1200
+LLM_TEMPERATURE = 0.2
+
+# Response cache: in-memory LRU, plus an SQLite tier when LLM_CACHE_PATH is set
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Hedged requests: when the primary provider has not answered within this
+# percentile of its recent latencies, ask the fallback too and keep the
+# first answer
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Sync calls that can be hedged at once need a thread each for the primary
+# and the backup; calls beyond that run unhedged on the caller's thread
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", str(2 * MAP_CONCURRENCY)))
+
+_retryable: tuple = ()
+
+
+def _retryable_errors() -> tuple:
+    global _retryable
+    if not _retryable:
+        _retryable = (
+            anthropic.APIStatusError,
+            anthropic.RateLimitError,
+            openai.APIError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+        )
+    return _retryable
+
+
+def _model_for(provider: str) -> str:
+    if provider == "openai":
+        return os.getenv("OPENAI_MODEL", DEFAULT_OPENAI_MODEL)
+    return os.getenv("ANTHROPIC_MODEL", DEFAULT_ANTHROPIC_MODEL)
 
 
-def _encoding():
-    """Return tiktoken encoding for the active model if available."""
-    if not tiktoken:
-        return None
+def _active_model() -> str:
+    return _model_for((os.getenv("LLM_PROVIDER") or "anthropic").lower())
+
+
+def llm_model_id() -> str:
+    """``provider:model`` answering first; keys stored LLM output."""
     provider = (os.getenv("LLM_PROVIDER") or "anthropic").lower()
-    if provider == "openai":
-        model = os.getenv("OPENAI_MODEL", DEFAULT_OPENAI_MODEL)
-    else:
-        model = os.getenv("ANTHROPIC_MODEL", DEFAULT_ANTHROPIC_MODEL)
-    try:
-        return tiktoken.encoding_for_model(model)
-    except Exception:
-        return tiktoken.get_encoding("cl100k_base")
+    return f"{provider}:{_model_for(provider)}"
 
 
 def estimate_tokens(text: str) -> int:
-    """Estimate token count for text using tiktoken when possible."""
-    enc = _encoding()
-    if enc:
-        try:
-            return len(enc.encode(text))
-        except Exception:
-            pass
-    # Fallback rough estimate (4 chars per token)
-    return max(1, len(text) // 4)
+    """Token count of ``text`` for the active model."""
+    return tokens.count_tokens(text, _active_model())
 
 
 def truncate_text_to_tokens(text: str, max_tokens: int) -> str:
     """Truncate text to the given number of tokens."""
-    if estimate_tokens(text) <= max_tokens:
-        return text
-    enc = _encoding()
-    if enc:
-        tokens = enc.encode(text)[:max_tokens]
-        return enc.decode(tokens)
-    words = text.split()
-    result = []
-    count = 0
-    for w in words:
-        token_len = estimate_tokens(w + " ")
-        if count + token_len > max_tokens:
-            break
-        result.append(w)
-        count += token_len
-    return " ".join(result)
-
-
-def split_text_into_chunks(text: str, max_tokens: int = 10_000):
+    return tokens.truncate_to_tokens(text, max_tokens, _active_model())
+
+
+def split_text_into_chunks(
+    text: str, max_tokens: int = 10_000, overlap: int = tokens.CHUNK_OVERLAP_TOKENS
+):
     """Split text into chunks each under `max_tokens` tokens."""
-    if estimate_tokens(text) <= max_tokens:
-        return [text]
-    words = text.split()
-    chunks = []
-    current = []
-    count = 0
-    for w in words:
-        tlen = estimate_tokens(w + " ")
-        if tlen > max_tokens:
-            raise ValueError("Token limit too small for given text")
-        if count + tlen > max_tokens:
-            chunks.append(" ".join(current))
-            current = [w]
-            count = tlen
-        else:
-            current.append(w)
-            count += tlen
-    if current:
-        chunks.append(" ".join(current))
-    return chunks
-
-
-def _anthropic_ask(prompt: str) -> str:
-    client = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
-    resp = client.messages.create(
-        model=os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-latest"),
-        max_tokens=1200,
-        messages=[{"role": "user", "content": prompt}],
+    return tokens.split_into_chunks(text, max_tokens, overlap, _active_model())
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
     )
+
+
+_sync_clients: dict = {}
+_sync_clients_lock = threading.Lock()
+# Async clients hold connections bound to the event loop that opened them,
+# so keep one set per running loop.
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _get_client(provider: str):
+    """Return the process-wide blocking client for ``provider``."""
+    client = _sync_clients.get(provider)
+    if client is not None:
+        return client
+    with _sync_clients_lock:
+        client = _sync_clients.get(provider)
+        if client is None:
+            if provider == "anthropic":
+                client = anthropic.Anthropic(
+                    api_key=os.environ["ANTHROPIC_API_KEY"],
+                    http_client=anthropic.DefaultHttpxClient(limits=_http_limits()),
+                    max_retries=0,
+                )
+            else:
+                client = openai.OpenAI(
+                    api_key=os.environ["OPENAI_API_KEY"],
+                    http_client=openai.DefaultHttpxClient(limits=_http_limits()),
+                    max_retries=0,
+                )
+            _sync_clients[provider] = client
+    return client
+
+
+def _get_async_client(provider: str):
+    """Return the async client for ``provider`` bound to the running loop."""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(provider)
+    if client is None:
+        if provider == "anthropic":
+            client = anthropic.AsyncAnthropic(
+                api_key=os.environ["ANTHROPIC_API_KEY"],
+                http_client=anthropic.DefaultAsyncHttpxClient(limits=_http_limits()),
+                max_retries=0,
+            )
+        else:
+            client = openai.AsyncOpenAI(
+                api_key=os.environ["OPENAI_API_KEY"],
+                http_client=openai.DefaultAsyncHttpxClient(limits=_http_limits()),
+                max_retries=0,
+            )
+        clients[provider] = client
+    return client
+
+
+async def close_async_clients() -> None:
+    """Close the async clients opened on the running loop (app shutdown)."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def _anthropic_request(prompt: str, max_tokens: int, temperature: float) -> dict:
+    return {
+        "model": _model_for("anthropic"),
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+
+
+def _anthropic_text(resp) -> str:
     # Concatenate text blocks
     chunks: List[str] = []
     for part in getattr(resp, "content", []) or []:
@@ -125,61 +191,547 @@ def _anthropic_ask(prompt: str) -> str:
     return "".join(chunks).strip()
 
 
-def _openai_ask(prompt: str) -> str:
-    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-    resp = client.chat.completions.create(
-        model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2,
+def _openai_request(prompt: str, max_tokens: int, temperature: float) -> dict:
+    return {
+        "model": _model_for("openai"),
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+
+
+def _anthropic_ask(prompt: str, max_tokens: int, temperature: float) -> str:
+    resp = _get_client("anthropic").messages.create(
+        **_anthropic_request(prompt, max_tokens, temperature)
+    )
+    return _anthropic_text(resp)
+
+
+def _openai_ask(prompt: str, max_tokens: int, temperature: float) -> str:
+    resp = _get_client("openai").chat.completions.create(
+        **_openai_request(prompt, max_tokens, temperature)
     )
     return resp.choices[0].message.content.strip()
 
 
-def ask_llm(prompt: str) -> str:
-    """
-    Ask the primary provider first with retries on transient failures.
-    If all attempts fail, try the fallback provider (if set) with the same policy.
-    Raise HTTPException(503) if neither succeeds.
-    """
+async def _async_anthropic_ask(prompt: str, max_tokens: int, temperature: float) -> str:
+    client = _get_async_client("anthropic")
+    resp = await client.messages.create(
+        **_anthropic_request(prompt, max_tokens, temperature)
+    )
+    return _anthropic_text(resp)
+
+
+async def _async_openai_ask(prompt: str, max_tokens: int, temperature: float) -> str:
+    client = _get_async_client("openai")
+    resp = await client.chat.completions.create(
+        **_openai_request(prompt, max_tokens, temperature)
+    )
+    return resp.choices[0].message.content.strip()
+
 
+async def _async_anthropic_stream(
+    prompt: str, max_tokens: int, temperature: float
+) -> AsyncIterator[str]:
+    client = _get_async_client("anthropic")
+    async with client.messages.stream(
+        **_anthropic_request(prompt, max_tokens, temperature)
+    ) as stream:
+        async for text in stream.text_stream:
+            yield text
+
+
+async def _async_openai_stream(
+    prompt: str, max_tokens: int, temperature: float
+) -> AsyncIterator[str]:
+    client = _get_async_client("openai")
+    stream = await client.chat.completions.create(
+        **_openai_request(prompt, max_tokens, temperature), stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+_SYNC_CALLS = {"anthropic": _anthropic_ask, "openai": _openai_ask}
+_ASYNC_CALLS = {"anthropic": _async_anthropic_ask, "openai": _async_openai_ask}
+_STREAM_CALLS = {
+    "anthropic": _async_anthropic_stream,
+    "openai": _async_openai_stream,
+}
+
+
+def _providers() -> List[str]:
     primary = (os.getenv("LLM_PROVIDER") or "anthropic").strip().lower()
     fallback = (os.getenv("LLM_FALLBACK_PROVIDER") or "").strip().lower()
 
     providers = [primary]
     if fallback and fallback != primary:
         providers.append(fallback)
+    return providers
+
+
+def _backoff(attempt: int) -> float:
+    return min(8.0, 0.5 * (2 ** attempt)) + random.random()
+
+
+def _has_fallback(providers: List[str], index: int, calls: dict) -> bool:
+    """Whether a provider after ``providers[index]`` can take the call now."""
+    return any(
+        p in calls and circuit.get_breaker(p).available() for p in providers[index + 1:]
+    )
+
+
+def _record_failure(breaker: circuit.CircuitBreaker, exc: Exception) -> None:
+    # Connection errors, timeouts and 5xx mean the provider is unhealthy. A
+    # rate limit or rejected request (4xx) is still an answer: the provider
+    # is reachable, which also settles a half-open probe
+    status = getattr(exc, "status_code", None)
+    if status is None or status >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _circuit_open(provider: str) -> Exception:
+    return RuntimeError(f"circuit open for {provider}")
+
+
+def _limiter(provider: str) -> ratelimit.RateLimiter:
+    return ratelimit.get_limiter(provider, _model_for(provider))
 
+
+def _request_tokens(prompt: str, max_tokens: int) -> int:
+    # Providers count the prompt plus the tokens reserved for the answer
+    return estimate_tokens(prompt) + max_tokens
+
+
+def _retry_delay(limiter: ratelimit.RateLimiter, exc: Exception, attempt: int) -> float:
+    """Seconds to sleep before retrying after ``exc``.
+
+    A 429 pauses the shared limiter instead (for the Retry-After the
+    provider sent, else the backoff), so every caller waits in the queue
+    rather than retrying in lock-step.
+    """
+    if getattr(exc, "status_code", None) == 429:
+        delay = ratelimit.retry_after(exc)
+        limiter.throttle(_backoff(attempt) if delay is None else delay)
+        return 0.0
+    return _backoff(attempt)
+
+
+_cache = TieredCache(
+    LRUCache(max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL),
+    SQLiteCache(LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL)
+    if LLM_CACHE_PATH
+    else None,
+)
+_cache_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+# Identical prompts already being answered share one provider call
+_inflight = SingleFlight()
+_hedge_counts = {"fired": 0, "won": 0, "saturated": 0}
+_hedge_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+# Free hedge pool threads; calls never queue behind busy ones, where the
+# wait would count against the hedge delay
+_hedge_slots = threading.BoundedSemaphore(LLM_HEDGE_WORKERS)
+
+
+@contextmanager
+def llm_cache_bypass():
+    """Skip cache reads for LLM calls made inside the block (writes still happen)."""
+    token = _cache_bypass.set(True)
+    try:
+        yield
+    finally:
+        _cache_bypass.reset(token)
+
+
+def llm_cache_bypassed() -> bool:
+    """True inside :func:`llm_cache_bypass`; other caches of LLM output honour it too."""
+    return _cache_bypass.get()
+
+
+def llm_cache_stats() -> dict:
+    return {"enabled": LLM_CACHE_ENABLED, **_cache.stats()}
+
+
+def llm_stats() -> dict:
+    """Counters for the LLM cache, coalescing, rate limiters and providers."""
+    with _hedge_lock:
+        hedging = {"enabled": LLM_HEDGE, **_hedge_counts}
+    return {
+        "cache": llm_cache_stats(),
+        "coalescing": _inflight.stats(),
+        "rate_limits": ratelimit.stats(),
+        "providers": circuit.stats(),
+        "hedging": hedging,
+    }
+
+
+def _cache_key(prompt: str, max_tokens: int, temperature: float, provider: str) -> str:
+    raw = json.dumps(
+        [provider, _model_for(provider), prompt, max_tokens, temperature],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_get(prompt: str, max_tokens: int, temperature: float) -> Optional[str]:
+    """Cached answer from any configured provider, the primary's first."""
+    if not LLM_CACHE_ENABLED or _cache_bypass.get():
+        return None
+    for provider in _providers():
+        value = _cache.get(_cache_key(prompt, max_tokens, temperature, provider))
+        if value is not None:
+            return value
+    return None
+
+
+def _cache_set(
+    provider: str, prompt: str, max_tokens: int, temperature: float, value: str
+) -> None:
+    """Cache ``value`` under the provider and model that produced it."""
+    if LLM_CACHE_ENABLED and value:
+        _cache.set(_cache_key(prompt, max_tokens, temperature, provider), value)
+
+
+def _ask_providers(
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    providers: Optional[List[str]] = None,
+) -> str:
     last_error = None
+    request_tokens = _request_tokens(prompt, max_tokens)
+    providers = providers or _providers()
+    for index, provider in enumerate(providers):
+        call = _SYNC_CALLS.get(provider)
+        if call is None:
+            last_error = ValueError(f"Unknown LLM provider: {provider}")
+            continue
+        limiter = _limiter(provider)
+        breaker = circuit.get_breaker(provider)
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            if not breaker.allow():
+                last_error = last_error or _circuit_open(provider)
+                break
+            limiter.acquire(request_tokens)
+            started = time.monotonic()
+            try:
+                result = call(prompt, max_tokens, temperature)
+            except _retryable_errors() as e:
+                _record_failure(breaker, e)
+                delay = _retry_delay(limiter, e, attempt)
+                last_error = e
+                # Fail over straight away rather than backing off
+                if _has_fallback(providers, index, _SYNC_CALLS):
+                    break
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                _record_failure(breaker, e)
+                last_error = e
+                break
+            breaker.record_success(time.monotonic() - started)
+            _cache_set(provider, prompt, max_tokens, temperature, result)
+            return result
+
+    raise HTTPException(status_code=503, detail=f"LLM unavailable: {last_error}")
 
-    def _call_provider(name: str) -> str:
-        if name == "anthropic":
-            return _anthropic_ask(prompt)
-        elif name == "openai":
-            return _openai_ask(prompt)
-        else:
-            raise ValueError(f"Unknown LLM provider: {name}")
 
-    for provider in providers:
-        for attempt in range(5):
+async def _async_ask_providers(
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    providers: Optional[List[str]] = None,
+) -> str:
+    last_error = None
+    request_tokens = _request_tokens(prompt, max_tokens)
+    providers = providers or _providers()
+    for index, provider in enumerate(providers):
+        call = _ASYNC_CALLS.get(provider)
+        if call is None:
+            last_error = ValueError(f"Unknown LLM provider: {provider}")
+            continue
+        limiter = _limiter(provider)
+        breaker = circuit.get_breaker(provider)
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            if not breaker.allow():
+                last_error = last_error or _circuit_open(provider)
+                break
+            await limiter.async_acquire(request_tokens)
+            started = time.monotonic()
             try:
-                return _call_provider(provider)
-            except (AnthropicAPIStatusError, AnthropicRateLimitError) as e:
-                sleep = min(8.0, 0.5 * (2 ** attempt)) + random.random()
-                time.sleep(sleep)
+                result = await call(prompt, max_tokens, temperature)
+            except _retryable_errors() as e:
+                _record_failure(breaker, e)
+                delay = _retry_delay(limiter, e, attempt)
                 last_error = e
+                if _has_fallback(providers, index, _ASYNC_CALLS):
+                    break
+                await asyncio.sleep(delay)
                 continue
-            except (OpenAIAPIError, OpenAIConnError, OpenAIRateLimitError) as e:
-                sleep = min(8.0, 0.5 * (2 ** attempt)) + random.random()
-                time.sleep(sleep)
+            except Exception as e:
+                _record_failure(breaker, e)
+                last_error = e
+                break
+            breaker.record_success(time.monotonic() - started)
+            _cache_set(provider, prompt, max_tokens, temperature, result)
+            return result
+
+    raise HTTPException(status_code=503, detail=f"LLM unavailable: {last_error}")
+
+
+def _count_hedge(outcome: str) -> None:
+    with _hedge_lock:
+        _hedge_counts[outcome] += 1
+
+
+def _hedge_plan():
+    """``(providers, backup, delay)`` when the call should be hedged, else None.
+
+    Hedging needs a second healthy provider and enough successful calls
+    to the first one to know its latency percentile.
+    """
+    if not LLM_HEDGE:
+        return None
+    providers = [p for p in _providers() if circuit.get_breaker(p).available()]
+    if len(providers) < 2:
+        return None
+    delay = circuit.get_breaker(providers[0]).percentile(LLM_HEDGE_PERCENTILE)
+    if delay is None:
+        return None
+    return providers, providers[1], delay
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge"
+            )
+    return _hedge_executor
+
+
+def _submit_hedged(*args) -> Optional[Future]:
+    """Run :func:`_ask_providers` on a free hedge thread, or return None."""
+    if not _hedge_slots.acquire(blocking=False):
+        _count_hedge("saturated")
+        return None
+    try:
+        future = _hedge_pool().submit(_ask_providers, *args)
+    except BaseException:
+        _hedge_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def _ask_hedged(prompt: str, max_tokens: int, temperature: float) -> str:
+    plan = _hedge_plan()
+    first = None
+    if plan is not None:
+        providers, backup, delay = plan
+        first = _submit_hedged(prompt, max_tokens, temperature, providers)
+    if first is None:
+        return _ask_providers(prompt, max_tokens, temperature)
+    if wait([first], timeout=delay).done:
+        return first.result()
+    hedge = _submit_hedged(prompt, max_tokens, temperature, [backup])
+    if hedge is None:
+        return first.result()
+    _count_hedge("fired")
+    pending, error = {first, hedge}, None
+    # The slower call cannot be interrupted; it finishes in the background
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _count_hedge("won")
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+async def _async_ask_hedged(
+    prompt: str, max_tokens: int, temperature: float
+) -> str:
+    plan = _hedge_plan()
+    if plan is None:
+        return await _async_ask_providers(prompt, max_tokens, temperature)
+    providers, backup, delay = plan
+    first = asyncio.ensure_future(
+        _async_ask_providers(prompt, max_tokens, temperature, providers)
+    )
+    pending, error = {first}, None
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+        _count_hedge("fired")
+        hedge = asyncio.ensure_future(
+            _async_ask_providers(prompt, max_tokens, temperature, [backup])
+        )
+        pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _count_hedge("won")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # The slower call is cancelled once an answer is in
+        for task in pending:
+            task.cancel()
+
+
+def ask_llm(
+    prompt: str,
+    max_tokens: int = LLM_MAX_TOKENS,
+    temperature: float = LLM_TEMPERATURE,
+) -> str:
+    """
+    Ask the primary provider first with retries on transient failures.
+    With a fallback provider (``LLM_FALLBACK_PROVIDER``) set, a failed call
+    moves to it straight away, and providers whose circuit breaker is open
+    are skipped. Raise HTTPException(503) if no provider answers.
+
+    With ``LLM_HEDGE`` on, the fallback is also asked when the primary has
+    not answered within its p95 latency, and the first answer wins.
+
+    Responses are cached by (provider, model, prompt, max_tokens, temperature)
+    of the provider that answered; a cached answer from any configured
+    provider is reused, the primary's first. Identical requests already in
+    flight share a single provider call.
+    """
+
+    cached = _cache_get(prompt, max_tokens, temperature)
+    if cached is not None:
+        return cached
+    # Shared by identical calls whichever provider ends up answering
+    key = _cache_key(prompt, max_tokens, temperature, "")
+    return _inflight.do(key, _ask_hedged, prompt, max_tokens, temperature)
+
+
+async def async_ask_llm(
+    prompt: str,
+    max_tokens: int = LLM_MAX_TOKENS,
+    temperature: float = LLM_TEMPERATURE,
+) -> str:
+    """Async counterpart of :func:`ask_llm` using the pooled async clients.
+
+    Retries back off with ``asyncio.sleep`` so the event loop keeps serving
+    other requests while a provider is rate limiting.
+    """
+
+    cached = _cache_get(prompt, max_tokens, temperature)
+    if cached is not None:
+        return cached
+    key = _cache_key(prompt, max_tokens, temperature, "")
+    return await _inflight.ado(key, _async_ask_hedged, prompt, max_tokens, temperature)
+
+
+async def async_stream_llm(
+    prompt: str,
+    max_tokens: int = LLM_MAX_TOKENS,
+    temperature: float = LLM_TEMPERATURE,
+) -> AsyncIterator[str]:
+    """Yield the completion for ``prompt`` as the provider streams it.
+
+    A cached answer is yielded in one piece. Retries and provider fallback
+    only happen before the first token; once text has been sent, a failure
+    is raised to the caller. The full text is cached when the stream ends.
+    """
+
+    cached = _cache_get(prompt, max_tokens, temperature)
+    if cached is not None:
+        yield cached
+        return
+
+    last_error = None
+    request_tokens = _request_tokens(prompt, max_tokens)
+    providers = _providers()
+    for index, provider in enumerate(providers):
+        call = _STREAM_CALLS.get(provider)
+        if call is None:
+            last_error = ValueError(f"Unknown LLM provider: {provider}")
+            continue
+        limiter = _limiter(provider)
+        breaker = circuit.get_breaker(provider)
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            if not breaker.allow():
+                last_error = last_error or _circuit_open(provider)
+                break
+            await limiter.async_acquire(request_tokens)
+            parts: List[str] = []
+            try:
+                async for text in call(prompt, max_tokens, temperature):
+                    parts.append(text)
+                    yield text
+                # Stream durations depend on the answer's length; only
+                # complete calls feed the latencies used for hedging
+                breaker.record_success()
+                answer = "".join(parts).strip()
+                _cache_set(provider, prompt, max_tokens, temperature, answer)
+                return
+            except _retryable_errors() as e:
+                if parts:
+                    raise
+                _record_failure(breaker, e)
+                delay = _retry_delay(limiter, e, attempt)
                 last_error = e
+                if _has_fallback(providers, index, _STREAM_CALLS):
+                    break
+                await asyncio.sleep(delay)
                 continue
             except Exception as e:
+                if parts:
+                    raise
+                _record_failure(breaker, e)
                 last_error = e
                 break
 
     raise HTTPException(status_code=503, detail=f"LLM unavailable: {last_error}")
 
 
+def _deep_prompts_prompt(text: str) -> str:
+    snippet = truncate_text_to_tokens(text, LLM_MAX_INPUT_TOKENS)
+    return (
+        "You are an expert tutor. Craft 5-8 reflective prompts to deepen "
+        "understanding of the following material. Respond ONLY with a JSON "
+        "array of objects where each object has 'prompt' and optional 'hint' "
+        "fields.\n\n" + snippet
+    )
+
+
+def _parse_deep_prompts(raw: str) -> list[dict]:
+    data = json.loads(raw)
+    if isinstance(data, dict):
+        data = data.get("deep_prompts") or data.get("prompts") or []
+    if not isinstance(data, list):
+        return []
+    results: list[dict] = []
+    for item in data:
+        if isinstance(item, dict):
+            p = (item.get("prompt") or item.get("text") or "").strip()
+            if not p:
+                continue
+            obj = {"prompt": p}
+            h = (item.get("hint") or item.get("explanation") or "").strip()
+            if h:
+                obj["hint"] = h
+            results.append(obj)
+        elif isinstance(item, str) and item.strip():
+            results.append({"prompt": item.strip()})
+    return results
+
+
 def make_deep_prompts(text: str) -> list[dict]:
     """Generate reflective prompts for the provided text using the active LLM.
 
@@ -188,39 +740,22 @@ def make_deep_prompts(text: str) -> list[dict]:
     failure results in an empty list so callers can safely ignore errors.
 
     Notes:
-        This helper intentionally truncates input to keep token counts small
-        and responses fast/deterministic.
+        Input beyond ``LLM_MAX_INPUT_TOKENS`` is cut off; use
+        ``app.services.planner.async_make_deep_prompts`` for longer texts.
     """
 
-    snippet = truncate_text_to_tokens(text, 800)
-    prompt = (
-        "You are an expert tutor. Craft 5-8 reflective prompts to deepen "
-        "understanding of the following material. Respond ONLY with a JSON "
-        "array of objects where each object has 'prompt' and optional 'hint' "
-        "fields.\n\n" + snippet
-    )
+    try:
+        return _parse_deep_prompts(ask_llm(_deep_prompts_prompt(text)))
+    except Exception as exc:  # pragma: no cover - parsing is best effort
+        logger.warning("Failed to parse deep prompts: %s", exc)
+        return []
+
+
+async def async_make_deep_prompts(text: str) -> list[dict]:
+    """Async counterpart of :func:`make_deep_prompts`."""
 
     try:
-        raw = ask_llm(prompt)
-        data = json.loads(raw)
-        if isinstance(data, dict):
-            data = data.get("deep_prompts") or data.get("prompts") or []
-        if not isinstance(data, list):
-            return []
-        results: list[dict] = []
-        for item in data:
-            if isinstance(item, dict):
-                p = (item.get("prompt") or item.get("text") or "").strip()
-                if not p:
-                    continue
-                obj = {"prompt": p}
-                h = (item.get("hint") or item.get("explanation") or "").strip()
-                if h:
-                    obj["hint"] = h
-                results.append(obj)
-            elif isinstance(item, str) and item.strip():
-                results.append({"prompt": item.strip()})
-        return results
+        return _parse_deep_prompts(await async_ask_llm(_deep_prompts_prompt(text)))
     except Exception as exc:  # pragma: no cover - parsing is best effort
         logger.warning("Failed to parse deep prompts: %s", exc)
         return []
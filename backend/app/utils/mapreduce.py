@@ -0,0 +1,186 @@
+"""Bounded-concurrency map/reduce helpers for chunked LLM work."""
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAP_CONCURRENCY = int(os.getenv("LLM_MAP_CONCURRENCY", "8"))
+REDUCE_MAX_TOKENS = int(os.getenv("LLM_REDUCE_MAX_TOKENS", "12000"))
+MAX_REDUCE_LEVELS = 4
+
+
+def _rough_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def map_unordered(
+    func: Callable, items: Sequence, max_workers: Optional[int] = None
+) -> Iterator[Tuple[int, Any]]:
+    """Yield ``(index, result)`` pairs as calls finish.
+
+    At most ``max_workers`` calls are in flight. The first failure, or closing
+    the iterator early, cancels whatever has not started yet.
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = max(1, min(max_workers or MAP_CONCURRENCY, len(items)))
+    if workers == 1:
+        for i, item in enumerate(items):
+            yield i, func(item)
+        return
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-map")
+    try:
+        # Run each call in a copy of the caller's context so request-scoped
+        # settings (e.g. LLM cache bypass) follow the work into the pool.
+        futures = {
+            pool.submit(contextvars.copy_context().run, func, item): i
+            for i, item in enumerate(items)
+        }
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+
+def map_ordered(
+    func: Callable, items: Sequence, max_workers: Optional[int] = None
+) -> List:
+    """Apply ``func`` to every item with at most ``max_workers`` calls in flight.
+
+    Results are returned in input order regardless of completion order.
+    """
+    items = list(items)
+    results: List = [None] * len(items)
+    for i, result in map_unordered(func, items, max_workers):
+        results[i] = result
+    return results
+
+
+async def async_map_ordered(
+    func: Callable[[Any], Awaitable], items: Sequence, max_workers: Optional[int] = None
+) -> List:
+    """Await ``func`` for every item with at most ``max_workers`` calls in flight.
+
+    Results are returned in input order. The first failure cancels the rest.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_workers or MAP_CONCURRENCY))
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    tasks = [asyncio.ensure_future(run(item)) for item in items]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def _pack(parts: Sequence[str], budget: int, count_tokens: Callable[[str], int]):
+    """Greedily group consecutive parts so each group stays under ``budget``."""
+    batches: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for part in parts:
+        size = count_tokens(part)
+        if current and used + size > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(part)
+        used += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def reduce_hierarchical(
+    parts: Sequence[str],
+    reduce_fn: Callable[[str], str],
+    *,
+    merge_fn: Optional[Callable[[str], str]] = None,
+    max_tokens: int = REDUCE_MAX_TOKENS,
+    max_workers: Optional[int] = None,
+    count_tokens: Callable[[str], int] = _rough_tokens,
+    separator: str = "\n",
+) -> str:
+    """Combine ``parts`` with ``reduce_fn``, merging level by level if needed.
+
+    While the joined parts exceed ``max_tokens`` they are packed into batches
+    that fit and each batch is merged concurrently with ``merge_fn`` (defaults
+    to ``reduce_fn``). The final call always goes through ``reduce_fn``.
+    """
+    merge_fn = merge_fn or reduce_fn
+    parts = list(parts)
+    for level in range(MAX_REDUCE_LEVELS):
+        batches = _pack(parts, max_tokens, count_tokens)
+        if len(batches) <= 1:
+            break
+        logger.info(
+            "Reduce level %d: merging %d parts in %d batches",
+            level + 1, len(parts), len(batches),
+        )
+        parts = map_ordered(
+            lambda batch: merge_fn(separator.join(batch)), batches, max_workers
+        )
+    return reduce_fn(separator.join(parts))
+
+
+def map_reduce(
+    chunks: Sequence[str],
+    map_fn: Callable[[str], str],
+    reduce_fn: Callable[[str], str],
+    *,
+    merge_fn: Optional[Callable[[str], str]] = None,
+    max_workers: Optional[int] = None,
+    max_tokens: int = REDUCE_MAX_TOKENS,
+    count_tokens: Callable[[str], int] = _rough_tokens,
+    separator: str = "\n",
+) -> str:
+    """Run ``map_fn`` over ``chunks`` concurrently, then reduce the results."""
+    partials = map_ordered(map_fn, chunks, max_workers)
+    return reduce_hierarchical(
+        partials,
+        reduce_fn,
+        merge_fn=merge_fn,
+        max_tokens=max_tokens,
+        max_workers=max_workers,
+        count_tokens=count_tokens,
+        separator=separator,
+    )
+
+
+async def async_reduce_hierarchical(
+    parts: Sequence[str],
+    reduce_fn: Callable[[str], Awaitable[str]],
+    *,
+    merge_fn: Optional[Callable[[str], Awaitable[str]]] = None,
+    max_tokens: int = REDUCE_MAX_TOKENS,
+    max_workers: Optional[int] = None,
+    count_tokens: Callable[[str], int] = _rough_tokens,
+    separator: str = "\n",
+) -> str:
+    """Async counterpart of :func:`reduce_hierarchical`."""
+    merge_fn = merge_fn or reduce_fn
+    parts = list(parts)
+    for level in range(MAX_REDUCE_LEVELS):
+        batches = _pack(parts, max_tokens, count_tokens)
+        if len(batches) <= 1:
+            break
+        logger.info(
+            "Reduce level %d: merging %d parts in %d batches",
+            level + 1, len(parts), len(batches),
+        )
+        parts = await async_map_ordered(
+            lambda batch: merge_fn(separator.join(batch)), batches, max_workers
+        )
+    return await reduce_fn(separator.join(parts))
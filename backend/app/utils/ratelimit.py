@@ -0,0 +1,354 @@
+"""Rate limiting of LLM provider calls, shared by every caller in the process.
+
+One :class:`RateLimiter` per provider and model enforces requests and
+tokens per minute with token buckets. Callers wait their turn in arrival
+order (threads and coroutines share one queue), and a 429's
+``Retry-After`` pauses every caller of that limiter at once instead of each
+of them sleeping and retrying on its own. With ``LLM_RATE_LIMIT_PATH`` set,
+the buckets live in an SQLite file so that worker processes share them.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+import itertools
+import email.utils
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Defaults for every provider and model; 0 means no limit
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+# Overrides by "provider" or "provider:model", e.g.
+# {"openai:gpt-4o-mini": {"rpm": 500, "tpm": 200000}, "anthropic": {"rpm": 50}}
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS") or "{}")
+LLM_RATE_LIMIT_PATH = os.getenv("LLM_RATE_LIMIT_PATH", "")
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "60"))
+# How often queued coroutines check whether it is their turn
+ASYNC_POLL_SECONDS = 0.05
+
+# (bucket name, capacity per minute, amount to take)
+Limits = List[Tuple[str, float, float]]
+
+
+def _refill(level: float, updated: float, capacity: float, now: float) -> float:
+    return min(capacity, level + max(0.0, now - updated) * capacity / 60.0)
+
+
+def _take(levels: Dict[str, Tuple[float, float]], limits: Limits, now: float):
+    """New bucket levels if every amount is available, else the seconds to wait."""
+    delay = 0.0
+    taken = {}
+    for bucket, capacity, amount in limits:
+        level, updated = levels.get(bucket, (capacity, now))
+        level = _refill(level, updated, capacity, now)
+        # A request larger than the bucket goes through once it is full
+        amount = min(amount, capacity)
+        if level < amount:
+            delay = max(delay, (amount - level) * 60.0 / capacity)
+        taken[bucket] = (level - amount, now)
+    return delay, taken
+
+
+class MemoryState:
+    """Bucket levels and Retry-After pauses kept in this process."""
+
+    # Whether take() can block (on I/O or other processes' locks)
+    blocking = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels: Dict[str, Tuple[float, float]] = {}
+        self._blocked: Dict[str, float] = {}
+
+    def take(self, key: str, limits: Limits, now: float) -> float:
+        with self._lock:
+            delay = self._blocked.get(key, 0.0) - now
+            levels = {
+                bucket: self._levels[f"{key}:{bucket}"]
+                for bucket, _, _ in limits
+                if f"{key}:{bucket}" in self._levels
+            }
+            wait, taken = _take(levels, limits, now)
+            delay = max(delay, wait)
+            if delay <= 0:
+                for bucket, level in taken.items():
+                    self._levels[f"{key}:{bucket}"] = level
+            return delay
+
+    def block(self, key: str, until: float) -> None:
+        with self._lock:
+            self._blocked[key] = max(self._blocked.get(key, 0.0), until)
+
+    def blocked_until(self, key: str) -> float:
+        return self._blocked.get(key, 0.0)
+
+
+class SQLiteState:
+    """Bucket levels and pauses in an SQLite file shared between processes."""
+
+    blocking = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; take() opens its own write transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, limits: Limits, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            names = [f"{key}:blocked"] + [f"{key}:{bucket}" for bucket, _, _ in limits]
+            rows = {
+                name: (level, updated)
+                for name, level, updated in conn.execute(
+                    "SELECT key, level, updated FROM buckets WHERE key IN (%s)"
+                    % ",".join("?" * len(names)),
+                    names,
+                )
+            }
+            delay = rows.get(f"{key}:blocked", (0.0, 0.0))[0] - now
+            levels = {
+                bucket: rows[f"{key}:{bucket}"]
+                for bucket, _, _ in limits
+                if f"{key}:{bucket}" in rows
+            }
+            wait, taken = _take(levels, limits, now)
+            delay = max(delay, wait)
+            if delay <= 0:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)",
+                    [(f"{key}:{b}", level, updated) for b, (level, updated) in taken.items()],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return delay
+
+    def block(self, key: str, until: float) -> None:
+        self._conn().execute(
+            "INSERT INTO buckets (key, level, updated) VALUES (?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET level = max(level, excluded.level),"
+            " updated = excluded.updated",
+            (f"{key}:blocked", until, time.time()),
+        )
+
+    def blocked_until(self, key: str) -> float:
+        row = self._conn().execute(
+            "SELECT level FROM buckets WHERE key = ?", (f"{key}:blocked",)
+        ).fetchone()
+        return row[0] if row else 0.0
+
+
+class RateLimiter:
+    """Requests- and tokens-per-minute limits for one provider and model.
+
+    :meth:`acquire` (threads) and :meth:`async_acquire` (coroutines) wait in
+    one first-come, first-served queue until both buckets can cover the
+    call; :meth:`throttle` pauses the limiter when the provider says so.
+    """
+
+    def __init__(self, key: str, rpm: float = 0, tpm: float = 0, state=None):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+        self._state = state or MemoryState()
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._tickets = itertools.count()
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_queued = 0
+        self.throttled = 0
+
+    def _limits(self, tokens: int) -> Limits:
+        limits = []
+        if self.rpm > 0:
+            limits.append(("requests", self.rpm, 1))
+        if self.tpm > 0:
+            limits.append(("tokens", self.tpm, tokens))
+        return limits
+
+    def _enter(self) -> int:
+        with self._cond:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            self.max_queued = max(self.max_queued, len(self._queue))
+        return ticket
+
+    def _leave(self, ticket: int) -> None:
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def _poll(self, ticket: int, tokens: int) -> Optional[float]:
+        """0 once ``ticket`` has its capacity, the seconds to wait if it is
+        first in line, ``None`` if others are ahead.
+
+        Only the head of the queue updates the state, so the lock is not
+        held meanwhile: an SQLite state may wait on other processes.
+        """
+        with self._cond:
+            if not self._queue or self._queue[0] != ticket:
+                return None
+        delay = self._state.take(self.key, self._limits(tokens), time.time())
+        if delay > 0:
+            return delay
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+            self._cond.notify_all()
+        return 0.0
+
+    def _record(self, started: float) -> float:
+        waited = time.monotonic() - started
+        with self._cond:
+            self.acquired += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            if waited >= 0.01:
+                self.waited += 1
+        return waited
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Block until a call of ``tokens`` tokens may go out; return the wait."""
+        started = time.monotonic()
+        ticket = self._enter()
+        try:
+            while True:
+                delay = self._poll(ticket, tokens)
+                if delay == 0.0:
+                    break
+                with self._cond:
+                    # Unless first in line, sleep until the queue moves
+                    if delay is not None or (self._queue and self._queue[0] != ticket):
+                        self._cond.wait(delay)
+        except BaseException:
+            self._leave(ticket)
+            raise
+        return self._record(started)
+
+    async def async_acquire(self, tokens: int = 1) -> float:
+        """Async counterpart of :meth:`acquire`; waits without blocking the loop.
+
+        A state that can block (the shared SQLite file) is updated from a
+        worker thread.
+        """
+        started = time.monotonic()
+        ticket = self._enter()
+        try:
+            while True:
+                if self._state.blocking:
+                    delay = await asyncio.to_thread(self._poll, ticket, tokens)
+                else:
+                    delay = self._poll(ticket, tokens)
+                if delay == 0.0:
+                    break
+                await asyncio.sleep(ASYNC_POLL_SECONDS if delay is None else delay)
+        except BaseException:
+            self._leave(ticket)
+            raise
+        return self._record(started)
+
+    def throttle(self, seconds: float) -> None:
+        """Hold every caller back for ``seconds`` (e.g. a 429's Retry-After)."""
+        seconds = min(max(seconds, 0.0), LLM_RETRY_AFTER_MAX)
+        self._state.block(self.key, time.time() + seconds)
+        with self._cond:
+            self.throttled += 1
+        logger.info("Rate limited by %s; pausing calls for %.1fs", self.key, seconds)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "queued": len(self._queue),
+                "max_queued": self.max_queued,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "avg_wait_seconds": round(self.wait_seconds / self.acquired, 3)
+                if self.acquired
+                else 0.0,
+                "max_wait_seconds": round(self.max_wait_seconds, 3),
+                "throttled": self.throttled,
+                "paused_seconds": round(
+                    max(0.0, self._state.blocked_until(self.key) - time.time()), 3
+                ),
+            }
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait in a rate-limit error, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def limits_for(provider: str, model: str) -> Tuple[float, float]:
+    """Requests and tokens per minute configured for ``provider`` and ``model``."""
+    for key in (f"{provider}:{model}", provider):
+        if key in LLM_RATE_LIMITS:
+            config = LLM_RATE_LIMITS[key]
+            return float(config.get("rpm", LLM_RPM)), float(config.get("tpm", LLM_TPM))
+    return LLM_RPM, LLM_TPM
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+_state = None
+
+
+def get_limiter(provider: str, model: str) -> RateLimiter:
+    global _state
+    key = f"{provider}:{model}"
+    limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            if _state is None:
+                _state = SQLiteState(LLM_RATE_LIMIT_PATH) if LLM_RATE_LIMIT_PATH else MemoryState()
+            limiter = RateLimiter(key, *limits_for(provider, model), state=_state)
+            _limiters[key] = limiter
+    return limiter
+
+
+def stats() -> dict:
+    return {key: limiter.stats() for key, limiter in list(_limiters.items())}
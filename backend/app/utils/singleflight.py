@@ -0,0 +1,87 @@
+"""Coalesce identical in-flight calls so only one of them does the work."""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """Share one execution between concurrent callers that use the same key.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is running wait for the leader's result or exception.
+    Threaded callers use :meth:`do`, asyncio callers use :meth:`ado`, and both
+    kinds can wait on each other. A blocking :meth:`do` must not be called
+    from an event loop thread that is also leading an :meth:`ado` call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut, False
+            fut = Future()
+            # A running future cannot be cancelled, so a follower that gives
+            # up waiting does not cancel the result for the others
+            fut.set_running_or_notify_cancel()
+            self._calls[key] = fut
+            self.executed += 1
+            return fut, True
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key: str, fn: Callable, *args, **kwargs):
+        fut, leader = self._join(key)
+        if not leader:
+            return fut.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            self._release(key)
+            if not fut.done():
+                fut.set_exception(exc)
+            raise
+        self._release(key)
+        if not fut.done():
+            fut.set_result(result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[..., Awaitable], *args, **kwargs):
+        fut, leader = self._join(key)
+        if not leader:
+            return await asyncio.shield(asyncio.wrap_future(fut))
+
+        def settle(task: asyncio.Task) -> None:
+            self._release(key)
+            if fut.done():
+                return
+            if task.cancelled():
+                fut.set_exception(asyncio.CancelledError())
+            elif task.exception() is not None:
+                fut.set_exception(task.exception())
+            else:
+                fut.set_result(task.result())
+
+        # Shield the shared work so a leader that disconnects does not cancel
+        # the call for everyone waiting on it.
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+        task.add_done_callback(settle)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+        }
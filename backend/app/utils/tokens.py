@@ -0,0 +1,225 @@
+"""Token accounting: memoized tokenizers and single-pass chunking.
+
+A document is encoded once. Chunks are cut from the token offsets at
+paragraph, sentence or word boundaries, so chunking costs one ``encode``
+however large the text is. Without tiktoken, or when its encoding files
+cannot be loaded (e.g. offline), tokens are estimated from the length.
+"""
+import os
+import re
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import tiktoken  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Used for models tiktoken does not know, e.g. Claude
+TOKENIZER_FALLBACK_ENCODING = os.getenv("TOKENIZER_FALLBACK_ENCODING", "cl100k_base")
+CHARS_PER_TOKEN = 4
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+# A boundary is only used if the chunk before it is at least this full
+CHUNK_MIN_FILL = 0.5
+
+# Boundaries are the character positions where the separating whitespace starts
+_PARAGRAPH = re.compile(r"\n[ \t]*\n")
+_SENTENCE = re.compile(r"[.!?][\"'”’)\]]*(?=\s)")
+_SPACE = re.compile(r"\s")
+
+
+class Tokenizer(ABC):
+    """Encodes text and maps tokens back to character offsets."""
+
+    name = ""
+
+    @abstractmethod
+    def encode(self, text: str) -> Sequence[int]:
+        """Tokens of ``text``."""
+
+    @abstractmethod
+    def offsets(self, text: str, tokens: Sequence[int]) -> Sequence[int]:
+        """Character offset in ``text`` where each of ``tokens`` starts."""
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+
+    def encode(self, text: str) -> Sequence[int]:
+        # User text may contain strings like "<|endoftext|>"; treat them as text
+        return self.encoding.encode(text, disallowed_special=())
+
+    def offsets(self, text: str, tokens: Sequence[int]) -> Sequence[int]:
+        return self.encoding.decode_with_offsets(list(tokens))[1]
+
+
+class CharTokenizer(Tokenizer):
+    """Length-based estimate: one pseudo-token every ``CHARS_PER_TOKEN`` chars."""
+
+    name = "chars"
+
+    def encode(self, text: str) -> Sequence[int]:
+        return range(0, len(text), CHARS_PER_TOKEN)
+
+    def offsets(self, text: str, tokens: Sequence[int]) -> Sequence[int]:
+        return tokens
+
+    def count(self, text: str) -> int:
+        return max(1, -(-len(text) // CHARS_PER_TOKEN))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: Optional[str] = None) -> Tokenizer:
+    """Tokenizer for ``model``, resolved once per model."""
+    if tiktoken is None:
+        return CharTokenizer()
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model or "")
+        except KeyError:
+            encoding = tiktoken.get_encoding(TOKENIZER_FALLBACK_ENCODING)
+    except Exception as exc:
+        logger.warning("No tiktoken encoding for %s (%s); estimating tokens", model, exc)
+        return CharTokenizer()
+    return TiktokenTokenizer(encoding)
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    return get_tokenizer(model).count(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut ``text`` to its first ``max_tokens`` tokens with a single encode."""
+    tokenizer = get_tokenizer(model)
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return text[: tokenizer.offsets(text, tokens[: max_tokens + 1])[max_tokens]]
+
+
+def _positions(pattern, text: str, end: bool = False) -> List[int]:
+    return [m.end() if end else m.start() for m in pattern.finditer(text)]
+
+
+def _last_boundary(boundaries: List[List[int]], lo: int, hi: int) -> Optional[int]:
+    """Last position in ``(lo, hi]`` from the first kind of boundary that has one."""
+    for positions in boundaries:
+        i = bisect_right(positions, hi) - 1
+        if i >= 0 and positions[i] > lo:
+            return positions[i]
+    return None
+
+
+def _first_boundary(boundaries: List[List[int]], lo: int, hi: int) -> Optional[int]:
+    """First position in ``[lo, hi)`` from the first kind of boundary that has one."""
+    for positions in boundaries:
+        i = bisect_left(positions, lo)
+        if i < len(positions) and positions[i] < hi:
+            return positions[i]
+    return None
+
+
+def _last_space(text: str, lo: int, hi: int) -> Optional[int]:
+    """Start of the last whitespace run that begins in ``(lo, hi]``."""
+    pos = max(text.rfind(c, lo + 1, hi + 1) for c in " \n\t")
+    if pos < 0:
+        return None
+    while pos - 1 > lo and text[pos - 1].isspace():
+        pos -= 1
+    return pos
+
+
+def split_spans(
+    text: str,
+    max_tokens: int,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+    model: Optional[str] = None,
+) -> List[Tuple[int, int]]:
+    """Character spans of chunks of at most ``max_tokens`` tokens.
+
+    Each chunk ends at the last paragraph break that keeps it at least
+    ``CHUNK_MIN_FILL`` full, else the last sentence end, else the last word
+    break, else mid-word. With ``overlap``, a chunk starts that many tokens before the
+    previous one ended, moved forward to a sentence start when possible.
+    ``max_tokens`` must be at least 2: a one-token chunk cut mid-token
+    could not be followed without skipping the rest of that token.
+    """
+    if max_tokens < 2:
+        raise ValueError("max_tokens must be at least 2")
+    tokenizer = get_tokenizer(model)
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return [(0, len(text))]
+    return split_offsets(text, tokenizer.offsets(text, tokens), max_tokens, overlap)
+
+
+def split_offsets(
+    text: str,
+    starts: Sequence[int],
+    max_tokens: int,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> List[Tuple[int, int]]:
+    """:func:`split_spans` for a text whose token offsets are already known.
+
+    ``starts`` holds the character offset of every token of ``text``, the
+    first being 0; chunks are counted with exactly these tokens.
+    """
+    if max_tokens < 2:
+        raise ValueError("max_tokens must be at least 2")
+    overlap = max(0, min(overlap, max_tokens // 2))
+    total = len(starts)
+    if total <= max_tokens:
+        return [(0, len(text))]
+    boundaries = [_positions(_PARAGRAPH, text), _positions(_SENTENCE, text, end=True)]
+
+    spans = []
+    first, begin = 0, 0  # first token and first character of the chunk
+    while True:
+        last = first + max_tokens
+        if last >= total:
+            spans.append((begin, len(text)))
+            break
+        lo = starts[first + int(max_tokens * CHUNK_MIN_FILL)]
+        cut = _last_boundary(boundaries, lo, starts[last])
+        if cut is None:
+            cut = _last_space(text, lo, starts[last]) or starts[last]
+        spans.append((begin, cut))
+        if overlap:
+            begin = starts[max(first + 1, bisect_left(starts, cut) - overlap)]
+            sentence = _first_boundary(boundaries[1:], begin, cut)
+            space = _SPACE.search(text, begin, cut)
+            if sentence is not None:
+                begin = sentence
+            elif space is not None:
+                begin = space.start()
+        else:
+            begin = cut
+        # Count the token ``begin`` falls in, so chunks never exceed the budget
+        first = max(first + 1, bisect_right(starts, begin) - 1)
+        begin = max(begin, starts[first])
+    return spans
+
+
+def split_into_chunks(
+    text: str,
+    max_tokens: int,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+    model: Optional[str] = None,
+) -> List[str]:
+    """Split ``text`` into chunks of at most ``max_tokens`` tokens (see :func:`split_spans`)."""
+    chunks = []
+    for start, end in split_spans(text, max_tokens, overlap, model):
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+    return chunks or [text]
@@ -0,0 +1,91 @@
+"""Chunking throughput: per-word token counting versus a single encode.
+
+Usage (from the repository root)::
+
+    python backend/benchmarks/chunking.py --tokens 200000 --max-tokens 10000
+
+The per-word splitter is the algorithm ``split_text_into_chunks`` used
+before ``app.utils.tokens``: it encodes every word separately. Both run
+with the same tokenizer (tiktoken when its encoding can be loaded, the
+length estimate otherwise), so the difference is the number of encodes.
+"""
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.utils import tokens  # noqa: E402
+
+WORDS = (
+    "cell membrane protein energy transport gradient enzyme reaction "
+    "substrate binding site structure function signal pathway receptor"
+).split()
+
+
+def make_document(approx_tokens: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    paragraphs, size = [], 0
+    while size < approx_tokens:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            words = rng.choices(WORDS, k=rng.randint(8, 24))
+            sentences.append(" ".join(words).capitalize() + ".")
+            size += len(words) + 1
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def per_word_chunks(text: str, max_tokens: int, tokenizer) -> list:
+    chunks, current, count = [], [], 0
+    for word in text.split():
+        length = tokenizer.count(word + " ")
+        if count + length > max_tokens:
+            chunks.append(" ".join(current))
+            current, count = [word], length
+        else:
+            current.append(word)
+            count += length
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def timed(fn, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=200_000)
+    parser.add_argument("--max-tokens", type=int, default=10_000)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = tokens.get_tokenizer(args.model)
+    text = make_document(args.tokens)
+    print(f"{len(text):,} chars, {tokenizer.count(text):,} tokens ({tokenizer.name})")
+
+    old, old_chunks = timed(
+        lambda: per_word_chunks(text, args.max_tokens, tokenizer), args.repeat
+    )
+    new, new_chunks = timed(
+        lambda: tokens.split_into_chunks(text, args.max_tokens, args.overlap, args.model),
+        args.repeat,
+    )
+    print(f"per-word     {old * 1000:9.1f} ms  {len(old_chunks)} chunks")
+    print(f"single-pass  {new * 1000:9.1f} ms  {len(new_chunks)} chunks")
+    print(f"speed-up     {old / new:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
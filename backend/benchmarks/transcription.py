@@ -0,0 +1,71 @@
+"""Throughput of the local speech-to-text backend per CPU thread setting.
+
+Usage (from the repository root)::
+
+    python backend/benchmarks/transcription.py lecture.mp3 --threads 1 2 4
+
+For each thread count the model is loaded once (load time is reported
+separately) and the file is transcribed ``--repeat`` times. The table shows
+the real-time factor (audio seconds per wall second) and that factor divided
+by the threads used, which is what to compare when deciding how to split
+cores between ``LOCAL_WHISPER_THREADS`` and ``LOCAL_WHISPER_WORKERS``.
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import transcription  # noqa: E402
+from app.services.transcription import LocalWhisperBackend  # noqa: E402
+
+
+def run(path: str, threads: int, args, duration: float) -> dict:
+    backend = LocalWhisperBackend(
+        model=args.model, compute_type=args.compute_type, cpu_threads=threads
+    )
+    started = time.perf_counter()
+    backend.warm()
+    load = time.perf_counter() - started
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        backend.transcribe(path)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return {
+        "threads": threads,
+        "load": load,
+        "best": best,
+        "rtf": duration / best,
+        "rtf_per_thread": duration / best / threads,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("audio")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--model", default=transcription.LOCAL_WHISPER_MODEL)
+    parser.add_argument("--compute-type", default=transcription.LOCAL_WHISPER_COMPUTE_TYPE)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--duration", type=float, help="audio length when ffprobe is missing")
+    args = parser.parse_args()
+
+    duration = args.duration or transcription.probe_duration(args.audio)
+    if not duration:
+        parser.error("could not read the audio length; pass --duration")
+
+    print(f"{args.audio}: {duration:.0f}s, model {args.model} ({args.compute_type})")
+    print(f"{'threads':>7} {'load s':>8} {'best s':>8} {'x realtime':>11} {'per thread':>11}")
+    for threads in args.threads:
+        row = run(args.audio, threads, args, duration)
+        print(
+            f"{row['threads']:>7} {row['load']:>8.1f} {row['best']:>8.1f} "
+            f"{row['rtf']:>11.2f} {row['rtf_per_thread']:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,43 @@ from fastapi import (
     Body,
     HTTPException,
     BackgroundTasks,
+    Request,
+    Query,
+    Header,
 )
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 import os
 import json
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Literal
 from pydantic import BaseModel
 
-from app.services import generator, srs, concept_map, exporter, tts
-from app.utils.llm import ask_llm, make_deep_prompts
-from app.models import ReviewInput, ExportInput
+from app.services import (
+    generator,
+    srs,
+    scheduler,
+    concept_map,
+    concept_render,
+    exporter,
+    tts,
+    jobs,
+    nlp_pool,
+    planner,
+)
+from app.utils.llm import (
+    async_ask_llm,
+    async_make_deep_prompts,
+    async_stream_llm,
+    close_async_clients,
+    llm_cache_bypass,
+    llm_stats,
+)
+from app.utils.ingest import BodySizeLimit
+from app.utils.lazy import start_warm_up
+from app.models import ReviewInput, BatchReviewInput, ExportInput, ConceptMapRequest
 
 class StudyRequest(BaseModel):
     """Request model for study mode generation."""
@@ -34,32 +60,141 @@ class StudyRequest(BaseModel):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(100 * 1024 * 1024)))  # 100 MB default
+# Heavy services to load in the background at start-up: a comma-separated
+# list (e.g. "pdf,nlp"), "all", or empty to load everything on first use.
+WARM_UP_SERVICES = os.getenv("WARM_UP_SERVICES", "")
+NLP_WORKERS = int(os.getenv("NLP_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Concept maps block on the spaCy worker processes (see nlp_pool); give the
+# waiting threads their own pool so they cannot starve the default executor.
+nlp_executor = ThreadPoolExecutor(max_workers=NLP_WORKERS, thread_name_prefix="nlp")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    jobs.get_queue().start()
+    if WARM_UP_SERVICES:
+        names = None if WARM_UP_SERVICES == "all" else [
+            name.strip() for name in WARM_UP_SERVICES.split(",") if name.strip()
+        ]
+        start_warm_up(names)
+    yield
+    jobs.get_queue().stop()
+    await close_async_clients()
+    nlp_executor.shutdown(wait=False, cancel_futures=True)
+    nlp_pool.shutdown()
+    generator.shutdown_ocr_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+# Refuse oversize uploads while they stream in rather than after buffering
+app.add_middleware(
+    BodySizeLimit, paths=("/upload-content", "/jobs"), max_bytes=MAX_MEDIA_BYTES
+)
+
+
+@app.middleware("http")
+async def llm_cache_control(request: Request, call_next):
+    """Skip cached LLM answers when the client asks for a fresh response.
+
+    Send ``X-LLM-Cache: bypass`` or ``Cache-Control: no-cache``.
+    """
+    bypass = request.headers.get("x-llm-cache", "").lower() == "bypass" or (
+        "no-cache" in request.headers.get("cache-control", "").lower()
+    )
+    if not bypass:
+        return await call_next(request)
+    with llm_cache_bypass():
+        return await call_next(request)
+
+
+def _wants_stream(stream, accept) -> bool:
+    """Stream when asked with ``?stream=1`` or ``Accept: text/event-stream``."""
+    return bool(stream) or "text/event-stream" in (accept or "").lower()
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_events(events):
+    try:
+        async for event, data in events:
+            yield _sse(event, data)
+    except HTTPException as exc:
+        yield _sse("error", {"status": exc.status_code, "detail": exc.detail})
+    except Exception as exc:
+        logger.exception("Streaming failed: %s", exc)
+        yield _sse("error", {"status": 500, "detail": "Internal server error"})
+
+
+def _sse_response(events) -> StreamingResponse:
+    """Send ``(event, data)`` pairs from an async iterator as server-sent events."""
+    return StreamingResponse(
+        _sse_events(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _iterate_in_thread(iterator):
+    """Drive a blocking iterator from a worker thread, one item at a time."""
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+AUDIO_EXTENSIONS = [".mp3", ".m4a", ".wav", ".flac", ".ogg", ".aac"]
+VIDEO_EXTENSIONS = [".mp4", ".mkv", ".mov", ".avi", ".webm"]
+
+
+def _upload_kind(file: UploadFile) -> str:
+    """Classify an upload as ``audio``, ``video`` or a ``course`` document."""
+    content_type = (file.content_type or "").lower()
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if content_type.startswith("audio/") or ext in AUDIO_EXTENSIONS:
+        return "audio"
+    if content_type.startswith("video/") or ext in VIDEO_EXTENSIONS:
+        return "video"
+    return "course"
 
 
 @app.post('/upload-content', tags=["Content"])
-async def upload_content(file: UploadFile = File(...)):
-    """Extract text from an uploaded file."""
+async def upload_content(
+    file: UploadFile = File(...),
+    stream: bool = Query(False),
+    accept: str | None = Header(None),
+):
+    """Extract text from an uploaded file.
+
+    Documents can be streamed as server-sent events: one ``chunk`` event per
+    chunk summary followed by a ``course`` event with the final outline.
+    """
     try:
         file.file.seek(0, os.SEEK_END)
         size = file.file.tell()
         file.file.seek(0)
         if size > MAX_MEDIA_BYTES:
             raise HTTPException(status_code=400, detail="File too large")
-        content_type = (file.content_type or "").lower()
-        ext = os.path.splitext(file.filename or "")[1].lower()
+        kind = _upload_kind(file)
 
-        if content_type.startswith("audio/") or ext in [".mp3", ".m4a", ".wav", ".flac", ".ogg", ".aac"]:
-            text = generator.transcribe_audio(file)
+        if kind == "audio":
+            text = await asyncio.to_thread(generator.transcribe_audio, file)
             return {"text": text}
 
-        if content_type.startswith("video/") or ext in [".mp4", ".mkv", ".mov", ".avi", ".webm"]:
-            text = generator.transcribe_video(file)
+        if kind == "video":
+            text = await asyncio.to_thread(generator.transcribe_video, file)
             return {"text": text}
 
         # else: document
-        return generator.generate_course(file)
+        if _wants_stream(stream, accept):
+            return _sse_response(
+                _iterate_in_thread(generator.iter_course_events(file))
+            )
+        return await asyncio.to_thread(generator.generate_course, file)
     except HTTPException as exc:
         raise exc
     except Exception as exc:
@@ -67,10 +202,36 @@ async def upload_content(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@app.post('/analyze', tags=["Analysis"])
-def analyze_text(text: str = Body(..., embed=True)):
-    """Return summary and topics for the given text using the LLM."""
-    prompt = (
+@app.post('/jobs', tags=["Content"], status_code=202)
+async def create_job(file: UploadFile = File(...)):
+    """Queue an upload for background processing and return its job id.
+
+    Poll ``GET /jobs/{job_id}`` for the stage, progress and final result
+    (the same payload ``/upload-content`` would have returned).
+    """
+    try:
+        job_id = await asyncio.to_thread(
+            jobs.get_queue().submit, _upload_kind(file), file
+        )
+        return {"job_id": job_id, "status": jobs.QUEUED}
+    except HTTPException as exc:
+        raise exc
+    except Exception as exc:
+        logger.exception("Failed to queue upload: %s", exc)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get('/jobs/{job_id}', tags=["Content"])
+def get_job(job_id: str):
+    """Return the status of a background job."""
+    job = jobs.get_queue().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def _analysis_prompt(text: str) -> str:
+    return (
         "Analyze the following text and respond only in JSON with the keys:\n"
         "{\n"
         '  "summary": str,\n'
@@ -82,26 +243,80 @@ def analyze_text(text: str = Body(..., embed=True)):
         "}\n"
         "Include key points in your analysis.\n\n" + text
     )
+
+
+def _analysis_payload(result: str, deep_prompts: list) -> dict:
     try:
-        result = ask_llm(prompt)
-        try:
-            data = json.loads(result)
-        except Exception:
-            data = {"summary": result}
-
-        deep_prompts = make_deep_prompts(text)
-
-        return {
-            "summary": data.get("summary", ""),
-            "concept_map": data.get("concept_map")
-            or data.get("conceptMap", {"groups": []}),
-            "flashcards": data.get("flashcards", []),
-            "quiz": data.get("quiz") or data.get("quizQuestions", []),
-            "spaced_repetition": data.get("spaced_repetition")
-            or data.get("spacedRepetition", []),
-            "progress": data.get("progress", {"completion": 0.0, "masteryLevel": ""}),
-            "deep_prompts": deep_prompts,
-        }
+        data = json.loads(result)
+    except Exception:
+        data = {"summary": result}
+
+    return {
+        "summary": data.get("summary", ""),
+        "concept_map": data.get("concept_map")
+        or data.get("conceptMap", {"groups": []}),
+        "flashcards": data.get("flashcards", []),
+        "quiz": data.get("quiz") or data.get("quizQuestions", []),
+        "spaced_repetition": data.get("spaced_repetition")
+        or data.get("spacedRepetition", []),
+        "progress": data.get("progress", {"completion": 0.0, "masteryLevel": ""}),
+        "deep_prompts": deep_prompts,
+    }
+
+
+def _analysis_call(parts: list):
+    if len(parts) == 1:
+        return async_ask_llm(_analysis_prompt(parts[0]))
+    return planner.async_run(parts, _analysis_prompt, planner.async_merge_analysis)
+
+
+def _deep_prompts_call(parts: list):
+    if len(parts) == 1:
+        return async_make_deep_prompts(parts[0])
+    return planner.async_make_deep_prompts(parts)
+
+
+async def _analysis_events(text: str, parts: list):
+    if len(parts) > 1:
+        # Chunked analysis has no single completion to stream
+        result, deep_prompts = await asyncio.gather(
+            _analysis_call(parts), _deep_prompts_call(parts)
+        )
+        yield "result", _analysis_payload(result, deep_prompts)
+        return
+    deep_prompts = asyncio.ensure_future(async_make_deep_prompts(text))
+    try:
+        parts = []
+        async for token in async_stream_llm(_analysis_prompt(text)):
+            parts.append(token)
+            yield "token", {"text": token}
+        yield "result", _analysis_payload("".join(parts).strip(), await deep_prompts)
+    finally:
+        deep_prompts.cancel()
+
+
+@app.post('/analyze', tags=["Analysis"])
+async def analyze_text(
+    text: str = Body(..., embed=True),
+    stream: bool = Query(False),
+    accept: str | None = Header(None),
+):
+    """Return summary and topics for the given text using the LLM.
+
+    When streaming, ``token`` events carry the raw completion as it arrives
+    and a final ``result`` event carries the parsed response. Texts too long
+    for one call are analysed chunk by chunk and merged (see
+    ``app.services.planner``); they only get the ``result`` event.
+    """
+    parts = await asyncio.to_thread(planner.plan, text)
+    if _wants_stream(stream, accept):
+        return _sse_response(_analysis_events(text, parts))
+    try:
+        # The analysis and the reflective prompts are independent calls
+        result, deep_prompts = await asyncio.gather(
+            _analysis_call(parts), _deep_prompts_call(parts)
+        )
+        return _analysis_payload(result, deep_prompts)
     except HTTPException as e:
         raise e
     except Exception as exc:
@@ -109,8 +324,103 @@ def analyze_text(text: str = Body(..., embed=True)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+# Prompt prefix, response key, accepted alias and log message per LLM mode
+STUDY_MODE_PROMPTS = {
+    "memorization": (
+        "Create flashcard question-answer pairs as JSON in the form "
+        "{'flashcards': [{'question': str, 'answer': str}]} for the following text:\n\n",
+        "flashcards",
+        "cards",
+        "Flashcard generation failed",
+    ),
+    "contextual_association": (
+        "Generate contextual practice exercises as JSON in the form "
+        "{'contextualExercises': [...]} for the following text:\n\n",
+        "contextualExercises",
+        "exercises",
+        "Exercise generation failed",
+    ),
+    "interactive_evaluation": (
+        "Generate quiz questions as JSON in the form "
+        "{'evaluationQuestions': [...]} for the following text:\n\n",
+        "evaluationQuestions",
+        "exercises",
+        "Exercise generation failed",
+    ),
+}
+
+
+def _study_payload(mode: str, result: str):
+    _, key, alias, _ = STUDY_MODE_PROMPTS[mode]
+    try:
+        payload = json.loads(result)
+        if key not in payload and alias in payload:
+            payload = {key: payload.get(alias)}
+        return payload
+    except Exception:
+        return {key: result}
+
+
+def _study_call(mode: str, parts: list):
+    prefix, key, alias, _ = STUDY_MODE_PROMPTS[mode]
+    if len(parts) == 1:
+        return async_ask_llm(prefix + parts[0])
+    return planner.async_run(
+        parts, lambda part: prefix + part, planner.merge_lists(key, alias)
+    )
+
+
+async def _deep_understanding_events(text: str, parts: list):
+    # Parse with spaCy on the NLP pool while the LLM call is in flight
+    loop = asyncio.get_running_loop()
+    pending = {
+        loop.run_in_executor(
+            nlp_executor, concept_map.generate_concept_map, text
+        ): "conceptMap",
+        asyncio.ensure_future(_deep_prompts_call(parts)): "deep_prompts",
+    }
+    try:
+        result = {}
+        while pending:
+            done, _ = await asyncio.wait(
+                set(pending), return_when=asyncio.FIRST_COMPLETED
+            )
+            for fut in done:
+                name = pending.pop(fut)
+                result[name] = fut.result()
+                yield name, result[name]
+        yield "result", {
+            "conceptMap": result["conceptMap"],
+            "deep_prompts": result["deep_prompts"],
+        }
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+async def _study_events(data: StudyRequest, parts: list):
+    if not data.mode or data.mode == "deep_understanding":
+        async for item in _deep_understanding_events(data.text, parts):
+            yield item
+        return
+    if len(parts) > 1:
+        result = await _study_call(data.mode, parts)
+        yield "result", _study_payload(data.mode, result)
+        return
+    prefix = STUDY_MODE_PROMPTS[data.mode][0]
+    parts = []
+    async for token in async_stream_llm(prefix + data.text):
+        parts.append(token)
+        yield "token", {"text": token}
+    yield "result", _study_payload(data.mode, "".join(parts).strip())
+
+
 @app.post('/study-mode', tags=["Study"])
-def study_mode(data: StudyRequest):
+async def study_mode(
+    data: StudyRequest,
+    stream: bool = Query(False),
+    accept: str | None = Header(None),
+):
     """Generate study materials in the requested mode.
 
     Minimal smoke test for deep prompts:
@@ -119,76 +429,145 @@ def study_mode(data: StudyRequest):
       -d '{"text":"short sample"}' | jq '.deep_prompts | length'
     ``
     Should output an integer \u2265 3.
+
+    With ``?stream=1`` the LLM modes emit ``token`` events and the deep
+    understanding bundle emits ``conceptMap``/``deep_prompts`` as each part
+    completes; both end with a ``result`` event. Texts too long for one call
+    are processed chunk by chunk and merged (see ``app.services.planner``).
     """
 
+    deep = not data.mode or data.mode == "deep_understanding"
+    if not deep and data.mode not in STUDY_MODE_PROMPTS:
+        raise HTTPException(status_code=400, detail="Invalid study mode")
+
+    parts = await asyncio.to_thread(planner.plan, data.text)
+    if _wants_stream(stream, accept):
+        return _sse_response(_study_events(data, parts))
+
     # Default behaviour (mode omitted or "deep_understanding"): return the
     # concept map along with reflective prompts.
-    if not data.mode or data.mode == "deep_understanding":
+    if deep:
         try:
-            return {
-                "conceptMap": concept_map.generate_concept_map(data.text),
-                "deep_prompts": make_deep_prompts(data.text),
-            }
+            # Parse with spaCy on the NLP pool while the LLM call is in flight
+            loop = asyncio.get_running_loop()
+            concept, deep_prompts = await asyncio.gather(
+                loop.run_in_executor(
+                    nlp_executor, concept_map.generate_concept_map, data.text
+                ),
+                _deep_prompts_call(parts),
+            )
+            return {"conceptMap": concept, "deep_prompts": deep_prompts}
         except Exception as exc:
             logger.exception("Concept map generation failed: %s", exc)
             raise HTTPException(status_code=500, detail="Internal server error")
 
-    if data.mode == "memorization":
-        prompt = (
-            "Create flashcard question-answer pairs as JSON in the form "
-            "{'flashcards': [{'question': str, 'answer': str}]} for the following text:\n\n"
-            + data.text
-        )
-        try:
-            result = ask_llm(prompt)
-            try:
-                payload = json.loads(result)
-                if "flashcards" not in payload and "cards" in payload:
-                    payload = {"flashcards": payload.get("cards")}
-                return payload
-            except Exception:
-                return {"flashcards": result}
-        except Exception as exc:
-            logger.exception("Flashcard generation failed: %s", exc)
-            raise HTTPException(status_code=500, detail="Internal server error")
+    failure = STUDY_MODE_PROMPTS[data.mode][3]
+    try:
+        result = await _study_call(data.mode, parts)
+        return _study_payload(data.mode, result)
+    except Exception as exc:
+        logger.exception("%s: %s", failure, exc)
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-    if data.mode == "contextual_association":
-        prompt = (
-            "Generate contextual practice exercises as JSON in the form "
-            "{'contextualExercises': [...]} for the following text:\n\n" + data.text
-        )
-        try:
-            result = ask_llm(prompt)
-            try:
-                payload = json.loads(result)
-                if "contextualExercises" not in payload and "exercises" in payload:
-                    payload = {"contextualExercises": payload.get("exercises")}
-                return payload
-            except Exception:
-                return {"contextualExercises": result}
-        except Exception as exc:
-            logger.exception("Exercise generation failed: %s", exc)
-            raise HTTPException(status_code=500, detail="Internal server error")
 
-    if data.mode == "interactive_evaluation":
-        prompt = (
-            "Generate quiz questions as JSON in the form "
-            "{'evaluationQuestions': [...]} for the following text:\n\n" + data.text
-        )
+@app.post('/concept-map/image', tags=["Analysis"])
+async def concept_map_image(
+    data: ConceptMapRequest,
+    if_none_match: str | None = Header(None),
+):
+    """Render a concept map as PNG or SVG.
+
+    Images are cached by graph content and carry an ``ETag``, so a client
+    that already has the image gets ``304 Not Modified``.
+    """
+    if data.concept_map is None and not data.text:
+        raise HTTPException(status_code=400, detail="Send text or concept_map")
+    loop = asyncio.get_running_loop()
+    concept = data.concept_map
+    if concept is None:
         try:
-            result = ask_llm(prompt)
-            try:
-                payload = json.loads(result)
-                if "evaluationQuestions" not in payload and "exercises" in payload:
-                    payload = {"evaluationQuestions": payload.get("exercises")}
-                return payload
-            except Exception:
-                return {"evaluationQuestions": result}
+            concept = await loop.run_in_executor(
+                nlp_executor, concept_map.generate_concept_map, data.text
+            )
         except Exception as exc:
-            logger.exception("Exercise generation failed: %s", exc)
+            logger.exception("Concept map generation failed: %s", exc)
             raise HTTPException(status_code=500, detail="Internal server error")
+    try:
+        key = concept_render.render_key(concept, data.fmt)
+    except (KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid concept map")
+    headers = {"ETag": f'"{key}"', "Cache-Control": "private, max-age=86400"}
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    image, _ = await loop.run_in_executor(
+        nlp_executor, concept_render.render_concept_map, concept, data.fmt
+    )
+    return Response(
+        content=image,
+        media_type=concept_render.RENDER_FORMATS[data.fmt],
+        headers=headers,
+    )
+
+
+@app.get('/concept-map/stats', tags=["Analysis"])
+def get_render_stats():
+    """Return concept map render cache and coalescing counters."""
+    return concept_render.render_stats()
+
+
+@app.get('/llm/stats', tags=["Analysis"])
+def get_llm_stats():
+    """Return LLM cache, coalescing, rate limiter and provider health counters."""
+    return llm_stats()
+
+
+@app.get('/flashcards/due', tags=["Flashcards"])
+def due_flashcards(
+    user_id: str = Query(""),
+    deck_id: str | None = Query(None),
+    limit: int = Query(20, ge=1, le=scheduler.MAX_PAGE_SIZE),
+    cursor: str | None = Query(None),
+):
+    """Return a page of due flashcards, oldest first.
+
+    Pass the returned ``next_cursor`` back as ``cursor`` for the next page.
+    """
+    try:
+        return scheduler.next_due(user_id, deck_id, limit, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Exception as exc:
+        logger.exception("Failed to load due flashcards: %s", exc)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.get('/flashcards/forecast', tags=["Flashcards"])
+def flashcard_forecast(user_id: str = Query(""), deck_id: str | None = Query(None)):
+    """Return how many reviews are due now and tomorrow (by hour, UTC)."""
+    try:
+        return scheduler.review_forecast(user_id, deck_id)
+    except Exception as exc:
+        logger.exception("Failed to build review forecast: %s", exc)
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-    raise HTTPException(status_code=400, detail="Invalid study mode")
+
+# Declared before /review/{card_id} so "batch" is not taken as a card id
+@app.post('/review/batch', tags=["Flashcards"])
+def review_flashcards_batch(data: BatchReviewInput = Body(...)):
+    """Apply a batch of reviews in one write and return per-item results."""
+    if len(data.reviews) > srs.MAX_BATCH_REVIEWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {srs.MAX_BATCH_REVIEWS} reviews per batch",
+        )
+    try:
+        results = srs.update_flashcards_batch(
+            [review.model_dump() for review in data.reviews]
+        )
+        return {"results": results}
+    except Exception as exc:
+        logger.exception("Failed to apply review batch: %s", exc)
+        raise HTTPException(status_code=500, detail="Internal server error")
 
 
 @app.post('/review/{card_id}', tags=["Flashcards"])
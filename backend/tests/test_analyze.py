@@ -1,8 +1,13 @@
+import asyncio
+import contextlib
 import json
 import sys
+import time
 import types
 from pathlib import Path
 
+import pytest
+
 # Create minimal FastAPI stubs so main can be imported without external deps
 fastapi_stub = types.ModuleType("fastapi")
 
@@ -20,6 +25,12 @@ class FastAPI:
             return func
         return decorator
 
+    get = post
+    middleware = post
+
+    def add_middleware(self, *args, **kwargs):
+        pass
+
 class BackgroundTasks:
     pass
 
@@ -29,10 +40,15 @@ fastapi_stub.File = lambda *args, **kwargs: None
 fastapi_stub.Body = lambda *args, **kwargs: None
 fastapi_stub.HTTPException = HTTPException
 fastapi_stub.BackgroundTasks = BackgroundTasks
+fastapi_stub.Request = object
+fastapi_stub.Query = lambda *args, **kwargs: None
+fastapi_stub.Header = lambda *args, **kwargs: None
 sys.modules["fastapi"] = fastapi_stub
 
 responses_stub = types.ModuleType("fastapi.responses")
 responses_stub.FileResponse = object
+responses_stub.StreamingResponse = object
+responses_stub.Response = object
 sys.modules["fastapi.responses"] = responses_stub
 
 # Stub external dependencies used by llm utilities
@@ -56,36 +72,105 @@ app_module = types.ModuleType("app")
 services_module = types.ModuleType("app.services")
 services_module.generator = types.SimpleNamespace()
 services_module.srs = types.SimpleNamespace()
+services_module.scheduler = types.SimpleNamespace(MAX_PAGE_SIZE=200)
 services_module.concept_map = types.SimpleNamespace(generate_concept_map=lambda text: [])
 services_module.exporter = types.SimpleNamespace()
 services_module.tts = types.SimpleNamespace()
+services_module.jobs = types.SimpleNamespace()
+services_module.nlp_pool = types.SimpleNamespace(shutdown=lambda: None)
+services_module.concept_render = types.SimpleNamespace()
+services_module.planner = types.SimpleNamespace(plan=lambda text: [text])
 
 models_module = types.ModuleType("app.models")
 models_module.ReviewInput = object
+models_module.BatchReviewInput = object
 models_module.ExportInput = object
+models_module.ConceptMapRequest = object
 
 utils_module = types.ModuleType("app.utils")
 llm_module = types.ModuleType("app.utils.llm")
+lazy_module = types.ModuleType("app.utils.lazy")
+ingest_module = types.ModuleType("app.utils.ingest")
+ingest_module.BodySizeLimit = object
+lazy_module.start_warm_up = lambda names=None: None
 llm_module.ask_llm = lambda prompt: ""
 llm_module.make_deep_prompts = lambda text: []
+
+
+async def _async_ask_llm(prompt):
+    return ""
+
+
+async def _async_make_deep_prompts(text):
+    return []
+
+
+async def _close_async_clients():
+    pass
+
+
+llm_module.async_ask_llm = _async_ask_llm
+llm_module.async_make_deep_prompts = _async_make_deep_prompts
+llm_module.async_stream_llm = None
+llm_module.close_async_clients = _close_async_clients
+llm_module.llm_cache_bypass = contextlib.nullcontext
+llm_module.llm_stats = lambda: {}
 utils_module.llm = llm_module
+utils_module.lazy = lazy_module
+utils_module.ingest = ingest_module
 
 sys.modules["app"] = app_module
 sys.modules["app.services"] = services_module
 sys.modules["app.services.generator"] = services_module.generator
 sys.modules["app.services.srs"] = services_module.srs
+sys.modules["app.services.scheduler"] = services_module.scheduler
 sys.modules["app.services.concept_map"] = services_module.concept_map
 sys.modules["app.services.exporter"] = services_module.exporter
 sys.modules["app.services.tts"] = services_module.tts
+sys.modules["app.services.jobs"] = services_module.jobs
+sys.modules["app.services.nlp_pool"] = services_module.nlp_pool
+sys.modules["app.services.concept_render"] = services_module.concept_render
+sys.modules["app.services.planner"] = services_module.planner
 sys.modules["app.models"] = models_module
 sys.modules["app.utils"] = utils_module
 sys.modules["app.utils.llm"] = llm_module
+sys.modules["app.utils.lazy"] = lazy_module
+sys.modules["app.utils.ingest"] = ingest_module
 
 # Ensure backend path is on sys.path and import main
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 import main
 
 
+class FakeStreamingResponse:
+    def __init__(self, content, media_type=None, headers=None):
+        self.body_iterator = content
+        self.media_type = media_type
+
+
+def _events(response):
+    async def read():
+        return [chunk async for chunk in response.body_iterator]
+
+    assert response.media_type == "text/event-stream"
+    events = []
+    for message in asyncio.run(read()):
+        event, data = message.strip().split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _token_stream(*tokens, error=None):
+    async def stream(prompt):
+        for token in tokens:
+            await asyncio.sleep(0)
+            yield token
+        if error is not None:
+            raise error
+
+    return stream
+
+
 def test_analyze_text_schema(monkeypatch):
     sample = json.dumps({
         "summary": "Test summary",
@@ -96,11 +181,11 @@ def test_analyze_text_schema(monkeypatch):
         "progress": {"completion": 0.5, "masteryLevel": "medium"}
     })
 
-    def fake_llm(prompt: str) -> str:
+    async def fake_llm(prompt: str) -> str:
         return sample
 
-    monkeypatch.setattr(main, "ask_llm", fake_llm)
-    result = main.analyze_text("content")
+    monkeypatch.setattr(main, "async_ask_llm", fake_llm)
+    result = asyncio.run(main.analyze_text("content"))
 
     assert set(result.keys()) == {
         "summary",
@@ -119,3 +204,137 @@ def test_analyze_text_schema(monkeypatch):
     assert isinstance(result["spaced_repetition"], list)
     assert {"completion", "masteryLevel"} <= set(result["progress"].keys())
     assert isinstance(result["deep_prompts"], list)
+
+
+def test_study_mode_runs_concept_map_and_prompts_concurrently(monkeypatch):
+    def slow_concept_map(text):
+        time.sleep(0.2)
+        return {"nodes": [], "links": []}
+
+    async def slow_prompts(text):
+        await asyncio.sleep(0.2)
+        return [{"prompt": "Why?"}]
+
+    monkeypatch.setattr(main.concept_map, "generate_concept_map", slow_concept_map)
+    monkeypatch.setattr(main, "async_make_deep_prompts", slow_prompts)
+
+    started = time.perf_counter()
+    result = asyncio.run(main.study_mode(main.StudyRequest(text="content")))
+    elapsed = time.perf_counter() - started
+
+    assert result == {
+        "conceptMap": {"nodes": [], "links": []},
+        "deep_prompts": [{"prompt": "Why?"}],
+    }
+    assert elapsed < 0.35
+
+
+def test_concept_map_image_reports_generation_failures(monkeypatch):
+    def broken(text):
+        raise RuntimeError("spaCy model missing")
+
+    monkeypatch.setattr(main.concept_map, "generate_concept_map", broken)
+    request = types.SimpleNamespace(concept_map=None, text="content", fmt="png")
+
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(main.concept_map_image(request, None))
+    assert exc.value.status_code == 500
+
+
+def test_unknown_study_mode_is_rejected_before_streaming(monkeypatch):
+    def streamed(events, **kwargs):
+        raise AssertionError("the response should not start")
+
+    monkeypatch.setattr(main, "StreamingResponse", streamed)
+    request = types.SimpleNamespace(text="content", mode="bogus")
+
+    with pytest.raises(main.HTTPException) as exc:
+        asyncio.run(main.study_mode(request, True, None))
+    assert exc.value.status_code == 400
+
+
+def test_analysis_streams_tokens_then_the_result(monkeypatch):
+    monkeypatch.setattr(main, "StreamingResponse", FakeStreamingResponse)
+    monkeypatch.setattr(main, "async_stream_llm", _token_stream('{"summary": ', '"Short"}'))
+
+    events = _events(asyncio.run(main.analyze_text("content", True, None)))
+
+    assert events[:2] == [("token", {"text": '{"summary": '}), ("token", {"text": '"Short"}'})]
+    event, result = events[2]
+    assert event == "result" and len(events) == 3
+    assert result["summary"] == "Short" and result["deep_prompts"] == []
+
+
+def test_study_mode_streams_when_asked_through_accept(monkeypatch):
+    monkeypatch.setattr(main, "StreamingResponse", FakeStreamingResponse)
+    monkeypatch.setattr(
+        main, "async_stream_llm", _token_stream('{"cards": [', '"q"]}')
+    )
+    request = main.StudyRequest(text="content", mode="memorization")
+
+    events = _events(asyncio.run(main.study_mode(request, None, "text/event-stream")))
+
+    assert [event for event, _ in events] == ["token", "token", "result"]
+    assert events[-1][1] == {"flashcards": ["q"]}
+
+
+def test_failed_stream_ends_with_an_error_event(monkeypatch):
+    monkeypatch.setattr(main, "StreamingResponse", FakeStreamingResponse)
+    monkeypatch.setattr(
+        main, "async_stream_llm", _token_stream("partial", error=RuntimeError("reset"))
+    )
+
+    events = _events(asyncio.run(main.analyze_text("content", True, None)))
+
+    assert events == [
+        ("token", {"text": "partial"}),
+        ("error", {"status": 500, "detail": "Internal server error"}),
+    ]
+
+
+def test_deep_understanding_streams_each_part(monkeypatch):
+    monkeypatch.setattr(main, "StreamingResponse", FakeStreamingResponse)
+    monkeypatch.setattr(
+        main.concept_map, "generate_concept_map", lambda text: {"nodes": []}
+    )
+
+    async def prompts(text):
+        return [{"prompt": "Why?"}]
+
+    monkeypatch.setattr(main, "async_make_deep_prompts", prompts)
+
+    events = _events(asyncio.run(main.study_mode(main.StudyRequest(text="content"), True, None)))
+
+    assert sorted(event for event, _ in events[:2]) == ["conceptMap", "deep_prompts"]
+    assert events[2] == (
+        "result", {"conceptMap": {"nodes": []}, "deep_prompts": [{"prompt": "Why?"}]}
+    )
+
+
+@pytest.mark.parametrize(
+    "headers, bypassed",
+    [
+        ({"x-llm-cache": "BYPASS"}, True),
+        ({"cache-control": "no-cache"}, True),
+        ({"cache-control": "max-age=0"}, False),
+        ({}, False),
+    ],
+)
+def test_cache_headers_bypass_llm_cache_reads(monkeypatch, headers, bypassed):
+    active = []
+
+    @contextlib.contextmanager
+    def bypass():
+        active.append(True)
+        try:
+            yield
+        finally:
+            active.pop()
+
+    async def call_next(request):
+        return bool(active)
+
+    monkeypatch.setattr(main, "llm_cache_bypass", bypass)
+    request = types.SimpleNamespace(headers=headers)
+
+    assert asyncio.run(main.llm_cache_control(request, call_next)) is bypassed
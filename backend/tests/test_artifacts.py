@@ -0,0 +1,82 @@
+import sys
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Other test modules replace ``app`` and ``fastapi`` with stubs; this test
+# needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+if not hasattr(sys.modules.get("fastapi"), "__path__"):
+    for name in [n for n in sys.modules if n == "fastapi" or n.startswith("fastapi.")]:
+        del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import artifacts, generator
+from app.utils import tokens
+
+
+@pytest.fixture
+def course_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(artifacts, "ARTIFACTS_PATH", str(tmp_path / "artifacts.db"))
+    monkeypatch.setattr(artifacts, "_store", None)
+    # One short paragraph per chunk, counted with the length estimate
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    monkeypatch.setattr(generator, "COURSE_CHUNK_TOKENS", 3)
+    tokens.get_tokenizer.cache_clear()
+    prompts = []
+
+    def fake_llm(prompt):
+        prompts.append(prompt)
+        return "summary of " + prompt.rsplit("\n\n", 1)[-1]
+
+    monkeypatch.setattr(generator, "ask_llm", fake_llm)
+    return prompts
+
+
+def _course(text: str):
+    upload = SimpleNamespace(
+        file=BytesIO(text.encode()), filename="notes.txt", content_type="text/plain"
+    )
+    return list(generator.iter_course_events(upload))
+
+
+def test_known_upload_returns_stored_course(course_env):
+    text = "cells\n\nproteins\n\nenzymes"
+    first = _course(text)
+    calls = len(course_env)
+    assert [event for event, _ in first].count("chunk") == 3
+
+    again = _course(text)
+
+    assert again == [("course", first[-1][1])]
+    assert len(course_env) == calls
+
+
+def test_edited_document_only_resummarizes_changed_chunks(course_env):
+    _course("cells\n\nproteins\n\nenzymes")
+    course_env.clear()
+
+    _course("cells\n\nproteins\n\nribosomes")
+
+    summaries = [p for p in course_env if p.startswith("Summarize")]
+    assert summaries == [
+        "Summarize the following part of a course document:\n\nribosomes"
+    ]
+
+
+def test_stored_outputs_are_not_reused_for_another_model(course_env, monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "anthropic")
+    _course("cells\n\nproteins")
+    course_env.clear()
+
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    events = _course("cells\n\nproteins")
+    assert [event for event, _ in events].count("chunk") == 2
+
+    course_env.clear()
+    monkeypatch.setattr(generator, "COURSE_PROMPT_VERSION", "test")
+    _course("cells\n\nproteins")
+    assert len([p for p in course_env if p.startswith("Summarize")]) == 2
@@ -0,0 +1,96 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Other test modules replace ``app`` and the provider SDKs with stubs; drop
+# them so the real modules are imported.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+for package in ("anthropic", "openai"):
+    if package in sys.modules and not hasattr(sys.modules[package], "__path__"):
+        for name in [n for n in sys.modules if n == package or n.startswith(package + ".")]:
+            del sys.modules[name]
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.utils import circuit, llm, tokens
+from app.utils.cache import LRUCache, SQLiteCache, TieredCache
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """A cached LLM layer whose only provider counts its calls."""
+    monkeypatch.setenv("LLM_PROVIDER", "anthropic")
+    monkeypatch.delenv("LLM_FALLBACK_PROVIDER", raising=False)
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    monkeypatch.setattr(circuit, "_breakers", {})
+    monkeypatch.setattr(llm, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "_cache", TieredCache(LRUCache(max_entries=8)))
+    tokens.get_tokenizer.cache_clear()
+    calls = []
+
+    def ask(prompt, max_tokens, temperature):
+        calls.append(prompt)
+        return f"answer {len(calls)}"
+
+    async def async_ask(prompt, max_tokens, temperature):
+        return ask(prompt, max_tokens, temperature)
+
+    monkeypatch.setitem(llm._SYNC_CALLS, "anthropic", ask)
+    monkeypatch.setitem(llm._ASYNC_CALLS, "anthropic", async_ask)
+    yield calls
+    tokens.get_tokenizer.cache_clear()
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["evictions"] == 1
+
+    cache.set("short", "x", ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+
+
+def test_sqlite_tier_bounds_size_and_promotes_hits(tmp_path):
+    disk = SQLiteCache(tmp_path / "cache.db", max_bytes=10)
+    disk.set("old", "xxxxxx")
+    disk.set("new", "yyyyyy")
+    assert disk.get("old") is None
+    assert disk.get("new") == "yyyyyy"
+
+    memory = LRUCache(max_entries=4)
+    tiered = TieredCache(memory, disk)
+    assert tiered.get("new") == "yyyyyy"
+    assert memory.get("new") == "yyyyyy"
+    assert tiered.stats()["disk"]["entries"] == 1
+
+
+def test_cached_answers_skip_the_provider(provider):
+    assert llm.ask_llm("question") == "answer 1"
+    assert llm.ask_llm("question") == "answer 1"
+    assert asyncio.run(llm.async_ask_llm("question")) == "answer 1"
+
+    assert provider == ["question"]
+    assert llm.llm_cache_stats()["memory"]["hits"] == 2
+
+
+def test_bypass_skips_the_read_but_stores_the_answer(provider):
+    assert llm.ask_llm("question") == "answer 1"
+
+    with llm.llm_cache_bypass():
+        assert llm.llm_cache_bypassed()
+        assert llm.ask_llm("question") == "answer 2"
+        assert asyncio.run(llm.async_ask_llm("question")) == "answer 3"
+
+    # The fresh answer replaced the cached one
+    assert llm.ask_llm("question") == "answer 3"
+    assert provider == ["question"] * 3
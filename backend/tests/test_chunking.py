@@ -0,0 +1,125 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Other test modules replace ``app`` and ``fastapi`` with stubs; this test
+# needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+if not hasattr(sys.modules.get("fastapi"), "__path__"):
+    for name in [n for n in sys.modules if n == "fastapi" or n.startswith("fastapi.")]:
+        del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import artifacts, chunking, generator
+from app.utils import tokens
+
+NOTES = """1 Cells
+
+Cells are the basic unit of life. Every organism is made of them.
+
+Cells divide to grow.
+
+1.1 Membranes
+Membranes enclose the cell and control transport.
+
+2 Energy
+
+Mitochondria produce energy for the cell."""
+
+
+@pytest.fixture(autouse=True)
+def length_estimate(monkeypatch, tmp_path):
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    monkeypatch.setattr(artifacts, "ARTIFACTS_PATH", str(tmp_path / "artifacts.db"))
+    monkeypatch.setattr(artifacts, "_store", None)
+    tokens.get_tokenizer.cache_clear()
+    yield
+    tokens.get_tokenizer.cache_clear()
+
+
+def test_plain_text_headings_and_paragraphs():
+    doc = chunking.document_from_text(NOTES)
+
+    assert [(b.level, doc.block_text(b)) for b in doc.headings()] == [
+        (1, "1 Cells"), (2, "1.1 Membranes"), (1, "2 Energy")
+    ]
+    assert doc.block_text(doc.blocks[-1]) == "Mitochondria produce energy for the cell."
+    assert chunking.heading_level("1. Mix the two solutions.") == 0
+
+
+def test_chunks_follow_sections_within_the_budget():
+    doc = chunking.document_from_text(NOTES)
+    index = chunking.chunk_document(doc, max_tokens=30)
+    texts = chunking.chunk_texts(NOTES, index)
+
+    assert [chunk["section"] for chunk in index] == [
+        "1 Cells", "1 Cells > 1.1 Membranes", "2 Energy"
+    ]
+    assert all(chunk["tokens"] <= 30 for chunk in index)
+    assert all(not text.endswith(("Cells", "Membranes", "Energy")) for text in texts)
+    assert texts[-1] == "2 Energy\n\nMitochondria produce energy for the cell."
+
+
+def test_oversize_paragraphs_are_split_at_sentences():
+    text = "Intro\n\n" + " ".join(f"Sentence number {i} is here." for i in range(20))
+    index = chunking.chunk_document(chunking.document_from_text(text), max_tokens=30)
+
+    assert len(index) > 2
+    assert all(chunk["tokens"] <= 30 for chunk in index)
+    assert all(t.endswith(".") for t in chunking.chunk_texts(text, index)[1:])
+
+
+@pytest.mark.parametrize("max_tokens", [4, 8, 12, 16])
+def test_split_paragraphs_are_counted_with_the_document_tokens(max_tokens):
+    # The paragraph does not start on a token boundary of the whole text
+    text = "Notes\n\n" + " ".join(f"Cell {i} divides." for i in range(12))
+    index = chunking.chunk_document(chunking.document_from_text(text), max_tokens)
+
+    assert all(chunk["tokens"] <= max_tokens for chunk in index)
+    # Nothing but whitespace is lost between the pieces
+    kept = "".join(chunking.chunk_texts(text, index))
+    assert kept.replace(" ", "") == text.replace(" ", "").replace("\n", "")
+
+
+def test_pdf_headings_come_from_font_sizes(tmp_path):
+    fitz = pytest.importorskip("fitz")
+    pdf = fitz.open()
+    for number, title in enumerate(["Photosynthesis", "Respiration"], start=1):
+        page = pdf.new_page()
+        page.insert_text((72, 72), title, fontsize=20)
+        for row in range(3):
+            page.insert_text(
+                (72, 120 + 14 * row), f"{title} body line {row} of page {number}.", fontsize=11
+            )
+    path = tmp_path / "notes.pdf"
+    pdf.save(str(path))
+
+    pages = generator.extract_pdf_pages(path)
+    text = "".join(entry["text"] for entry in pages)
+    doc = chunking.document_from_pages(text, pages)
+    index = chunking.chunk_document(doc, max_tokens=40)
+
+    assert [(b.page, doc.block_text(b)) for b in doc.headings()] == [
+        (1, "Photosynthesis"), (2, "Respiration")
+    ]
+    assert [(c["pages"], c["section"]) for c in index] == [
+        ([1, 1], "Photosynthesis"), ([2, 2], "Respiration")
+    ]
+
+
+def test_chunk_index_is_stored(monkeypatch):
+    built = []
+    chunk_document = chunking.chunk_document
+
+    def counting(*args):
+        built.append(args)
+        return chunk_document(*args)
+
+    monkeypatch.setattr(chunking, "chunk_document", counting)
+    first = chunking.chunk_index(NOTES, 40)
+    again = chunking.chunk_index(NOTES, 40)
+
+    assert again == first
+    assert len(built) == 1
@@ -0,0 +1,239 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Other test modules replace ``app``, ``fastapi`` and the provider SDKs with
+# stubs; this test needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+for package in ("fastapi", "anthropic", "openai"):
+    if package in sys.modules and not hasattr(sys.modules[package], "__path__"):
+        for name in [n for n in sys.modules if n == package or n.startswith(package + ".")]:
+            del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+# Import the real SDKs now so that stubs set up by later modules keep them
+import anthropic  # noqa: F401
+import openai
+from app.utils import circuit, llm, tokens
+from app.utils.cache import LRUCache, TieredCache
+from app.utils.circuit import CircuitBreaker
+
+
+def _outage():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://llm.test"))
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "anthropic")
+    monkeypatch.setenv("LLM_FALLBACK_PROVIDER", "openai")
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    monkeypatch.setattr(llm, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(circuit, "_breakers", {})
+    monkeypatch.setattr(circuit, "LLM_BREAKER_FAILURES", 3)
+    tokens.get_tokenizer.cache_clear()
+    calls = []
+
+    async def primary(prompt, max_tokens, temperature):
+        calls.append("anthropic")
+        raise _outage()
+
+    async def fallback(prompt, max_tokens, temperature):
+        calls.append("openai")
+        return "fallback answer"
+
+    monkeypatch.setitem(llm._ASYNC_CALLS, "anthropic", primary)
+    monkeypatch.setitem(llm._ASYNC_CALLS, "openai", fallback)
+    yield calls
+    tokens.get_tokenizer.cache_clear()
+
+
+def test_breaker_opens_and_probes():
+    breaker = CircuitBreaker("p", failures=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == circuit.OPEN and not breaker.allow()
+    time.sleep(0.06)
+    # One probe after the reset period; it fails, so the breaker stays open
+    assert breaker.allow() and breaker.state == circuit.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == circuit.OPEN and not breaker.available()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success(0.2)
+    assert breaker.state == circuit.CLOSED
+    assert breaker.stats()["opened"] == 2 and breaker.stats()["rejected"] == 2
+
+
+def test_latency_percentiles(monkeypatch):
+    monkeypatch.setattr(circuit, "LLM_LATENCY_MIN_SAMPLES", 10)
+    breaker = CircuitBreaker("p")
+    for n in range(1, 20):
+        breaker.record_success(n / 10)
+    assert breaker.percentile(0.95) is not None
+    breaker.record_success(2.0)
+
+    assert breaker.percentile(0.95) == 1.9
+    assert breaker.percentile(0.5) == 1.0
+
+
+def test_failed_calls_move_to_the_fallback_at_once(providers):
+    started = time.monotonic()
+    answers = [asyncio.run(llm.async_ask_llm(f"question {n}")) for n in range(5)]
+
+    assert answers == ["fallback answer"] * 5
+    # No backoff sleeps, and the primary is skipped once its circuit opens
+    assert time.monotonic() - started < 0.5
+    assert providers.count("anthropic") == 3
+    stats = llm.llm_stats()["providers"]
+    assert stats["anthropic"]["state"] == circuit.OPEN
+    assert stats["anthropic"]["rejected"] == 2
+
+
+def test_slow_primary_is_hedged(providers, monkeypatch):
+    async def slow(prompt, max_tokens, temperature):
+        providers.append("anthropic")
+        await asyncio.sleep(1)
+        return "primary answer"
+
+    monkeypatch.setitem(llm._ASYNC_CALLS, "anthropic", slow)
+    monkeypatch.setattr(llm, "LLM_HEDGE", True)
+    monkeypatch.setattr(circuit, "LLM_LATENCY_MIN_SAMPLES", 5)
+    for _ in range(5):
+        circuit.get_breaker("anthropic").record_success(0.05)
+    before = dict(llm._hedge_counts)
+
+    started = time.monotonic()
+    answer = asyncio.run(llm.async_ask_llm("question"))
+
+    assert answer == "fallback answer"
+    assert time.monotonic() - started < 0.5
+    assert providers == ["anthropic", "openai"]
+    assert llm._hedge_counts["fired"] == before["fired"] + 1
+    assert llm._hedge_counts["won"] == before["won"] + 1
+
+
+def test_fast_primary_is_not_hedged(providers, monkeypatch):
+    def primary(prompt, max_tokens, temperature):
+        providers.append("anthropic")
+        return "primary answer"
+
+    monkeypatch.setitem(llm._SYNC_CALLS, "anthropic", primary)
+    monkeypatch.setattr(llm, "LLM_HEDGE", True)
+    monkeypatch.setattr(circuit, "LLM_LATENCY_MIN_SAMPLES", 5)
+    for _ in range(5):
+        circuit.get_breaker("anthropic").record_success(0.5)
+
+    assert llm.ask_llm("question") == "primary answer"
+    assert providers == ["anthropic"]
+
+
+def test_answers_are_cached_under_the_provider_that_gave_them(providers, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "_cache", TieredCache(LRUCache(max_entries=8)))
+
+    assert asyncio.run(llm.async_ask_llm("question")) == "fallback answer"
+    assert asyncio.run(llm.async_ask_llm("question")) == "fallback answer"
+
+    assert providers == ["anthropic", "openai"]
+    key = llm._cache_key("question", llm.LLM_MAX_TOKENS, llm.LLM_TEMPERATURE, "openai")
+    assert llm._cache.get(key) == "fallback answer"
+    primary = llm._cache_key("question", llm.LLM_MAX_TOKENS, llm.LLM_TEMPERATURE, "anthropic")
+    assert llm._cache.get(primary) is None
+
+
+def test_sync_hedge_runs_inline_when_the_pool_is_busy(providers, monkeypatch):
+    threads = []
+
+    def slow(prompt, max_tokens, temperature):
+        threads.append(threading.current_thread())
+        time.sleep(0.3)
+        return "primary answer"
+
+    monkeypatch.setitem(llm._SYNC_CALLS, "anthropic", slow)
+    monkeypatch.setitem(llm._SYNC_CALLS, "openai", lambda *args: "fallback answer")
+    monkeypatch.setattr(llm, "LLM_HEDGE", True)
+    monkeypatch.setattr(circuit, "LLM_LATENCY_MIN_SAMPLES", 5)
+    for _ in range(5):
+        circuit.get_breaker("anthropic").record_success(0.05)
+
+    started = time.monotonic()
+    assert llm.ask_llm("hedged") == "fallback answer"
+    assert time.monotonic() - started < 0.25
+
+    monkeypatch.setattr(llm, "_hedge_slots", threading.BoundedSemaphore(0))
+    assert llm.ask_llm("inline") == "primary answer"
+    assert threads[-1] is threading.current_thread()
+
+
+def test_probe_answered_with_a_rate_limit_closes_the_circuit():
+    breaker = CircuitBreaker("p", failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == circuit.HALF_OPEN
+
+    llm._record_failure(breaker, openai.RateLimitError(
+        "slow down",
+        response=httpx.Response(429, request=httpx.Request("POST", "https://llm.test")),
+        body=None,
+    ))
+
+    assert breaker.state == circuit.CLOSED
+
+
+def _collect(stream):
+    async def read():
+        return [text async for text in stream]
+
+    return asyncio.run(read())
+
+
+def test_stream_falls_back_before_the_first_token(providers, monkeypatch):
+    async def primary(prompt, max_tokens, temperature):
+        providers.append("anthropic")
+        raise _outage()
+        yield
+
+    async def fallback(prompt, max_tokens, temperature):
+        providers.append("openai")
+        for text in ("fallback ", "answer"):
+            yield text
+
+    monkeypatch.setitem(llm._STREAM_CALLS, "anthropic", primary)
+    monkeypatch.setitem(llm._STREAM_CALLS, "openai", fallback)
+    monkeypatch.setattr(llm, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "_cache", TieredCache(LRUCache(max_entries=8)))
+
+    assert _collect(llm.async_stream_llm("question")) == ["fallback ", "answer"]
+    # The whole answer is cached and replayed in one piece
+    assert _collect(llm.async_stream_llm("question")) == ["fallback answer"]
+    assert providers == ["anthropic", "openai"]
+
+
+def test_stream_failure_after_the_first_token_is_raised(providers, monkeypatch):
+    async def primary(prompt, max_tokens, temperature):
+        providers.append("anthropic")
+        yield "partial"
+        raise _outage()
+
+    monkeypatch.setitem(llm._STREAM_CALLS, "anthropic", primary)
+    received = []
+
+    async def read():
+        async for text in llm.async_stream_llm("question"):
+            received.append(text)
+
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(read())
+    assert received == ["partial"]
+    # Sent text can't be taken back, so there is no retry or fallback
+    assert providers == ["anthropic"]
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+
+BACKEND = Path(__file__).resolve().parents[1]
+
+# Modules that must stay out of the API's import path; each is loaded on
+# first use through app.utils.lazy.
+HEAVY_MODULES = [
+    "spacy", "fitz", "pdf2image", "pytesseract", "weasyprint",
+    "gtts", "markdown", "bs4", "openai", "anthropic",
+]
+# Seconds allowed for ``import main`` in a fresh interpreter
+COLD_START_BUDGET = float(os.getenv("COLD_START_BUDGET", "2.5"))
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    import main
+except ModuleNotFoundError as exc:
+    print(json.dumps({"missing": exc.name}))
+    sys.exit(0)
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def test_import_main_stays_lazy_and_fast(tmp_path):
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="test",
+        ANTHROPIC_API_KEY="test",
+        JOBS_DIR=str(tmp_path / "jobs"),
+        SRS_DB_PATH=str(tmp_path / "cards.db"),
+    )
+    env.pop("WARM_UP_SERVICES", None)
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE % (HEAVY_MODULES,)],
+        cwd=BACKEND, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert out.returncode == 0, out.stderr
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    if "missing" in report:
+        pytest.skip(f"backend dependency not installed: {report['missing']}")
+
+    assert report["loaded"] == []
+    assert report["seconds"] < COLD_START_BUDGET
@@ -0,0 +1,93 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Other test modules replace the ``app`` package with stubs.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import concept_map
+from app.services.concept_graph import ConceptGraph, merge_states
+
+
+def _star_graph():
+    graph = ConceptGraph()
+    for leaf in ("dna", "membrane", "ribosome", "nucleus"):
+        graph.add_mention("cell", "Cells")
+        graph.add_mention(leaf, leaf)
+        graph.add_edge("cell", leaf, "contain")
+    graph.add_edge("dna", "protein", "encode")
+    return graph
+
+
+def test_parallel_edges_merge_with_counts_and_top_label():
+    graph = ConceptGraph()
+    graph.add_edge("cell", "dna", "contain")
+    graph.add_edge("cell", "dna", "contain")
+    graph.add_edge("cell", "dna", "hold")
+    graph.add_edge("cell", "cell", "be")
+
+    result = graph.to_dict()
+
+    assert result["links"] == [
+        {"source": "cell", "target": "dna", "label": "contain", "weight": 3}
+    ]
+    assert {node["id"] for node in result["nodes"]} == {"cell", "dna"}
+
+
+def test_hub_ranks_first_and_pruning_keeps_only_kept_links():
+    result = _star_graph().to_dict(max_nodes=3)
+
+    ids = [node["id"] for node in result["nodes"]]
+    assert ids[0] == "cell"
+    assert result["nodes"][0]["label"] == "Cells"
+    assert len(ids) == 3
+    for link in result["links"]:
+        assert link["source"] in ids and link["target"] in ids
+    for node_id, indexes in result["adjacency"].items():
+        for index in indexes:
+            link = result["links"][index]
+            assert node_id in (link["source"], link["target"])
+
+
+def test_pagerank_sums_to_one_and_states_round_trip():
+    graph = _star_graph()
+    rank = graph.pagerank()
+    assert abs(sum(rank.values()) - 1.0) < 1e-6
+
+    halves = [ConceptGraph(), ConceptGraph()]
+    halves[0].add_edge("cell", "dna", "contain")
+    halves[1].add_edge("cell", "dna", "contain")
+    merged = merge_states(h.to_state() for h in halves)
+    assert merged.to_dict()["links"][0]["weight"] == 2
+
+
+def test_extraction_canonicalizes_noun_chunks():
+    spacy = pytest.importorskip("spacy")
+    from spacy.tokens import Doc
+
+    # "The networks connect the nodes and the servers. A network uses protocols."
+    doc = Doc(
+        spacy.blank("en").vocab,
+        words=["The", "networks", "connect", "the", "nodes", "and", "the", "servers", ".",
+               "A", "network", "uses", "protocols", "."],
+        heads=[1, 2, 2, 4, 2, 4, 7, 4, 2, 10, 11, 11, 11, 11],
+        deps=["det", "nsubj", "ROOT", "det", "dobj", "cc", "det", "conj", "punct",
+              "det", "nsubj", "ROOT", "dobj", "punct"],
+        pos=["DET", "NOUN", "VERB", "DET", "NOUN", "CCONJ", "DET", "NOUN", "PUNCT",
+             "DET", "NOUN", "VERB", "NOUN", "PUNCT"],
+        lemmas=["the", "network", "connect", "the", "node", "and", "the", "server", ".",
+                "a", "network", "use", "protocol", "."],
+    )
+
+    result = ConceptGraph.from_state(concept_map._extract(doc)).to_dict()
+
+    assert result["nodes"][0]["id"] == "network"
+    assert result["nodes"][0]["mentions"] == 2
+    assert {(l["source"], l["target"], l["label"]) for l in result["links"]} == {
+        ("network", "node", "connect"),
+        ("network", "server", "connect"),
+        ("network", "protocol", "use"),
+    }
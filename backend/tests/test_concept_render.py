@@ -0,0 +1,66 @@
+import sys
+import subprocess
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Other test modules replace the ``app`` package with stubs.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip("graphviz")
+from fastapi import HTTPException
+
+from app.services import concept_render
+
+MAP = {
+    "nodes": [{"id": "cell", "label": "Cells"}, {"id": "dna"}],
+    "links": [{"source": "cell", "target": "dna", "label": "contain"}],
+}
+
+
+@pytest.fixture
+def fake_graphviz(monkeypatch):
+    calls = []
+
+    def run(cmd, input, **kwargs):
+        calls.append((cmd, input.decode()))
+        return SimpleNamespace(stdout=b"<svg/>" if cmd[1] == "-Tsvg" else b"PNG")
+
+    monkeypatch.setattr(concept_render.subprocess, "run", run)
+    monkeypatch.setattr(concept_render, "_cache", concept_render.TieredCache(
+        concept_render.LRUCache(max_entries=8)
+    ))
+    return calls
+
+
+def test_same_graph_in_any_order_renders_once(fake_graphviz):
+    image, key = concept_render.render_concept_map(MAP, "svg")
+    reordered = {"nodes": MAP["nodes"][::-1], "links": MAP["links"]}
+    again, same_key = concept_render.render_concept_map(reordered, "svg")
+
+    assert image == again == b"<svg/>"
+    assert key == same_key
+    assert len(fake_graphviz) == 1
+    assert fake_graphviz[0][0] == ["dot", "-Tsvg"]
+    assert "Cells" in fake_graphviz[0][1]
+    assert concept_render.render_key(MAP, "png") != key
+    assert concept_render.render_stats()["cache"]["memory"]["hits"] == 1
+
+
+def test_large_maps_use_sfdp(fake_graphviz, monkeypatch):
+    monkeypatch.setattr(concept_render, "RENDER_SFDP_THRESHOLD", 1)
+    concept_render.render_concept_map(MAP, "png")
+    assert fake_graphviz[0][0] == ["sfdp", "-Tpng"]
+
+
+def test_slow_layout_is_cut_off(monkeypatch):
+    def run(cmd, input, timeout, **kwargs):
+        raise subprocess.TimeoutExpired(cmd, timeout)
+
+    monkeypatch.setattr(concept_render.subprocess, "run", run)
+    with pytest.raises(HTTPException) as exc:
+        concept_render.render_concept_map({"nodes": [{"id": "x"}], "links": []})
+    assert exc.value.status_code == 504
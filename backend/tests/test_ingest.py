@@ -0,0 +1,84 @@
+import sys
+import hashlib
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Other test modules replace ``app`` and ``fastapi`` with stubs; this test
+# needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+if not hasattr(sys.modules.get("fastapi"), "__path__"):
+    for name in [n for n in sys.modules if n == "fastapi" or n.startswith("fastapi.")]:
+        del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from app.utils import ingest
+
+
+def _upload(data: bytes, filename: str = "notes.pdf"):
+    return SimpleNamespace(
+        file=BytesIO(data), filename=filename, content_type="application/pdf"
+    )
+
+
+def test_spool_copies_in_chunks_and_hashes(monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_CHUNK_BYTES", 7)
+    data = b"0123456789" * 10
+    with ingest.spool_upload(_upload(data)) as upload:
+        assert upload.path.suffix == ".pdf"
+        assert upload.read_bytes() == data
+        assert upload.size == len(data)
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        path = upload.path
+    assert not path.exists()
+
+
+def test_spool_rejects_oversize_and_removes_partial_file(tmp_path):
+    dest = tmp_path / "upload.pdf"
+    with pytest.raises(HTTPException) as exc:
+        ingest.spool_upload(_upload(b"x" * 100), max_bytes=10, dest=dest)
+    assert exc.value.detail == "File too large"
+    assert not dest.exists()
+
+
+def test_files_already_on_disk_are_hashed_in_place(tmp_path):
+    path = tmp_path / "lecture.mp3"
+    path.write_bytes(b"audio")
+    with open(path, "rb") as fh:
+        upload = ingest.spool_upload(
+            SimpleNamespace(file=fh, filename="lecture.mp3", content_type="audio/mpeg")
+        )
+    assert upload.path == path and not upload.owned
+    upload.cleanup()
+    assert path.exists()
+
+
+def test_body_limit_cuts_off_streamed_uploads():
+    app = FastAPI()
+
+    @app.post("/upload-content")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    app.add_middleware(ingest.BodySizeLimit, paths=["/upload-content"], max_bytes=0)
+    client = TestClient(app)
+    limit = ingest.MULTIPART_OVERHEAD_BYTES
+
+    def chunks():
+        for _ in range(limit // 1000 + 2):
+            yield b"x" * 1000
+
+    streamed = client.post("/upload-content", content=chunks())
+    assert streamed.status_code == 400
+    assert streamed.json() == {"detail": "File too large"}
+
+    declared = client.post("/upload-content", content=b"x" * (limit + 1))
+    assert declared.status_code == 400
+
+    assert client.post("/upload-content", content=b"x" * 10).json() == {"size": 10}
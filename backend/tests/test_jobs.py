@@ -0,0 +1,121 @@
+import sqlite3
+import sys
+import time
+import types
+from io import BytesIO
+from pathlib import Path
+
+# Other test modules replace the ``app`` package with stubs; drop them so the
+# real job queue is imported, with a stand-in for the heavy generator module.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+
+
+def _course_events(upload):
+    text = upload.file.read().decode()
+    yield "chunk", {"index": 1, "total": 2, "summary": "b"}
+    yield "chunk", {"index": 0, "total": 2, "summary": "a"}
+    yield "course", {"course": text.upper()}
+
+
+generator_stub = types.SimpleNamespace(
+    iter_course_events=_course_events,
+    transcribe_audio=lambda f: "audio text",
+    transcribe_video=lambda f: "video text",
+)
+sys.modules["app.services.generator"] = generator_stub
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.services import jobs
+
+del sys.modules["app.services.generator"]
+
+
+class DummyUpload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.content_type = "text/plain"
+        self.file = BytesIO(data)
+
+
+def _wait(queue, job_id):
+    for _ in range(100):
+        job = queue.get(job_id)
+        if job["status"] in (jobs.DONE, jobs.FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("job did not finish")
+
+
+def test_jobs_run_in_background_and_persist(tmp_path):
+    queue = jobs.JobQueue(root=tmp_path, workers=2)
+    course_id = queue.submit("course", DummyUpload("notes.txt", b"hello"))
+    audio_id = queue.submit("audio", DummyUpload("talk.mp3", b"..."))
+    assert queue.get(course_id)["status"] == jobs.QUEUED
+
+    queue.start()
+    try:
+        course = _wait(queue, course_id)
+        audio = _wait(queue, audio_id)
+    finally:
+        queue.stop()
+
+    assert course["result"] == {"course": "HELLO"}
+    assert course["progress"] == 1.0
+    assert audio["result"] == {"text": "audio text"}
+    assert list((tmp_path / "uploads").iterdir()) == []
+
+    reopened = jobs.JobQueue(root=tmp_path, workers=1)
+    assert reopened.get(course_id)["status"] == jobs.DONE
+    assert reopened.get("missing") is None
+
+
+def test_only_jobs_with_expired_leases_are_recovered(tmp_path):
+    live = jobs.JobQueue(root=tmp_path, workers=1)
+    job_id = live.submit("audio", DummyUpload("talk.mp3", b"..."))
+    assert live._claim()["id"] == job_id
+
+    # Another process starting on the same database leaves the job alone
+    other = jobs.JobQueue(root=tmp_path, workers=1)
+    assert other._recover() == 0
+    assert other.get(job_id)["status"] == jobs.RUNNING
+
+    # Once the owner stops renewing its lease the job is run again
+    live._update(job_id, lease=time.time() - 1)
+    other.start()
+    try:
+        job = _wait(other, job_id)
+    finally:
+        other.stop()
+
+    assert job["result"] == {"text": "audio text"}
+    assert other._threads == []
+
+
+def test_workers_survive_database_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_SECONDS", 0.01)
+    queue = jobs.JobQueue(root=tmp_path, workers=1)
+    job_id = queue.submit("audio", DummyUpload("talk.mp3", b"..."))
+    claim, update = queue._claim, queue._update
+    failures = {"claim": 2, "update": 2}
+
+    def flaky(name, call):
+        def wrapper(*args, **kwargs):
+            if failures[name]:
+                failures[name] -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return call(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(queue, "_claim", flaky("claim", claim))
+    monkeypatch.setattr(queue, "_update", flaky("update", update))
+    queue.start()
+    try:
+        job = _wait(queue, job_id)
+    finally:
+        queue.stop()
+
+    assert job["result"] == {"text": "audio text"}
+    assert failures == {"claim": 0, "update": 0}
+    assert list((tmp_path / "uploads").iterdir()) == []
@@ -0,0 +1,55 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Other test modules replace the ``app`` package with stubs; drop them so the
+# real utility module is imported.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.utils.mapreduce import map_ordered, map_reduce
+
+
+def test_map_ordered_keeps_order_and_bounds_concurrency():
+    lock = threading.Lock()
+    in_flight = 0
+    peak = 0
+
+    def work(i):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.01 * (5 - i % 5))
+        with lock:
+            in_flight -= 1
+        return i * 2
+
+    result = map_ordered(work, range(10), max_workers=3)
+
+    assert result == [i * 2 for i in range(10)]
+    assert 1 < peak <= 3
+
+
+def test_map_reduce_merges_hierarchically_when_over_budget():
+    merges = []
+
+    def merge(text):
+        merges.append(text)
+        return "m"
+
+    result = map_reduce(
+        ["a", "b", "c", "d"],
+        lambda chunk: chunk * 4,
+        lambda text: "final:" + text,
+        merge_fn=merge,
+        max_tokens=8,
+        count_tokens=len,
+        separator="|",
+    )
+
+    # Groups are merged on worker threads, in any order
+    assert sorted(merges) == ["aaaa|bbbb", "cccc|dddd"]
+    assert result == "final:m|m"
@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+
+# Other test modules replace the ``app`` package with stubs.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import concept_map, nlp_pool
+from app.services.concept_graph import ConceptGraph
+
+
+def test_split_segments_keeps_sentences_whole():
+    sentence = "Cells divide by mitosis."
+    text = "\n\n".join(" ".join([sentence] * 5) for _ in range(20))
+    segments = nlp_pool.split_segments(text, max_chars=300)
+    assert len(segments) > 1
+    assert all(len(s) <= 300 for s in segments)
+    rebuilt = " ".join(" ".join(s.split()) for s in segments)
+    assert rebuilt == " ".join(text.split())
+    for segment in segments:
+        assert segment.endswith(".")
+
+
+def test_short_text_is_one_segment():
+    assert nlp_pool.split_segments("Short text.", max_chars=100) == ["Short text."]
+
+
+def _fake_extract(text):
+    # One "subject verb object." triple per sentence
+    graph = ConceptGraph()
+    for sentence in text.split("."):
+        words = sentence.split()
+        if len(words) == 3:
+            graph.add_mention(words[0], words[0])
+            graph.add_mention(words[2], words[2])
+            graph.add_edge(words[0], words[2], words[1])
+    return graph.to_state()
+
+
+class _FakeNLP:
+    def pipe(self, texts, **kwargs):
+        return iter(texts)
+
+
+def test_segmented_map_matches_whole_text(monkeypatch):
+    monkeypatch.setattr(nlp_pool, "_nlp", _FakeNLP())
+    monkeypatch.setattr(nlp_pool, "NLP_PROCESSES", 0)
+    monkeypatch.setattr(concept_map, "_extract", _fake_extract)
+    text = " ".join(f"cell{i % 7} makes protein{i % 5}." for i in range(200))
+    whole = ConceptGraph.from_state(_fake_extract(text)).to_dict(max_nodes=None)
+
+    split = nlp_pool.split_segments
+    monkeypatch.setattr(nlp_pool, "split_segments", lambda t: split(t, max_chars=120))
+    segmented = concept_map.generate_concept_map(text, max_nodes=None)
+
+    assert segmented == whole
+    assert sum(link["weight"] for link in segmented["links"]) == 200
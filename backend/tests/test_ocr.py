@@ -0,0 +1,104 @@
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Other test modules replace ``app`` and ``fastapi`` with stubs; this test
+# needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+if not hasattr(sys.modules.get("fastapi"), "__path__"):
+    for name in [n for n in sys.modules if n == "fastapi" or n.startswith("fastapi.")]:
+        del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import generator
+
+PAGES = 7
+
+
+class Pool:
+    """Runs each task on its own thread, after a random delay, and tracks
+    how many results have been submitted but not collected yet."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    def submit(self, fn, *args):
+        pool = self
+
+        class Tracked(Future):
+            collected = False
+
+            def result(self, timeout=None):
+                with pool.lock:
+                    if not self.collected:
+                        self.collected = True
+                        pool.outstanding -= 1
+                return super().result(timeout)
+
+        future = Tracked()
+        with self.lock:
+            self.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding, self.outstanding)
+
+        def run():
+            time.sleep(random.uniform(0, 0.01))
+            future.set_result(fn(*args))
+
+        threading.Thread(target=run).start()
+        return future
+
+
+@pytest.fixture
+def ocr(monkeypatch):
+    calls = []
+
+    def convert(source):
+        def render(data, dpi, first_page, last_page, grayscale):
+            calls.append((source, first_page, last_page))
+            return list(range(first_page, last_page + 1))
+
+        return render
+
+    monkeypatch.setattr(generator, "pdf2image", SimpleNamespace(
+        pdfinfo_from_path=lambda path: {"Pages": PAGES},
+        pdfinfo_from_bytes=lambda data: {"Pages": PAGES},
+        convert_from_path=convert("path"),
+        convert_from_bytes=convert("bytes"),
+    ))
+    monkeypatch.setattr(generator, "pytesseract", SimpleNamespace(
+        image_to_string=lambda image, lang: f"[{image}]"
+    ))
+    monkeypatch.setattr(generator, "OCR_BATCH_PAGES", 2)
+    monkeypatch.setattr(generator, "OCR_WORKERS", 1)
+    pool = Pool()
+    monkeypatch.setattr(generator, "_get_ocr_pool", lambda: pool)
+    return SimpleNamespace(calls=calls, pool=pool)
+
+
+@pytest.mark.parametrize("source", ["bytes", "path"])
+def test_pages_are_ocrd_in_order_in_batches(ocr, tmp_path, source):
+    pdf = b"%PDF-1.4" if source == "bytes" else tmp_path / "scan.pdf"
+
+    text = generator.extract_text_with_ocr(pdf)
+
+    assert text == "".join(f"[{page}]" for page in range(1, PAGES + 1))
+    assert ocr.calls == [(source, 1, 2), (source, 3, 4), (source, 5, 6), (source, 7, 7)]
+
+
+def test_pending_pages_are_bounded(ocr):
+    generator.extract_text_with_ocr(b"%PDF-1.4")
+
+    # At most max_pending pages wait, plus the batch just rendered
+    max_pending = max(generator.OCR_BATCH_PAGES, 2 * generator.OCR_WORKERS)
+    assert ocr.pool.max_outstanding <= max_pending + generator.OCR_BATCH_PAGES
+    assert ocr.pool.max_outstanding < PAGES
+    assert ocr.pool.outstanding == 0
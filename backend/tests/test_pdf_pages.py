@@ -0,0 +1,67 @@
+import sys
+from concurrent.futures import Future
+from pathlib import Path
+
+import pytest
+
+# Other test modules replace ``app`` and ``fastapi`` with stubs; this test
+# needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+if not hasattr(sys.modules.get("fastapi"), "__path__"):
+    for name in [n for n in sys.modules if n == "fastapi" or n.startswith("fastapi.")]:
+        del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import generator
+
+fitz = pytest.importorskip("fitz")
+
+BODY = "Photosynthesis turns light, water and carbon dioxide into sugar."
+
+
+class Pool:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, png):
+        self.submitted.append(png)
+        future = Future()
+        future.set_result(("Scanned page text.", 0.25))
+        return future
+
+
+def _pdf(path):
+    pdf = fitz.open()
+    pdf.new_page().insert_text((72, 72), BODY, fontsize=11)
+    scan = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 40, 40), False)
+    scan.clear_with(200)
+    pdf.new_page().insert_image(fitz.Rect(72, 72, 272, 272), pixmap=scan)
+    pdf.save(str(path))
+
+
+@pytest.mark.parametrize("source", ["path", "bytes"])
+def test_only_scanned_pages_are_ocrd(monkeypatch, tmp_path, source):
+    pool = Pool()
+    monkeypatch.setattr(generator, "_get_ocr_pool", lambda: pool)
+    path = tmp_path / "mixed.pdf"
+    _pdf(path)
+
+    pages = generator.extract_pdf_pages(path if source == "path" else path.read_bytes())
+
+    text_page, scanned = pages
+    assert text_page["page"] == 1 and text_page["method"] == "text"
+    assert text_page["text"] == BODY + "\n"
+    assert text_page["chars"] == len(BODY) + 1
+    assert text_page["blocks"] == [{"start": 0, "end": len(BODY) + 1, "size": 11.0}]
+    assert scanned == {
+        "page": 2,
+        "method": "ocr",
+        "text": "Scanned page text.",
+        "chars": len("Scanned page text."),
+        "blocks": None,
+        "seconds": scanned["seconds"],
+    }
+    assert scanned["seconds"] >= 0.25
+    # Only the image-only page is rendered and sent to OCR
+    assert len(pool.submitted) == 1 and pool.submitted[0].startswith(b"\x89PNG")
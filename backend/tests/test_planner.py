@@ -0,0 +1,99 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Other test modules replace ``app`` and ``fastapi`` with stubs; this test
+# needs the real ones.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+if not hasattr(sys.modules.get("fastapi"), "__path__"):
+    for name in [n for n in sys.modules if n == "fastapi" or n.startswith("fastapi.")]:
+        del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import artifacts, planner
+from app.utils import tokens
+
+BOOK = "\n\n".join(
+    f"Chapter {n}\n\n" + " ".join(f"Fact {n}.{i} about topic {n}." for i in range(12))
+    for n in range(1, 7)
+)
+
+
+@pytest.fixture
+def prompts(monkeypatch, tmp_path):
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    monkeypatch.setattr(artifacts, "ARTIFACTS_PATH", str(tmp_path / "artifacts.db"))
+    monkeypatch.setattr(artifacts, "_store", None)
+    monkeypatch.setattr(planner, "LLM_MAX_INPUT_TOKENS", 200)
+    monkeypatch.setattr(planner, "PLANNER_CHUNK_TOKENS", 120)
+    tokens.get_tokenizer.cache_clear()
+    sent = []
+
+    async def fake_llm(prompt):
+        sent.append(prompt)
+        if prompt.startswith("Merge"):
+            return "merged summary"
+        chapter = prompt.split("Chapter ", 1)[1].split()[0]
+        return json.dumps({
+            "summary": f"summary {chapter}",
+            "flashcards": [
+                {"question": f"What is topic {chapter}?"},
+                {"question": "What is a fact?"},
+            ],
+        })
+
+    monkeypatch.setattr(planner, "async_ask_llm", fake_llm)
+    yield sent
+    tokens.get_tokenizer.cache_clear()
+
+
+def test_short_texts_are_sent_whole(prompts):
+    assert planner.plan("A short note.") == ["A short note."]
+
+
+def test_long_texts_are_covered_chunk_by_chunk(prompts):
+    parts = planner.plan(BOOK)
+    result = asyncio.run(
+        planner.async_run(parts, lambda part: "Cards:\n" + part, planner.merge_lists("flashcards"))
+    )
+
+    assert len(parts) > 1 and len(prompts) == len(parts)
+    # Nothing is truncated: every chapter reaches the model
+    assert all(f"Fact {n}.11 " in "".join(prompts) for n in range(1, 7))
+    questions = [card["question"] for card in json.loads(result)["flashcards"]]
+    assert questions[:2] == ["What is topic 1?", "What is topic 2?"]
+    assert questions.count("What is a fact?") == 1
+
+
+def test_analysis_answers_are_merged(prompts):
+    parts = planner.plan(BOOK)
+    partials = [asyncio.run(planner.async_ask_llm(part)) for part in parts]
+    merged = json.loads(asyncio.run(planner.async_merge_analysis(partials)))
+
+    assert merged["summary"] == "merged summary"
+    assert prompts[-1].startswith("Merge") and "summary 6" in prompts[-1]
+    assert len(merged["flashcards"]) == 7
+
+
+def test_interleave_keeps_every_part_represented():
+    lists = [[f"a{i}" for i in range(5)], ["b0", "b1"], ["c0"]]
+
+    assert planner.interleave(lists, limit=4) == ["a0", "b0", "c0", "a1"]
+
+
+def test_fenced_answers_are_merged_and_bad_ones_reported(caplog):
+    merge = planner.merge_lists("flashcards")
+    partials = [
+        '```json\n{"flashcards": [{"question": "Q1"}]}\n```',
+        '```\n{"flashcards": [{"question": "Q2"}]}```',
+        "Sorry, I cannot help with that.",
+    ]
+
+    merged = json.loads(asyncio.run(merge(partials)))
+
+    assert merged == {"flashcards": [{"question": "Q1"}, {"question": "Q2"}]}
+    assert "not JSON" in caplog.text
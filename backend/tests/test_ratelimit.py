@@ -0,0 +1,152 @@
+import asyncio
+import sqlite3
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+# Other test modules replace the ``app`` package with stubs; drop them so the
+# real utility module is imported.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.utils import ratelimit
+from app.utils.ratelimit import MemoryState, RateLimiter, SQLiteState
+
+
+def test_requests_are_spaced_to_the_rpm():
+    # 1200 rpm: a burst of a minute's worth, then one every 50ms
+    limiter = RateLimiter("p:m", rpm=1200)
+    for _ in range(1200):
+        limiter.acquire()
+    # Use up whatever refilled during the burst
+    while limiter.acquire() < 0.01:
+        pass
+
+    started = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+
+    assert 0.12 <= time.monotonic() - started < 0.5
+    stats = limiter.stats()
+    assert stats["acquired"] > 1203 and stats["waited"] >= 4
+
+
+def test_token_budget_holds_back_large_calls():
+    limiter = RateLimiter("p:m", tpm=6000)
+    limiter.acquire(6000)
+
+    started = time.monotonic()
+    limiter.acquire(10)
+
+    # 10 tokens refill at 100 tokens per second
+    assert 0.05 <= time.monotonic() - started < 0.5
+
+
+def test_callers_are_served_in_arrival_order():
+    limiter = RateLimiter("p:m", rpm=600)
+    for _ in range(600):
+        limiter.acquire()
+    order = []
+
+    def call(n):
+        limiter.acquire()
+        order.append(n)
+
+    threads = []
+    for n in range(4):
+        threads.append(threading.Thread(target=call, args=(n,)))
+        threads[-1].start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    assert order == [0, 1, 2, 3]
+    assert limiter.stats()["max_queued"] >= 3
+
+
+def test_coroutines_share_the_queue():
+    limiter = RateLimiter("p:m", rpm=1200)
+
+    async def main():
+        await asyncio.gather(*(limiter.async_acquire() for _ in range(1202)))
+
+    started = time.monotonic()
+    asyncio.run(main())
+
+    assert time.monotonic() - started >= 0.08
+    assert limiter.stats()["queued"] == 0
+
+
+def test_throttle_pauses_every_caller():
+    limiter = RateLimiter("p:m", state=MemoryState())
+    limiter.throttle(0.1)
+
+    started = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - started >= 0.08
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_retry_after_headers():
+    def error(headers):
+        return types.SimpleNamespace(response=types.SimpleNamespace(headers=headers))
+
+    assert ratelimit.retry_after(error({"retry-after": "7"})) == 7.0
+    assert ratelimit.retry_after(error({"retry-after-ms": "250"})) == 0.25
+    assert ratelimit.retry_after(error({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert ratelimit.retry_after(error({})) is None
+    assert ratelimit.retry_after(ValueError()) is None
+
+
+def test_sqlite_state_is_shared_between_limiters(tmp_path):
+    path = tmp_path / "limits.db"
+    first = RateLimiter("p:m", rpm=60, state=SQLiteState(path))
+    second = RateLimiter("p:m", rpm=60, state=SQLiteState(path))
+
+    # Both limiters draw from one 60-request bucket
+    for _ in range(30):
+        first.acquire()
+        second.acquire()
+    assert SQLiteState(path).take("p:m", [("requests", 60, 1)], time.time()) > 0
+
+    second.throttle(5)
+    assert first.stats()["paused_seconds"] > 4
+
+
+def test_limits_come_from_overrides(monkeypatch):
+    monkeypatch.setattr(ratelimit, "LLM_RPM", 100)
+    monkeypatch.setattr(
+        ratelimit, "LLM_RATE_LIMITS", {"openai": {"tpm": 5000}, "openai:mini": {"rpm": 9}}
+    )
+
+    assert ratelimit.limits_for("openai", "mini") == (9, 0)
+    assert ratelimit.limits_for("openai", "large") == (100, 5000)
+    assert ratelimit.limits_for("anthropic", "claude") == (100, 0)
+
+
+def test_sqlite_state_does_not_block_the_event_loop(tmp_path):
+    path = tmp_path / "limits.db"
+    limiter = RateLimiter("p:m", rpm=60, state=SQLiteState(path))
+    # Another process holds the write lock for a while
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.2, lambda: holder.execute("COMMIT")).start()
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while not acquired.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        acquired = asyncio.ensure_future(limiter.async_acquire())
+        await asyncio.gather(acquired, tick())
+        return ticks
+
+    assert asyncio.run(main()) >= 10
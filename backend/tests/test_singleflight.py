@@ -0,0 +1,91 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Other test modules replace the ``app`` package with stubs; drop them so the
+# real utility module is imported.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.utils.singleflight import SingleFlight
+
+
+def test_threaded_callers_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+        for _ in range(4)
+    ]
+    for t in followers:
+        t.start()
+    for t in [leader, *followers]:
+        t.join()
+
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_async_callers_share_result_and_errors():
+    flight = SingleFlight()
+    calls = []
+
+    async def slow(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "boom":
+            raise ValueError(value)
+        return value
+
+    async def run():
+        ok = await asyncio.gather(*(flight.ado("a", slow, "x") for _ in range(3)))
+        failed = await asyncio.gather(
+            *(flight.ado("b", slow, "boom") for _ in range(2)),
+            return_exceptions=True,
+        )
+        return ok, failed
+
+    ok, failed = asyncio.run(run())
+
+    assert ok == ["x", "x", "x"]
+    assert all(isinstance(exc, ValueError) for exc in failed)
+    assert calls == ["x", "boom"]
+    assert flight.coalesced == 3
+
+
+def test_cancelled_follower_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        leader = asyncio.ensure_future(flight.ado("k", slow))
+        await asyncio.sleep(0)
+        quitter = asyncio.ensure_future(flight.ado("k", slow))
+        follower = asyncio.ensure_future(flight.ado("k", slow))
+        await asyncio.sleep(0.01)
+        quitter.cancel()
+        return await asyncio.gather(leader, follower, quitter, return_exceptions=True)
+
+    leader, follower, quitter = asyncio.run(run())
+
+    assert leader == follower == "answer"
+    assert isinstance(quitter, asyncio.CancelledError)
@@ -0,0 +1,133 @@
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Other test modules replace the ``app`` package with stubs; drop them so the
+# real service module is imported.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from app.services import scheduler, srs
+
+
+def _use_tmp_deck(monkeypatch, tmp_path, legacy_cards):
+    legacy = tmp_path / "srs_cards.json"
+    legacy.write_text(json.dumps(legacy_cards))
+    monkeypatch.setattr(srs, "DATA_FILE", legacy)
+    monkeypatch.setattr(srs, "DB_FILE", tmp_path / "srs_cards.db")
+    monkeypatch.setattr(srs, "_local", threading.local())
+    monkeypatch.setattr(srs, "_schema_ready", False)
+
+
+def test_legacy_json_is_migrated_once(monkeypatch, tmp_path):
+    legacy = [{
+        "id": "old",
+        "front": "f",
+        "back": "b",
+        "interval": 4,
+        "next_review": "2000-01-01T00:00:00",
+        "difficulty": 1,
+    }]
+    _use_tmp_deck(monkeypatch, tmp_path, legacy)
+
+    due = srs.get_due_flashcards()
+
+    assert [c["id"] for c in due] == ["old"]
+    assert due[0]["interval"] == 4
+    assert srs.migrate_json(srs.DATA_FILE) == 0
+
+
+def test_callers_wait_for_the_first_run_migration(monkeypatch, tmp_path):
+    legacy = [{"id": "old", "front": "f", "back": "b", "next_review": "2000-01-01T00:00:00"}]
+    _use_tmp_deck(monkeypatch, tmp_path, legacy)
+    migrate_json = srs.migrate_json
+    started = threading.Event()
+
+    def slow_migration(*args):
+        started.set()
+        time.sleep(0.1)
+        return migrate_json(*args)
+
+    monkeypatch.setattr(srs, "migrate_json", slow_migration)
+    results = {}
+    first = threading.Thread(target=lambda: results.update(first=srs.get_due_flashcards()))
+    first.start()
+    started.wait()
+    results["second"] = srs.get_due_flashcards()
+    first.join()
+
+    assert [c["id"] for c in results["first"]] == ["old"]
+    assert [c["id"] for c in results["second"]] == ["old"]
+
+
+def test_add_review_and_due_cards(monkeypatch, tmp_path):
+    _use_tmp_deck(monkeypatch, tmp_path, [])
+
+    added = srs.add_flashcards([{"front": "q1", "back": "a1"}, {"front": "q2", "back": "a2"}])
+    assert {c["id"] for c in srs.get_due_flashcards()} == {c["id"] for c in added}
+
+    updated = srs.update_flashcard(added[0]["id"], "easy")
+
+    assert updated["interval"] == 2
+    assert updated["difficulty"] == 0
+    assert [c["id"] for c in srs.get_due_flashcards()] == [added[1]["id"]]
+    assert srs.update_flashcard("missing", "easy") is None
+
+
+def test_due_cards_are_paged_per_deck_with_a_cursor(monkeypatch, tmp_path):
+    _use_tmp_deck(monkeypatch, tmp_path, [])
+    cards = [{"front": f"q{i}", "back": "a"} for i in range(5)]
+    spanish = srs.add_flashcards(cards, user_id="u1", deck_id="es")
+    srs.add_flashcards(cards[:2], user_id="u1", deck_id="fr")
+    srs.add_flashcards(cards, user_id="u2", deck_id="es")
+
+    first = scheduler.next_due("u1", "es", limit=3)
+    second = scheduler.next_due("u1", "es", limit=3, cursor=first["next_cursor"])
+
+    paged = [c["id"] for c in first["cards"] + second["cards"]]
+    assert sorted(paged) == sorted(c["id"] for c in spanish)
+    assert second["next_cursor"] is None
+    assert len(scheduler.next_due("u1", limit=200)["cards"]) == 7
+
+
+def test_forecast_counts_tomorrows_reviews(monkeypatch, tmp_path):
+    tomorrow_noon = datetime.combine(
+        datetime.utcnow().date() + timedelta(days=1), datetime.min.time()
+    ) + timedelta(hours=12)
+    legacy = [
+        {"id": "due", "user_id": "u1", "front": "f", "back": "b",
+         "next_review": "2000-01-01T00:00:00"},
+        {"id": "later", "user_id": "u1", "front": "f", "back": "b",
+         "next_review": tomorrow_noon.isoformat()},
+    ]
+    _use_tmp_deck(monkeypatch, tmp_path, legacy)
+
+    forecast = scheduler.review_forecast("u1")
+
+    assert forecast["due_now"] == 1
+    assert forecast["tomorrow"]["total"] == 1
+    assert forecast["tomorrow"]["by_hour"][12] == 1
+
+
+def test_batch_review_replays_in_time_order(monkeypatch, tmp_path):
+    _use_tmp_deck(monkeypatch, tmp_path, [])
+    card = srs.add_flashcards([{"front": "q", "back": "a"}])[0]
+    first = datetime(2024, 5, 1, 9, 0)
+    second = first + timedelta(days=1)
+
+    results = srs.update_flashcards_batch([
+        {"card_id": card["id"], "feedback": "easy", "reviewed_at": second},
+        {"card_id": "missing", "feedback": "easy", "reviewed_at": None},
+        {"card_id": card["id"], "feedback": "easy", "reviewed_at": first},
+    ])
+
+    assert [r["status"] for r in results] == ["updated", "not_found", "updated"]
+    assert results[2]["card"]["interval"] == 2
+    assert results[0]["card"]["interval"] == 4
+    assert results[0]["card"]["next_review"] == srs.to_iso(second + timedelta(days=4))
+    stored = scheduler.next_due(limit=5, now=second + timedelta(days=5))["cards"]
+    assert stored[0]["interval"] == 4
@@ -0,0 +1,122 @@
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Other test modules replace the ``app`` package with stubs.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.utils import tokens
+
+
+class WordEncoding:
+    """Stands in for a tiktoken encoding: one token per word and its leading space."""
+
+    name = "words"
+
+    def __init__(self):
+        self.pieces = []
+        self.encodes = 0
+
+    def encode(self, text, disallowed_special=None):
+        self.encodes += 1
+        ids = []
+        for piece in re.findall(r"\s*\S+|\s+", text):
+            self.pieces.append(piece)
+            ids.append(len(self.pieces) - 1)
+        return ids
+
+    def decode_with_offsets(self, ids):
+        offsets, text = [], ""
+        for i in ids:
+            offsets.append(len(text))
+            text += self.pieces[i]
+        return text, offsets
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    encoding = WordEncoding()
+    monkeypatch.setattr(
+        tokens, "tiktoken", SimpleNamespace(encoding_for_model=lambda model: encoding)
+    )
+    tokens.get_tokenizer.cache_clear()
+    yield encoding
+    tokens.get_tokenizer.cache_clear()
+
+
+def _paragraph(n):
+    return " ".join(f"Sentence {n}.{i} has five words." for i in range(4))
+
+
+def test_chunks_end_at_paragraphs_and_respect_the_budget(encoding):
+    text = "\n\n".join(_paragraph(n) for n in range(10))
+    chunks = tokens.split_into_chunks(text, max_tokens=45, overlap=0, model="m")
+
+    assert encoding.encodes == 1
+    assert chunks == ["\n\n".join(_paragraph(n) for n in (i, i + 1)) for i in range(0, 10, 2)]
+    assert all(tokens.count_tokens(c, "m") <= 45 for c in chunks)
+
+
+def test_long_paragraphs_are_cut_at_sentences_with_overlap(encoding):
+    text = _paragraph(0) + " " + _paragraph(1)
+    chunks = tokens.split_into_chunks(text, max_tokens=22, overlap=6, model="m")
+
+    assert chunks[0] == "Sentence 0.0 has five words. Sentence 0.1 has five words. " \
+        "Sentence 0.2 has five words. Sentence 0.3 has five words."
+    # The overlap starts at a sentence, not mid-way through one
+    assert chunks[1].startswith("Sentence 0.3 has five words. Sentence 1.0")
+    assert chunks[-1].endswith("Sentence 1.3 has five words.")
+    assert all(tokens.count_tokens(c, "m") <= 22 for c in chunks)
+
+
+def test_truncate_encodes_once(encoding):
+    assert tokens.truncate_to_tokens("one two three four", 2, model="m") == "one two"
+    assert encoding.encodes == 1
+
+
+def test_unloadable_encodings_fall_back_to_estimates(monkeypatch):
+    def offline(name):
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(
+        tokens,
+        "tiktoken",
+        SimpleNamespace(encoding_for_model=offline, get_encoding=offline),
+    )
+    tokens.get_tokenizer.cache_clear()
+    try:
+        assert tokens.count_tokens("x" * 40, "m") == 10
+        assert tokens.get_tokenizer("m") is tokens.get_tokenizer("m")
+        chunks = tokens.split_into_chunks("word " * 100, max_tokens=20, model="m")
+        assert len(chunks) > 1 and all(len(c) <= 80 for c in chunks)
+    finally:
+        tokens.get_tokenizer.cache_clear()
+
+
+def test_tokenizers_must_implement_encode_and_offsets():
+    class Incomplete(tokens.Tokenizer):
+        def encode(self, text):
+            return []
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_spans_cover_the_whole_text(monkeypatch):
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    tokens.get_tokenizer.cache_clear()
+    text = "\tbeta.\té1. Intro to cells."
+    try:
+        for max_tokens in (2, 3, 5):
+            spans = tokens.split_spans(text, max_tokens, overlap=0)
+            assert "".join(text[a:b] for a, b in spans) == text
+        # One token per chunk would drop text after a mid-token cut
+        with pytest.raises(ValueError):
+            tokens.split_spans(text, 1, overlap=0)
+    finally:
+        tokens.get_tokenizer.cache_clear()
@@ -0,0 +1,158 @@
+import sys
+import time
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Other test modules replace the ``app`` package with stubs.
+for name in [n for n in sys.modules if n == "app" or n.startswith("app.")]:
+    del sys.modules[name]
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import transcription
+from app.services.transcription import Segment, StubBackend
+
+
+def _fake_extract(src, segment, workdir):
+    return f"{workdir}/segment-{segment.index}.mp3"
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_plan_cuts_at_silences_within_the_limit():
+    silences = [(100.0, 102.0), (250.0, 251.0), (280.0, 282.0), (700.0, 701.0)]
+    segments = transcription.plan_segments(900.0, silences, max_seconds=300, min_seconds=30)
+
+    assert [(s.start, s.end) for s in segments] == [
+        (0.0, 281.0), (281.0, 581.0), (581.0, 700.5), (700.5, 900.0)
+    ]
+    assert all(s.duration <= 300 for s in segments)
+
+
+def test_failed_segments_are_retried_alone(monkeypatch, tmp_path):
+    monkeypatch.setattr(transcription.time, "sleep", lambda seconds: None)
+    failures = {"segment-2.mp3": 2}
+
+    def text_for(path):
+        name = Path(path).name
+        if failures.get(name):
+            failures[name] -= 1
+            raise StatusError(429)
+        return f"part {name[8]}"
+
+    backend = StubBackend(text_for)
+    segments = [Segment(i, i * 10.0, (i + 1) * 10.0) for i in range(4)]
+    done = transcription.transcribe_segments(
+        "talk.mp3", segments, backend, str(tmp_path), extract=_fake_extract
+    )
+    result = transcription.stitch(done)
+
+    assert result["text"] == "part 0 part 1 part 2 part 3"
+    assert result["segments"][2] == {"index": 2, "start": 20.0, "end": 30.0, "text": "part 2"}
+    assert sorted(Path(p).name for p in backend.calls).count("segment-2.mp3") == 3
+    assert len(backend.calls) == 6
+
+
+def test_segments_give_up_after_the_last_attempt(monkeypatch, tmp_path):
+    monkeypatch.setattr(transcription.time, "sleep", lambda seconds: None)
+
+    def text_for(path):
+        raise ConnectionRefusedError("Connection refused")
+
+    backend = StubBackend(text_for)
+    with pytest.raises(ConnectionRefusedError):
+        transcription.transcribe_segments(
+            "talk.mp3", [Segment(0, 0, 10)], backend, str(tmp_path),
+            extract=_fake_extract,
+        )
+    assert len(backend.calls) == transcription.TRANSCRIBE_ATTEMPTS
+
+
+@pytest.mark.parametrize("error", [StatusError(401), StatusError(400), FileNotFoundError("ffmpeg")])
+def test_permanent_errors_are_not_retried(monkeypatch, tmp_path, error):
+    sleeps = []
+    monkeypatch.setattr(transcription.time, "sleep", sleeps.append)
+
+    def text_for(path):
+        raise error
+
+    backend = StubBackend(text_for)
+    with pytest.raises(type(error)):
+        transcription.transcribe_segments(
+            "talk.mp3", [Segment(0, 0, 10)], backend, str(tmp_path),
+            extract=_fake_extract,
+        )
+    assert len(backend.calls) == 1 and sleeps == []
+
+
+def test_concurrency_is_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(transcription, "TRANSCRIBE_CONCURRENCY", 2)
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def text_for(path):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.02)
+        with lock:
+            active -= 1
+        return "x"
+
+    segments = [Segment(i, i, i + 1) for i in range(6)]
+    transcription.transcribe_segments(
+        "talk.mp3", segments, StubBackend(text_for), str(tmp_path), extract=_fake_extract
+    )
+    assert peak == 2
+
+
+def test_short_files_are_sent_whole(monkeypatch, tmp_path):
+    audio = tmp_path / "note.mp3"
+    audio.write_bytes(b"ID3")
+    monkeypatch.setattr(transcription, "probe_duration", lambda path: 42.0)
+    backend = StubBackend()
+
+    result = transcription.transcribe_file(audio, backend)
+
+    assert backend.calls == [str(audio)]
+    assert result["text"] == "transcript of note.mp3"
+    assert result["segments"][0]["end"] == 42.0
+
+
+def test_local_backend_loads_the_model_once(monkeypatch):
+    loads = []
+
+    class FakeWhisperModel:
+        def __init__(self, model, **options):
+            loads.append((model, options))
+
+        def transcribe(self, path, **options):
+            segments = (SimpleNamespace(text=f" {word}") for word in ("hello", "world"))
+            return segments, SimpleNamespace(language="en")
+
+    monkeypatch.setitem(
+        sys.modules, "faster_whisper", SimpleNamespace(WhisperModel=FakeWhisperModel)
+    )
+    backend = transcription.LocalWhisperBackend(model="tiny", cpu_threads=2)
+
+    assert backend.transcribe("a.wav") == "hello world"
+    assert backend.transcribe("b.wav") == "hello world"
+    assert loads == [
+        ("tiny", {"device": "cpu", "compute_type": "int8", "cpu_threads": 2, "num_workers": 1})
+    ]
+    assert backend.describe() == "local:tiny:int8"
+
+
+def test_backends_must_implement_transcribe():
+    class Incomplete(transcription.TranscriptionBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -1,3 +1,5 @@
+import contextlib
+import json
 import sys
 import types
 from pathlib import Path
@@ -21,6 +23,12 @@ class FastAPI:
             return func
         return decorator
 
+    get = post
+    middleware = post
+
+    def add_middleware(self, *args, **kwargs):
+        pass
+
 class BackgroundTasks:
     pass
 
@@ -30,10 +38,15 @@ fastapi_stub.File = lambda *args, **kwargs: None
 fastapi_stub.Body = lambda *args, **kwargs: None
 fastapi_stub.HTTPException = HTTPException
 fastapi_stub.BackgroundTasks = BackgroundTasks
+fastapi_stub.Request = object
+fastapi_stub.Query = lambda *args, **kwargs: None
+fastapi_stub.Header = lambda *args, **kwargs: None
 sys.modules["fastapi"] = fastapi_stub
 
 responses_stub = types.ModuleType("fastapi.responses")
 responses_stub.FileResponse = object
+responses_stub.StreamingResponse = object
+responses_stub.Response = object
 sys.modules["fastapi.responses"] = responses_stub
 
 # Stub external dependencies used by llm utilities
@@ -63,30 +76,70 @@ generator_stub = types.SimpleNamespace(
 )
 services_module.generator = generator_stub
 services_module.srs = types.SimpleNamespace()
+services_module.scheduler = types.SimpleNamespace(MAX_PAGE_SIZE=200)
 services_module.concept_map = types.SimpleNamespace(generate_concept_map=lambda text: [])
 services_module.exporter = types.SimpleNamespace()
 services_module.tts = types.SimpleNamespace()
+services_module.jobs = types.SimpleNamespace()
+services_module.nlp_pool = types.SimpleNamespace(shutdown=lambda: None)
+services_module.concept_render = types.SimpleNamespace()
+services_module.planner = types.SimpleNamespace(plan=lambda text: [text])
 
 models_module = types.ModuleType("app.models")
 models_module.ReviewInput = object
+models_module.BatchReviewInput = object
 models_module.ExportInput = object
+models_module.ConceptMapRequest = object
 
 utils_module = types.ModuleType("app.utils")
 llm_module = types.ModuleType("app.utils.llm")
+lazy_module = types.ModuleType("app.utils.lazy")
+ingest_module = types.ModuleType("app.utils.ingest")
+ingest_module.BodySizeLimit = object
+lazy_module.start_warm_up = lambda names=None: None
 llm_module.ask_llm = lambda prompt: ""
 llm_module.make_deep_prompts = lambda text: []
+
+
+async def _async_ask_llm(prompt):
+    return ""
+
+
+async def _async_make_deep_prompts(text):
+    return []
+
+
+async def _close_async_clients():
+    pass
+
+
+llm_module.async_ask_llm = _async_ask_llm
+llm_module.async_make_deep_prompts = _async_make_deep_prompts
+llm_module.async_stream_llm = None
+llm_module.close_async_clients = _close_async_clients
+llm_module.llm_cache_bypass = contextlib.nullcontext
+llm_module.llm_stats = lambda: {}
 utils_module.llm = llm_module
+utils_module.lazy = lazy_module
+utils_module.ingest = ingest_module
 
 sys.modules["app"] = app_module
 sys.modules["app.services"] = services_module
 sys.modules["app.services.generator"] = generator_stub
 sys.modules["app.services.srs"] = services_module.srs
+sys.modules["app.services.scheduler"] = services_module.scheduler
 sys.modules["app.services.concept_map"] = services_module.concept_map
 sys.modules["app.services.exporter"] = services_module.exporter
 sys.modules["app.services.tts"] = services_module.tts
+sys.modules["app.services.jobs"] = services_module.jobs
+sys.modules["app.services.nlp_pool"] = services_module.nlp_pool
+sys.modules["app.services.concept_render"] = services_module.concept_render
+sys.modules["app.services.planner"] = services_module.planner
 sys.modules["app.models"] = models_module
 sys.modules["app.utils"] = utils_module
 sys.modules["app.utils.llm"] = llm_module
+sys.modules["app.utils.lazy"] = lazy_module
+sys.modules["app.utils.ingest"] = ingest_module
 
 # Ensure backend path is on sys.path and import main
 sys.path.append(str(Path(__file__).resolve().parents[1]))
@@ -95,6 +148,22 @@ import main as main_module
 main = importlib.reload(main_module)
 
 
+class FakeStreamingResponse:
+    def __init__(self, content, media_type=None, headers=None):
+        self.body_iterator = content
+
+
+def _events(response):
+    async def read():
+        return [chunk async for chunk in response.body_iterator]
+
+    events = []
+    for message in asyncio.run(read()):
+        event, data = message.strip().split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
 class DummyUpload:
     def __init__(self, content_type: str):
         self.filename = "file"
@@ -112,3 +181,39 @@ def test_upload_video_returns_text():
     upload = DummyUpload("video/mp4")
     result = asyncio.run(main.upload_content(upload))
     assert result == {"text": "video text"}
+
+
+def test_upload_document_streams_chunks_then_the_course(monkeypatch):
+    def course_events(file):
+        yield "chunk", {"index": 1, "summary": "second"}
+        yield "chunk", {"index": 0, "summary": "first"}
+        yield "course", {"course": "done"}
+
+    monkeypatch.setattr(main, "StreamingResponse", FakeStreamingResponse)
+    monkeypatch.setattr(main.generator, "iter_course_events", course_events, raising=False)
+
+    response = asyncio.run(main.upload_content(DummyUpload("application/pdf"), True, None))
+
+    assert _events(response) == [
+        ("chunk", {"index": 1, "summary": "second"}),
+        ("chunk", {"index": 0, "summary": "first"}),
+        ("course", {"course": "done"}),
+    ]
+
+
+def test_failed_course_stream_ends_with_an_error_event(monkeypatch):
+    def course_events(file):
+        yield "chunk", {"index": 0, "summary": "first"}
+        raise main.HTTPException(status_code=503, detail="LLM unavailable")
+
+    monkeypatch.setattr(main, "StreamingResponse", FakeStreamingResponse)
+    monkeypatch.setattr(main.generator, "iter_course_events", course_events, raising=False)
+
+    response = asyncio.run(
+        main.upload_content(DummyUpload("text/plain"), None, "text/event-stream")
+    )
+
+    assert _events(response) == [
+        ("chunk", {"index": 0, "summary": "first"}),
+        ("error", {"status": 503, "detail": "LLM unavailable"}),
+    ]